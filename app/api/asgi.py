@@ -0,0 +1,329 @@
+"""ASGI application serving the cafe routes of the API with coroutines on an async SQLAlchemy session.
+
+A waiting client or query no longer holds a worker thread, so one process handles many concurrent
+connections. Every other route is passed to the Flask app through asgiref's WSGI adapter. The coroutine
+views share the Flask request context, error handlers, hooks, rate limit counters and response cache.
+"""
+from asgiref.wsgi import WsgiToAsgi
+from flask import request, jsonify, g
+from functools import wraps
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from werkzeug.exceptions import HTTPException
+from app.main import create_app, db, limiter, cache, metrics
+from app.main.cache import conditional
+from app.main.database import REPLICA_BIND, engine_options, configure_sqlite
+from app.main.models import Cafe
+from app.main.search import search_index
+from app.main.storage import delete_blobs
+from . import routes
+from .auth import auth_cache
+from .routes import (CAFE_COLUMNS, verify_request_token, admin_error, listing_query, listing_response, cafe_query,
+                     cafe_response, cafe_payload, cafe_not_found, cafe_conflict, save_new_cafe, save_cafe_changes,
+                     delete_saved_cafe)
+import asyncio
+import io
+import sys
+
+# Database backend -> asyncio driver used by the async engine
+ASYNC_DRIVERS = {
+    'sqlite': 'sqlite+aiosqlite',
+    'postgresql': 'postgresql+asyncpg',
+    'mysql': 'mysql+aiomysql',
+}
+
+
+def async_engine(app, engine):
+    """Creates an async engine for the same database and with the same options as a Flask-SQLAlchemy engine."""
+    backend = engine.url.get_backend_name()
+    if backend not in ASYNC_DRIVERS:
+        raise ValueError(f"No asyncio driver is configured for '{backend}' databases.")
+    new_engine = create_async_engine(engine.url.set(drivername=ASYNC_DRIVERS[backend]), **engine_options(app.config))
+    if app.config['DATABASE_PROFILE'] == 'sqlite' and backend == 'sqlite':
+        configure_sqlite(new_engine.sync_engine, app.config)
+    if app.config['METRICS_ENABLED']:
+        metrics.instrument_engine(new_engine.sync_engine)
+    return new_engine
+
+
+async def run_sync(func, *args):
+    """Runs code using db.session on the request's AsyncSession, without blocking the event loop."""
+    return await g.async_session.run_sync(lambda session: func(*args))
+
+
+def token_required(func):
+    """Coroutine version of routes.token_required."""
+    @wraps(func)
+    async def decorated_function(*args, **kwargs):
+        user_id, error = verify_request_token()
+        if error:
+            return error
+
+        principal = await run_sync(auth_cache.principal, user_id)
+        if not principal:
+            return jsonify({'message': 'User not found!'}), 401
+        g.principal = principal
+        return await func(*args, **kwargs)
+    return decorated_function
+
+
+def admin_required(func):
+    """Coroutine version of routes.admin_required."""
+    @wraps(func)
+    async def wrapper(*args, **kwargs):
+        error = admin_error()
+        if error:
+            return error
+        return await func(*args, **kwargs)
+    return wrapper
+
+
+def rate_limited(func):
+    """Applies the limits declared on the WSGI view of the same endpoint, to the same counters."""
+    @wraps(func)
+    async def wrapper(*args, **kwargs):
+        await asyncio.to_thread(limiter.check)   # The counters may be a SQLite file or a remote store
+        return await func(*args, **kwargs)
+    return wrapper
+
+
+async def catalog_validators():
+    """Coroutine version of routes.catalog_validators."""
+    return await run_sync(routes.catalog_validators)
+
+
+async def cafe_validators(cafe_id):
+    """Coroutine version of routes.cafe_validators. Also reads the catalog version the cached response is keyed on."""
+    def validators():
+        Cafe.catalog_version()
+        return routes.cafe_validators(cafe_id)
+    return await run_sync(validators)
+
+
+@token_required
+@rate_limited
+@conditional(catalog_validators)
+@cache.cached()
+async def get_all_cafes():
+    """Fetches a list of cafes, optionally filtered, sorted and paginated."""
+    try:
+        statement, page = listing_query(db.select(*CAFE_COLUMNS))
+    except ValueError as err:
+        return jsonify({'message': str(err)}), 400
+    rows = (await g.async_session.execute(statement)).all()
+    return listing_response(rows, page)
+
+
+@token_required
+@rate_limited
+@conditional(cafe_validators)
+@cache.cached()
+async def get_cafe(cafe_id):
+    """Retrieves information about a specific cafe by ID."""
+    row = (await g.async_session.execute(cafe_query(cafe_id))).first()
+    if not row:
+        return cafe_not_found()
+    return cafe_response(row)
+
+
+@token_required
+@rate_limited
+async def add_cafe():
+    """Adds a new cafe to the database."""
+    data, error = cafe_payload()
+    if error:
+        return error
+
+    session = g.async_session
+    existing_cafe = (await session.scalars(db.select(Cafe).filter_by(name=data['name']).limit(1))).first()
+    if existing_cafe:
+        return cafe_conflict(existing_cafe.name)
+
+    new_cafe = await run_sync(save_new_cafe, data)
+    await session.commit()
+    cafe = await run_sync(new_cafe.to_dict)   # Reloads the committed row, like the WSGI view
+    search_index.add(new_cafe)
+    cache.invalidate()
+
+    return jsonify({"message": "Cafe added successfully!", "cafe": cafe}), 201
+
+
+@token_required
+@admin_required
+async def update_cafe(cafe_id):
+    """Updates an existing cafe in the database."""
+    session = g.async_session
+    cafe = await session.get(Cafe, cafe_id)
+    if not cafe:
+        return cafe_not_found()
+
+    data, error = cafe_payload(partial=True)
+    if error:
+        return error
+
+    orphans = await run_sync(save_cafe_changes, cafe, data)
+    await session.commit()
+    if orphans:
+        await asyncio.to_thread(delete_blobs, orphans)
+    cafe_dict = await run_sync(cafe.to_dict)
+    search_index.update(cafe)
+    cache.invalidate()
+    return jsonify({"message": f"{cafe.name} updated successfully!", "cafe": cafe_dict})
+
+
+@token_required
+@admin_required
+async def delete_cafe(cafe_id):
+    """Deletes a cafe from the database."""
+    session = g.async_session
+    cafe = await session.get(Cafe, cafe_id)
+    if not cafe:
+        return cafe_not_found()
+    orphans = await run_sync(delete_saved_cafe, cafe)
+    await session.commit()
+    if orphans:
+        await asyncio.to_thread(delete_blobs, orphans)
+    search_index.remove(cafe_id)
+    cache.invalidate()
+    return jsonify({"message": f"{cafe.name} deleted successfully!"}), 200
+
+
+# Flask endpoint -> coroutine view serving it
+ASYNC_VIEWS = {
+    'api.get_all_cafes': get_all_cafes,
+    'api.get_cafe': get_cafe,
+    'api.add_cafe': add_cafe,
+    'api.update_cafe': update_cafe,
+    'api.delete_cafe': delete_cafe,
+}
+
+
+async def read_body(receive, max_length=None):
+    """Reads the body of an ASGI request. Stops after max_length bytes, which Flask then rejects with a 413."""
+    chunks = []
+    size = 0
+    while True:
+        message = await receive()
+        chunk = message.get('body', b'')
+        chunks.append(chunk)
+        size += len(chunk)
+        if not message.get('more_body') or (max_length and size > max_length):
+            return b''.join(chunks)
+
+
+def wsgi_environ(scope, body):
+    """Builds the WSGI environ of an ASGI HTTP request, so Flask can build its request object from it."""
+    script_name = scope.get('root_path', '').encode('utf8').decode('latin1')
+    path_info = scope['path'].encode('utf8').decode('latin1')
+    if path_info.startswith(script_name):
+        path_info = path_info[len(script_name):]
+    server_name, server_port = scope.get('server') or ('localhost', 80)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': script_name,
+        'PATH_INFO': path_info,
+        'QUERY_STRING': scope['query_string'].decode('ascii'),
+        'SERVER_NAME': server_name,
+        'SERVER_PORT': str(server_port),
+        'SERVER_PROTOCOL': f"HTTP/{scope['http_version']}",
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.input_terminated': True,   # The whole body has been read, even without a Content-Length
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': False,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    if scope.get('client'):
+        environ['REMOTE_ADDR'] = scope['client'][0]
+    for name, value in scope['headers']:
+        name = name.decode('latin1').upper().replace('-', '_')
+        if name not in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+            name = f'HTTP_{name}'
+        value = value.decode('latin1')
+        environ[name] = f'{environ[name]},{value}' if name in environ else value
+    return environ
+
+
+class AsyncApi:
+    """ASGI application running the ASYNC_VIEWS as coroutines and every other route through WSGI."""
+
+    def __init__(self, app):
+        self.app = app
+        self.wsgi = WsgiToAsgi(app)
+        self.urls = app.url_map.bind('localhost')
+        with app.app_context():
+            engines = app.extensions['sqlalchemy'].engines
+            self.engine = async_engine(app, engines[None])
+            self.read_engine = async_engine(app, engines[REPLICA_BIND]) if REPLICA_BIND in engines else self.engine
+        self.sessions = async_sessionmaker(self.engine)
+        self.read_sessions = async_sessionmaker(self.read_engine)   # GET requests read from the replica
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+        elif scope['type'] == 'http' and (view := self.match(scope)):
+            await self.handle(view, scope, receive, send)
+        else:
+            await self.wsgi(scope, receive, send)
+
+    def match(self, scope):
+        """Returns the coroutine view for a request, or None if the Flask app serves it."""
+        try:
+            endpoint, _ = self.urls.match(scope['path'], scope['method'])
+        except HTTPException:   # Not found, method not allowed or a redirect: Flask answers those
+            return None
+        return ASYNC_VIEWS.get(endpoint)
+
+    async def handle(self, view, scope, receive, send):
+        environ = wsgi_environ(scope, await read_body(receive, self.app.config['MAX_CONTENT_LENGTH']))
+        ctx = self.app.request_context(environ)
+        error = None
+        ctx.push()
+        try:
+            sessions = self.read_sessions if request.method in ('GET', 'HEAD') else self.sessions
+            async with sessions() as session:
+                # db.session is this session's sync side for the request, so model and stats helpers
+                # shared with the WSGI views run unchanged inside run_sync
+                db.session.registry.set(session.sync_session)
+                g.async_session = session
+                try:
+                    response = await self.dispatch(view)
+                except Exception as e:
+                    error = e
+                    response = self.app.handle_exception(e)
+            headers = response.get_wsgi_headers(environ)
+            body = b''.join(response.get_app_iter(environ))   # Empty for HEAD requests and 304s
+        finally:
+            ctx.pop(error)
+
+        await send({'type': 'http.response.start', 'status': response.status_code,
+                    'headers': [(name.lower().encode('latin1'), value.encode('latin1')) for name, value in headers]})
+        await send({'type': 'http.response.body', 'body': body})
+
+    async def dispatch(self, view):
+        """Runs the request hooks and the coroutine view like Flask.full_dispatch_request."""
+        try:
+            rv = self.app.preprocess_request()
+            if rv is None:
+                rv = await view(**request.view_args)
+        except Exception as e:
+            rv = self.app.handle_user_exception(e)
+        return self.app.finalize_request(rv)
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await self.engine.dispose()
+                if self.read_engine is not self.engine:
+                    await self.read_engine.dispose()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+
+def create_asgi_app(app=None):
+    """Returns the ASGI application of a Flask app, by default a new one from create_app."""
+    return AsyncApi(app or create_app())
@@ -0,0 +1,79 @@
+from collections import namedtuple
+from datetime import datetime, timedelta
+from sqlalchemy import event
+from app.main.cache import MemoryCache
+from app.main.models import db, User
+from config import Config
+import jwt
+import time
+
+
+# What the API needs to know about the caller, resolved once per token instead of once per request
+Principal = namedtuple('Principal', ['id', 'is_admin'])
+
+
+def generate_token(user_id):
+    """Generates a JWT token with an expiration time of 1 hour."""
+    expiration = datetime.utcnow() + timedelta(hours=1)
+    token = jwt.encode({
+        'user_id': user_id,
+        'exp': expiration
+    }, Config.API_KEY, algorithm="HS256")
+    return token
+
+
+class AuthCache:
+    """Caches verified tokens and the principals they resolve to.
+
+    Tokens are keyed by their signature and kept until they expire, so a repeated token skips
+    jwt.decode. Principals are kept for a short time and dropped whenever a user row changes,
+    so authenticated requests normally resolve without a database query.
+    """
+
+    def __init__(self):
+        self.tokens = MemoryCache(1000)
+        self.principals = MemoryCache(1000)
+        self.principal_timeout = 60
+
+    def init_app(self, app):
+        self.tokens = MemoryCache(app.config.get('AUTH_CACHE_SIZE', 1000))
+        self.principals = MemoryCache(app.config.get('AUTH_CACHE_SIZE', 1000))
+        self.principal_timeout = app.config.get('AUTH_PRINCIPAL_TTL', 60)
+
+    def verify(self, token, key):
+        """Returns the user id of a valid token. Raises jwt.InvalidTokenError like jwt.decode."""
+        signing_input, _, signature = token.rpartition('.')
+        entry = self.tokens.get(signature)
+        if entry is not None:
+            cached_input, user_id, expires_at = entry
+            if cached_input == signing_input and time.time() < expires_at:
+                return user_id
+
+        data = jwt.decode(token, key, algorithms=["HS256"])
+        expires_at = data.get('exp', time.time() + self.principal_timeout)
+        self.tokens.set(signature, (signing_input, data['user_id'], expires_at), expires_at - time.time())
+        return data['user_id']
+
+    def principal(self, user_id):
+        """Returns the principal of a user, or None if the user doesn't exist."""
+        principal = self.principals.get(user_id)
+        if principal is None:
+            user = db.session.get(User, user_id)
+            if not user:
+                return None
+            principal = Principal(user.id, bool(user.is_admin))
+            self.principals.set(user_id, principal, self.principal_timeout)
+        return principal
+
+    def invalidate_principals(self):
+        """Drops every cached principal, e.g. after a user's role changed."""
+        self.principals.clear()
+
+
+auth_cache = AuthCache()
+
+
+@event.listens_for(User, 'after_update')
+@event.listens_for(User, 'after_delete')
+def user_changed(mapper, connection, target):
+    auth_cache.invalidate_principals()
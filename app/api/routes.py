@@ -1,59 +1,337 @@
-from flask import request, jsonify
-from flask_login import current_user, login_user
+from flask import request, jsonify, current_app, Response, stream_with_context, g
 from marshmallow import ValidationError
-from app.api.schemas import CafeSchema
+from app.api.schemas import load_cafe, load_cafes
 from functools import wraps
 from app.main.models import User, Cafe, db
-from app.main.routes import generate_token
-from app.main import limiter
+from app.main.database import nocase
+from app.main.search import search_index
+from app.main.pagination import decode_cursor, keyset_query, page_rows
+from app.main.geo import location_fields
+from app.main.pricing import price_fields
+from app.main.stats import STATS_COLUMNS, stats_entry, update_stats, stats_summary
+from app.main.storage import retain_images, release_images, delete_blobs
+from app.main import limiter, cache
+from app.main.cache import conditional, normalized_args
+from app.main.serialization import RowEncoder, json_response
+from .auth import auth_cache, generate_token
 from config import Config
 from . import api
+from datetime import datetime
+import csv
+import hashlib
+import io
 import jwt
 
-def token_required(func):
-    """Decorator that ensures a valid token is present in the request headers."""
-    @wraps(func)
-    def decorated_function(*args, **kwargs):
-        token = None
 
-        if 'Authorization' in request.headers:
-            try:
-                token = request.headers['Authorization'].split(" ")[1]
-            except IndexError:
-                return jsonify({'message': 'Token format is invalid!'}), 400
-        if not token:
-            return jsonify({'message': 'Token is missing!'}), 401
+MAX_PAGE_SIZE = 100
+MAX_BULK_SIZE = 1000
+EXPORT_BATCH_SIZE = 500
+DEFAULT_NEARBY_RADIUS_KM = 10
+MAX_NEARBY_RADIUS_KM = 500
+DEFAULT_NEARBY_COUNT = 10
+
+SORT_KEYS = {
+    'id': Cafe.id,
+    'name': Cafe.name,
+    'city': Cafe.city,
+    'country': Cafe.country,
+    'full_rating': Cafe.full_rating,
+    'seats': Cafe.seats,
+}
 
+# Cafe reads select these columns as plain rows and encode them without building ORM objects
+CAFE_COLUMNS = list(Cafe.__table__.columns)
+cafe_json = RowEncoder(CAFE_COLUMNS)
+cafe_ndjson = RowEncoder(CAFE_COLUMNS, separators=(', ', ': '))   # Export lines, as written by json.dumps
+
+BOOLEAN_VALUES = {'true': True, '1': True, 'yes': True, 'false': False, '0': False, 'no': False}
+
+
+def parse_int_arg(name, min_value=None, max_value=None):
+    """Parses an optional integer query argument. Raises ValueError if it is out of range."""
+    value = request.args.get(name)
+    if value is None:
+        return None
+    try:
+        value = int(value)
+    except ValueError:
+        raise ValueError(f"'{name}' must be an integer.")
+    if (min_value is not None and value < min_value) or (max_value is not None and value > max_value):
+        raise ValueError(f"'{name}' must be between {min_value} and {max_value}.")
+    return value
+
+
+def parse_float_arg(name, min_value, max_value):
+    """Parses an optional number query argument. Raises ValueError if it is out of range."""
+    value = request.args.get(name)
+    if value is None:
+        return None
+    try:
+        value = float(value)
+    except ValueError:
+        raise ValueError(f"'{name}' must be a number.")
+    if not min_value <= value <= max_value:
+        raise ValueError(f"'{name}' must be between {min_value} and {max_value}.")
+    return value
+
+
+def parse_bool_arg(name):
+    """Parses an optional boolean query argument. Raises ValueError if it is not a boolean."""
+    value = request.args.get(name)
+    if value is None:
+        return None
+    if value.lower() not in BOOLEAN_VALUES:
+        raise ValueError(f"'{name}' must be true or false.")
+    return BOOLEAN_VALUES[value.lower()]
+
+
+def filter_cafes(query):
+    """Applies the listing filters from the query string to a Cafe query."""
+    city = request.args.get('city')
+    country = request.args.get('country')
+    min_rating = parse_int_arg('min_rating', 1, 5)
+    min_wifi = parse_int_arg('min_wifi', 0, 5)
+    has_sockets = parse_bool_arg('has_sockets')
+    has_toilet = parse_bool_arg('has_toilet')
+
+    if city:
+        query = query.filter(nocase(Cafe.city) == nocase(city))
+    if country:
+        query = query.filter(nocase(Cafe.country) == nocase(country))
+    if min_rating is not None:
+        query = query.filter(Cafe.full_rating >= min_rating)
+    if min_wifi is not None:
+        query = query.filter(Cafe.wifi_strength >= min_wifi)
+    if has_sockets is not None:
+        query = query.filter(Cafe.has_sockets == has_sockets)
+    if has_toilet is not None:
+        query = query.filter(Cafe.has_toilet == has_toilet)
+    return query
+
+
+def listing_query(query):
+    """Applies the sort, filters and page arguments of a cafe listing to a Cafe query or select.
+
+    Returns (query, page), where page holds the page_rows arguments of a paginated listing and is None
+    otherwise. Raises ValueError with a message for the client if an argument is invalid.
+    """
+    sort = request.args.get('sort', 'id')
+    descending = sort.startswith('-')
+    sort_column = SORT_KEYS.get(sort.lstrip('-'))
+    if sort_column is None:
+        raise ValueError(f"Invalid sort key. Use one of: {', '.join(SORT_KEYS)}.")
+
+    query = filter_cafes(query)
+    limit = parse_int_arg('limit', 1, MAX_PAGE_SIZE)
+    cursor = request.args.get('cursor')
+    if cursor is not None:
+        cursor = decode_cursor(cursor, sort)
+
+    if limit is None and cursor is None:
+        if 'sort' in request.args:
+            query = query.order_by(sort_column.desc() if descending else sort_column.asc(), Cafe.id)
+        return query, None
+
+    limit = limit or MAX_PAGE_SIZE
+    return keyset_query(query, sort_column, Cafe.id, limit, cursor, descending), (sort, sort_column, Cafe.id, limit)
+
+
+def listing_response(rows, page):
+    """Returns the JSON response of a cafe listing from the CAFE_COLUMNS rows fetched with listing_query."""
+    if page is None:
+        return json_response(f'{{"cafes":{cafe_json.encode_rows(rows)}}}')
+    rows, next_cursor = page_rows(rows, *page)
+    next_cursor = current_app.json.dumps(next_cursor)
+    return json_response(f'{{"cafes":{cafe_json.encode_rows(rows)},"next_cursor":{next_cursor}}}')
+
+
+def catalog_validators():
+    """Returns the ETag and Last-Modified values of a cafe listing."""
+    version, updated_at = Cafe.catalog_version()
+    digest = hashlib.sha1(f"{version}:{normalized_args()}".encode()).hexdigest()
+    return f"cafes-{digest}", updated_at
+
+
+def cafe_validators(cafe_id):
+    """Returns the ETag and Last-Modified values of a single cafe, or None if it does not exist."""
+    updated_at = db.session.query(Cafe.updated_at).filter_by(id=cafe_id).scalar()
+    if updated_at is None:
+        return None
+    return f"cafe-{cafe_id}-{updated_at.timestamp():.6f}", updated_at
+
+
+def not_modified(response):
+    """Lets 304 responses through the rate limit without using up the client's quota."""
+    return response.status_code != 304
+
+
+def verify_request_token():
+    """Verifies the bearer token of the request. Returns (user id, None), or (None, error response)."""
+    token = None
+
+    if 'Authorization' in request.headers:
         try:
-            # Decode the token and verify the user
-            data = jwt.decode(token, Config.API_KEY, algorithms=["HS256"])
-            user = User.query.get(data['user_id'])
-            if not user:
-                return jsonify({'message': 'User not found!'}), 401
+            token = request.headers['Authorization'].split(" ")[1]
+        except IndexError:
+            return None, (jsonify({'message': 'Token format is invalid!'}), 400)
+    if not token:
+        return None, (jsonify({'message': 'Token is missing!'}), 401)
 
-            login_user(user)
+    try:
+        # Verified once per token, then served from the cache until it expires
+        return auth_cache.verify(token, Config.API_KEY), None
+    except jwt.ExpiredSignatureError:
+        return None, (jsonify({'message': 'Token has expired! Please login again.'}), 401)
+    except jwt.InvalidTokenError:
+        return None, (jsonify({'message': 'Token is invalid!'}), 401)
 
-        except jwt.ExpiredSignatureError:
-            return jsonify({'message': 'Token has expired! Please login again.'}), 401
-        except jwt.InvalidTokenError:
-            return jsonify({'message': 'Token is invalid!'}), 401
 
+def token_required(func):
+    """Decorator that ensures a valid token is present in the request headers."""
+    @wraps(func)
+    def decorated_function(*args, **kwargs):
+        user_id, error = verify_request_token()
+        if error:
+            return error
+
+        # Resolve the token's user, from the cache when possible
+        principal = auth_cache.principal(user_id)
+        if not principal:
+            return jsonify({'message': 'User not found!'}), 401
+
+        # The API is stateless, so the caller is kept on the request instead of a login session
+        g.principal = principal
         return func(*args, **kwargs)
     return decorated_function
 
 
+def admin_error():
+    """Returns an error response unless the caller is an admin."""
+    principal = g.get('principal')
+    if principal is None:
+        return jsonify({'message': 'Authentication required!'}), 401
+    if not principal.is_admin:
+        return jsonify({'message': 'Access forbidden: Admin privileges required!'}), 403
+    return None
+
+
 def admin_required(func):
     """Grants admin privileges."""
     @wraps(func)
     def wrapper(*args, **kwargs):
-        if not current_user.is_authenticated:
-            return jsonify({'message': 'Authentication required!'}), 401
-        if not current_user.is_admin:
-            return jsonify({'message': 'Access forbidden: Admin privileges required!'}), 403
+        error = admin_error()
+        if error:
+            return error
         return func(*args, **kwargs)
     return wrapper
 
 
+def cafe_not_found():
+    """Returns the 404 response for an unknown cafe id."""
+    return jsonify(error={"Not Found": "Sorry, a cafe with that id was not found in the database."}), 404
+
+
+def cafe_query(cafe_id):
+    """Returns the select of a single cafe's CAFE_COLUMNS row."""
+    return db.select(*CAFE_COLUMNS).where(Cafe.id == cafe_id)
+
+
+def cafe_response(row):
+    """Returns the JSON response of a single cafe from its CAFE_COLUMNS row."""
+    return json_response(f'{{"cafe":{cafe_json.encode(row)}}}')
+
+
+def cafe_conflict(name):
+    """Returns the 409 response for a cafe name that is already taken."""
+    return jsonify({'message': f"Cafe '{name}' already exists in the database."}), 409
+
+
+def cafe_payload(partial=False):
+    """Validates the JSON body of a cafe request. Returns (data, None), or (None, error response)."""
+    if not request.is_json:
+        return None, (jsonify({'message': 'Check request body. Content-Type must be application/json'}), 415)
+
+    data = request.get_json()
+    if not data:
+        return None, (jsonify({'message': 'Request body is empty. Please provide data in JSON format.'}), 400)
+
+    try:
+        return load_cafe(data, partial=partial), None   # partial=True allows partial updates
+    except ValidationError as err:
+        return None, (jsonify(err.messages), 400)
+
+
+def save_new_cafe(data):
+    """Adds a cafe built from validated data, with its image references and statistics. Doesn't commit."""
+    new_cafe = Cafe(
+        name=data['name'],
+        map_url=data['map_url'],
+        city=data['city'],
+        country=data['country'],
+        coffee_price=data['coffee_price'],
+        currency=data['currency'],
+        wifi_strength=data['wifi_strength'],
+        seats=data['seats'],
+        has_sockets=data['has_sockets'],
+        has_toilet=data['has_toilet'],
+        images=data['images'],
+        full_review=data['full_review'],
+        full_rating=data['full_rating']
+    )
+    new_cafe.locate()
+    new_cafe.set_price()
+    db.session.add(new_cafe)
+    retain_images(new_cafe.images)
+    update_stats(added=[stats_entry(new_cafe)])
+    Cafe.touch_catalog()
+    return new_cafe
+
+
+def save_cafe_changes(cafe, data):
+    """Applies validated changes to a cafe, its image references and statistics. Doesn't commit.
+
+    Returns the orphaned blobs to delete with delete_blobs after the commit.
+    """
+    old_stats = stats_entry(cafe)
+    cafe.name = data.get('name', cafe.name)
+    cafe.map_url = data.get('map_url', cafe.map_url)
+    cafe.city = data.get('city', cafe.city)
+    cafe.country = data.get('country', cafe.country)
+    cafe.coffee_price = data.get('coffee_price', cafe.coffee_price)
+    cafe.currency = data.get('currency', cafe.currency)
+    cafe.wifi_strength = data.get('wifi_strength', cafe.wifi_strength)
+    cafe.seats = data.get('seats', cafe.seats)
+    cafe.has_sockets = data.get('has_sockets', cafe.has_sockets)
+    cafe.has_toilet = data.get('has_toilet', cafe.has_toilet)
+    cafe.full_review = data.get('full_review', cafe.full_review)
+    cafe.full_rating = data.get('full_rating', cafe.full_rating)
+    cafe.locate()
+    cafe.set_price()
+
+    orphans = []
+    if data.get('images', cafe.images) != cafe.images:
+        retain_images(data['images'])
+        orphans = release_images(cafe.images)
+        cafe.images = data['images']
+        cafe.image_variants = None
+
+    update_stats(removed=[old_stats], added=[stats_entry(cafe)])
+    Cafe.touch_catalog()
+    return orphans
+
+
+def delete_saved_cafe(cafe):
+    """Deletes a cafe, its image references and statistics. Doesn't commit.
+
+    Returns the orphaned blobs to delete with delete_blobs after the commit.
+    """
+    orphans = release_images(cafe.images)
+    db.session.delete(cafe)
+    update_stats(removed=[stats_entry(cafe)])
+    Cafe.touch_catalog()
+    return orphans
+
+
 @api.route('/login', methods=['POST'])
 @limiter.limit("10 per minute")
 def api_login():
@@ -71,11 +349,10 @@ def api_login():
     user = User.query.filter_by(email=data['email'].lower()).first()
 
     if user and user.check_password(data['password']):
+        db.session.commit()   # Keeps a rehashed password
         token = generate_token(user.id)
 
         if user.is_admin:
-            # Bypass rate limiting for admin users
-            limiter.reset()
             return jsonify({'token': token, 'message': 'Admin login successful!'}), 200
 
         return jsonify({'token': token}), 200
@@ -85,23 +362,106 @@ def api_login():
 
 @api.route('/cafes', methods=['GET'])
 @token_required
-@limiter.limit("15 per minute")
+@limiter.limit("15 per minute", deduct_when=not_modified)
+@conditional(catalog_validators)
+@cache.cached()
 def get_all_cafes():
-    """Fetches a list of all cafes."""
-    cafes = Cafe.query.all()
-    cafes_list = [cafe.to_dict() for cafe in cafes]
+    """Fetches a list of cafes, optionally filtered, sorted and paginated."""
+    try:
+        statement, page = listing_query(db.select(*CAFE_COLUMNS))
+    except ValueError as err:
+        return jsonify({'message': str(err)}), 400
+    return listing_response(db.session.execute(statement).all(), page)
+
+
+@api.route('/cafes/export', methods=['GET'])
+@token_required
+@limiter.limit("5 per minute")
+def export_cafes():
+    """Streams the cafe catalog as newline-delimited JSON or CSV."""
+    export_format = request.args.get('format', 'ndjson').lower()
+    if export_format not in ('ndjson', 'csv'):
+        return jsonify({'message': "Invalid format. Use 'ndjson' or 'csv'."}), 400
+
+    try:
+        query = filter_cafes(Cafe.query)
+    except ValueError as err:
+        return jsonify({'message': str(err)}), 400
+
+    # Plain column rows have the same keys and values as Cafe.to_dict, without building ORM objects
+    columns = [column.name for column in CAFE_COLUMNS]
+    statement = query.with_entities(*CAFE_COLUMNS).order_by(Cafe.id).statement
+    rows = db.session.execute(statement.execution_options(yield_per=EXPORT_BATCH_SIZE))
+
+    def generate_ndjson():
+        encode = cafe_ndjson.encode
+        for batch in rows.partitions():
+            yield ''.join(encode(row) + '\n' for row in batch)
+
+    def generate_csv():
+        # JSON columns, e.g. image_variants, are written as JSON rather than as Python reprs
+        json_columns = [index for index, column in enumerate(CAFE_COLUMNS) if isinstance(column.type, db.JSON)]
+        dumps = current_app.json.dumps
+
+        def csv_row(row):
+            row = list(row)
+            for index in json_columns:
+                if row[index] is not None:
+                    row[index] = dumps(row[index])
+            return row
+
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(columns)
+        for batch in rows.partitions():
+            writer.writerows(map(csv_row, batch))
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+        if buffer.tell():
+            yield buffer.getvalue()
+
+    if export_format == 'csv':
+        return Response(stream_with_context(generate_csv()), mimetype='text/csv',
+                        headers={'Content-Disposition': 'attachment; filename=cafes.csv'})
+    return Response(stream_with_context(generate_ndjson()), mimetype='application/x-ndjson')
+
+
+@api.route('/cafes/nearby', methods=['GET'])
+@token_required
+@limiter.limit("15 per minute", deduct_when=not_modified)
+@conditional(catalog_validators)
+@cache.cached()
+def get_nearby_cafes():
+    """Finds the cafes nearest to a point, within a radius in kilometres."""
+    try:
+        latitude = parse_float_arg('lat', -90, 90)
+        longitude = parse_float_arg('lon', -180, 180)
+        radius = parse_float_arg('radius', 0, MAX_NEARBY_RADIUS_KM)
+        count = parse_int_arg('k', 1, MAX_PAGE_SIZE) or DEFAULT_NEARBY_COUNT
+    except ValueError as err:
+        return jsonify({'message': str(err)}), 400
+    if latitude is None or longitude is None:
+        return jsonify({'message': "'lat' and 'lon' are required."}), 400
+    if radius is None:
+        radius = DEFAULT_NEARBY_RADIUS_KM
+
+    cafes_list = [{**cafe.to_dict(), 'distance_km': round(distance, 3)}
+                  for cafe, distance in Cafe.nearby(latitude, longitude, radius, count)]
     return jsonify(cafes=cafes_list)
 
 
 @api.route('/cafes/<int:cafe_id>', methods=['GET'])
 @token_required
-@limiter.limit("15 per minute")
+@limiter.limit("15 per minute", deduct_when=not_modified)
+@conditional(cafe_validators)
+@cache.cached()
 def get_cafe(cafe_id):
     """Retrieves information about a specific cafe by ID."""
-    cafe = Cafe.query.get(cafe_id)
-    if not cafe:
-        return jsonify(error={"Not Found": "Sorry, a cafe with that id was not found in the database."}), 404
-    return jsonify(cafe=cafe.to_dict())
+    row = db.session.execute(cafe_query(cafe_id)).first()
+    if not row:
+        return cafe_not_found()
+    return cafe_response(row)
 
 
 @api.route('/cafes', methods=['POST'])
@@ -109,42 +469,18 @@ def get_cafe(cafe_id):
 @limiter.limit("10 per minute")
 def add_cafe():
     """Adds a new cafe to the database."""
-    if current_user.is_admin:
-        limiter.reset()
-    if not request.is_json:
-        return jsonify({'message': 'Check request body. Content-Type must be application/json'}), 415
-
-    data = request.get_json()
-    if not data:
-        return jsonify({'message': 'Request body is empty. Please provide data in JSON format.'}), 400
-
-    schema = CafeSchema()
-    try:
-        data = schema.load(data)
-    except ValidationError as err:
-        return jsonify(err.messages), 400
+    data, error = cafe_payload()
+    if error:
+        return error
 
     existing_cafe = Cafe.query.filter_by(name=data['name']).first()
     if existing_cafe:
-        return jsonify({'message': f"Cafe '{existing_cafe.name}' already exists in the database."}), 409
+        return cafe_conflict(existing_cafe.name)
 
-    new_cafe = Cafe(
-        name=data['name'],
-        map_url=data['map_url'],
-        city=data['city'],
-        country=data['country'],
-        coffee_price=data['coffee_price'],
-        currency=data['currency'],
-        wifi_strength=data['wifi_strength'],
-        seats=data['seats'],
-        has_sockets=data['has_sockets'],
-        has_toilet=data['has_toilet'],
-        images=data['images'],
-        full_review=data['full_review'],
-        full_rating=data['full_rating']
-    )
-    db.session.add(new_cafe)
+    new_cafe = save_new_cafe(data)
     db.session.commit()
+    search_index.add(new_cafe)
+    cache.invalidate()
 
     return jsonify({"message": "Cafe added successfully!", "cafe": new_cafe.to_dict()}), 201
 
@@ -156,36 +492,17 @@ def update_cafe(cafe_id):
     """Updates an existing cafe in the database."""
     cafe = Cafe.query.get(cafe_id)
     if not cafe:
-        return jsonify(error={"Not Found": "Sorry, a cafe with that id was not found in the database."}), 404
-
-    if not request.is_json:
-        return jsonify({'message': 'Check request body. Content-Type must be application/json'}), 415
-
-    data = request.get_json()
-    if not data:
-        return jsonify({'message': 'Request body is empty. Please provide data in JSON format.'}), 400
+        return cafe_not_found()
 
-    schema = CafeSchema()
-    try:
-        data = schema.load(request.get_json(), partial=True)    # partial=True allows partial updates
-    except ValidationError as err:
-        return jsonify(err.messages), 400
-
-    cafe.name = data.get('name', cafe.name)
-    cafe.map_url = data.get('map_url', cafe.map_url)
-    cafe.city = data.get('city', cafe.city)
-    cafe.country = data.get('country', cafe.country)
-    cafe.coffee_price = data.get('coffee_price', cafe.coffee_price)
-    cafe.currency = data.get('currency', cafe.currency)
-    cafe.wifi_strength = data.get('wifi_strength', cafe.wifi_strength)
-    cafe.seats = data.get('seats', cafe.seats)
-    cafe.has_sockets = data.get('has_sockets', cafe.has_sockets)
-    cafe.has_toilet = data.get('has_toilet', cafe.has_toilet)
-    cafe.images = data.get('images', cafe.images)
-    cafe.full_review = data.get('full_review', cafe.full_review)
-    cafe.full_rating = data.get('full_rating', cafe.full_rating)
+    data, error = cafe_payload(partial=True)
+    if error:
+        return error
 
+    orphans = save_cafe_changes(cafe, data)
     db.session.commit()
+    delete_blobs(orphans)
+    search_index.update(cafe)
+    cache.invalidate()
     return jsonify({"message": f"{cafe.name} updated successfully!", "cafe": cafe.to_dict()})
 
 
@@ -196,7 +513,222 @@ def delete_cafe(cafe_id):
     """Deletes a cafe from the database."""
     cafe = Cafe.query.get(cafe_id)
     if not cafe:
-        return jsonify(error={"Not Found": "Sorry, a cafe with that id was not found in the database."}), 404
-    db.session.delete(cafe)
+        return cafe_not_found()
+    orphans = delete_saved_cafe(cafe)
     db.session.commit()
+    delete_blobs(orphans)
+    search_index.remove(cafe_id)
+    cache.invalidate()
     return jsonify({"message": f"{cafe.name} deleted successfully!"}), 200
+
+
+def bulk_payload(key):
+    """Reads a JSON body holding a list under the given key. Returns (items, error response)."""
+    if not request.is_json:
+        return None, (jsonify({'message': 'Check request body. Content-Type must be application/json'}), 415)
+
+    data = request.get_json()
+    items = data.get(key) if isinstance(data, dict) else None
+    if not isinstance(items, list) or not items:
+        return None, (jsonify({'message': f"Request body must contain a non-empty '{key}' list."}), 400)
+    if len(items) > MAX_BULK_SIZE:
+        return None, (jsonify({'message': f"A batch can contain at most {MAX_BULK_SIZE} items."}), 413)
+    return items, None
+
+
+def bulk_response(results):
+    """Summarizes per-item results of a bulk operation."""
+    succeeded = sum(1 for result in results if result['status'] < 300)
+    return jsonify(succeeded=succeeded, failed=len(results) - succeeded, results=results), 200
+
+
+@api.route('/cafes/bulk', methods=['POST'])
+@token_required
+@limiter.limit("10 per minute")
+def bulk_add_cafes():
+    """Adds a batch of cafes to the database in a single transaction."""
+    items, error = bulk_payload('cafes')
+    if error:
+        return error
+
+    loaded, errors = load_cafes(items)
+    results = [None] * len(items)
+    for index, messages in errors.items():
+        results[index] = {'index': index, 'status': 400, 'errors': messages}
+
+    # One IN query finds the names that are already taken
+    names = {data['name'] for index, data in enumerate(loaded) if index not in errors}
+    taken = set(db.session.scalars(db.select(Cafe.name).where(Cafe.name.in_(names)))) if names else set()
+
+    rows = []
+    row_indexes = []
+    for index, data in enumerate(loaded):
+        if index in errors:
+            continue
+        if data['name'] in taken:
+            results[index] = {'index': index, 'status': 409,
+                              'message': f"Cafe '{data['name']}' already exists in the database."}
+            continue
+        taken.add(data['name'])
+        data.update(location_fields(data['map_url']))
+        data.update(price_fields(data['coffee_price'], data['currency']))
+        rows.append(data)
+        row_indexes.append(index)
+
+    if rows:
+        new_ids = db.session.scalars(
+            db.insert(Cafe).returning(Cafe.id, sort_by_parameter_order=True), rows).all()
+        for row in rows:
+            retain_images(row.get('images'))
+        update_stats(added=[stats_entry(row) for row in rows])
+        Cafe.touch_catalog()
+        db.session.commit()
+
+        for index, cafe_id in zip(row_indexes, new_ids):
+            results[index] = {'index': index, 'status': 201, 'id': cafe_id}
+        search_index.add_rows((cafe_id, row['name'], row['city'], row['country'])
+                              for cafe_id, row in zip(new_ids, rows))
+        cache.invalidate()
+
+    return bulk_response(results)
+
+
+@api.route('/cafes/bulk', methods=['PATCH'])
+@token_required
+@admin_required
+def bulk_update_cafes():
+    """Updates a batch of existing cafes in a single transaction."""
+    items, error = bulk_payload('cafes')
+    if error:
+        return error
+
+    results = [None] * len(items)
+    changes = {}
+    for index, item in enumerate(items):
+        cafe_id = item.pop('id', None) if isinstance(item, dict) else None
+        if type(cafe_id) is not int:
+            results[index] = {'index': index, 'status': 400, 'errors': {'id': ['Missing or invalid cafe id.']}}
+            continue
+        try:
+            changes[index] = (cafe_id, load_cafe(item, partial=True))
+        except ValidationError as err:
+            results[index] = {'index': index, 'status': 400, 'errors': err.messages}
+
+    ids = {cafe_id for cafe_id, data in changes.values()}
+    names = {data['name'] for cafe_id, data in changes.values() if 'name' in data}
+    existing = {row.id: row._asdict() for row in db.session.execute(
+        db.select(Cafe.id, Cafe.images, Cafe.coffee_price, Cafe.currency, *STATS_COLUMNS).where(Cafe.id.in_(ids)))} \
+        if ids else {}
+    owners = dict(db.session.execute(db.select(Cafe.name, Cafe.id).where(Cafe.name.in_(names))).all()) \
+        if names else {}
+
+    rows = []
+    removed_stats, added_stats = [], []
+    current = {cafe_id: dict(values) for cafe_id, values in existing.items()}   # Includes earlier items of the batch
+    updated_at = datetime.utcnow()
+    for index, (cafe_id, data) in changes.items():
+        if cafe_id not in existing:
+            results[index] = {'index': index, 'status': 404, 'message': f"Cafe {cafe_id} was not found."}
+            continue
+        if 'name' in data and owners.setdefault(data['name'], cafe_id) != cafe_id:
+            results[index] = {'index': index, 'status': 409,
+                              'message': f"Cafe '{data['name']}' already exists in the database."}
+            continue
+        images = existing[cafe_id]['images']
+        if data.get('images', images) != images:
+            data['image_variants'] = None
+        if 'map_url' in data:
+            data.update(location_fields(data['map_url']))
+        if 'coffee_price' in data or 'currency' in data:
+            values = current[cafe_id]
+            data.update(price_fields(data.get('coffee_price', values['coffee_price']),
+                                     data.get('currency', values['currency'])))
+        removed_stats.append(stats_entry(current[cafe_id]))
+        current[cafe_id].update(data)
+        added_stats.append(stats_entry(current[cafe_id]))
+        rows.append({'id': cafe_id, 'updated_at': updated_at, **data})
+        results[index] = {'index': index, 'status': 200, 'id': cafe_id}
+
+    if rows:
+        # Rows with different column sets are grouped into separate executemany batches
+        db.session.execute(db.update(Cafe), rows)
+        # Retain every new reference before releasing old ones, so images moved between cafes survive
+        replaced = [row for row in rows if 'image_variants' in row]
+        for row in replaced:
+            retain_images(row['images'])
+        orphans = []
+        for row in replaced:
+            orphans += release_images(existing[row['id']]['images'])
+        update_stats(removed_stats, added_stats)
+        Cafe.touch_catalog()
+        db.session.commit()
+        delete_blobs(orphans)
+
+        updated_ids = [row['id'] for row in rows]
+        search_index.add_rows(db.session.execute(
+            db.select(Cafe.id, Cafe.name, Cafe.city, Cafe.country).where(Cafe.id.in_(updated_ids))).all())
+        cache.invalidate()
+
+    return bulk_response(results)
+
+
+@api.route('/cafes/bulk', methods=['DELETE'])
+@token_required
+@admin_required
+def bulk_delete_cafes():
+    """Deletes a batch of cafes in a single transaction."""
+    ids, error = bulk_payload('ids')
+    if error:
+        return error
+
+    valid_ids = {cafe_id for cafe_id in ids if type(cafe_id) is int}
+    existing = {row.id: row for row in db.session.execute(
+        db.select(Cafe.id, Cafe.images, *STATS_COLUMNS).where(Cafe.id.in_(valid_ids)))} if valid_ids else {}
+
+    results = []
+    for index, cafe_id in enumerate(ids):
+        if type(cafe_id) is int and cafe_id in existing:
+            results.append({'index': index, 'status': 200, 'id': cafe_id})
+        else:
+            results.append({'index': index, 'status': 404, 'message': f"Cafe {cafe_id} was not found."})
+
+    if existing:
+        orphans = []
+        for row in existing.values():
+            orphans += release_images(row.images)
+        db.session.execute(db.delete(Cafe).where(Cafe.id.in_(existing)))
+        update_stats(removed=[stats_entry(row) for row in existing.values()])
+        Cafe.touch_catalog()
+        db.session.commit()
+        delete_blobs(orphans)
+
+        search_index.remove(*existing)
+        cache.invalidate()
+
+    return bulk_response(results)
+
+
+@api.route('/stats', methods=['GET'])
+@token_required
+@limiter.limit("15 per minute", deduct_when=not_modified)
+@conditional(catalog_validators)
+@cache.cached()
+def get_stats():
+    """Returns the cafe count, average rating, wifi strengths and prices of a city or country."""
+    scopes = [scope for scope in ('city', 'country') if request.args.get(scope)]
+    if len(scopes) != 1:
+        return jsonify({'message': "Provide either 'city' or 'country'."}), 400
+
+    scope = scopes[0]
+    stats = stats_summary(scope, request.args[scope].strip())
+    if stats is None:
+        return jsonify(error={"Not Found": f"Sorry, there are no cafes in that {scope}."}), 404
+    return jsonify(stats=stats)
+
+
+@api.route('/cache/stats', methods=['GET'])
+@token_required
+@admin_required
+def get_cache_stats():
+    """Returns the response cache hit/miss counters of the serving worker."""
+    return jsonify(cache=cache.stats())
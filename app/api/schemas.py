@@ -1,47 +1,74 @@
-from marshmallow import Schema, fields, validate, ValidationError, validates
-from app.main.data import COUNTRIES, CURRENCIES, STAR_RATINGS
+from marshmallow import Schema, fields, validate, ValidationError, validates, RAISE, EXCLUDE
+from app.main.validation import (NAME_LENGTH, CITY_LENGTH, COUNTRY_LENGTH, CURRENCY_LENGTH, IMAGES_LENGTH,
+                                 REVIEW_LENGTH, COUNTRY_CHOICES, CURRENCY_CHOICES, WIFI_STRENGTHS, FULL_RATINGS,
+                                 PRICE_PATTERN, clean_cafe)
 
 
 class CafeSchema(Schema):
     """ Schema for validating Cafe data. """
-    name = fields.String(required=True, validate=validate.Length(min=2, max=30))
+    name = fields.String(required=True, validate=validate.Length(*NAME_LENGTH))
     map_url = fields.String(required=True, validate=validate.URL())
-    city = fields.String(required=True, validate=validate.Length(min=2, max=25))
-    country = fields.String(required=True, validate=validate.Length(min=2, max=20))
+    city = fields.String(required=True, validate=validate.Length(*CITY_LENGTH))
+    country = fields.String(required=True, validate=validate.Length(*COUNTRY_LENGTH))
     coffee_price = fields.String(
         required=True,
-        validate=validate.Regexp(r'^\d+(\.\d{1,2})?$', error='Enter a digit in string format'),
+        validate=validate.Regexp(PRICE_PATTERN, error='Enter a digit in string format'),
         error_messages={"invalid": "Enter a digit in string format"}
     )
-    currency = fields.String(required=True, validate=validate.Length(max=10))
+    currency = fields.String(required=True, validate=validate.Length(*CURRENCY_LENGTH))
     wifi_strength = fields.Integer(validate=validate.Range(min=0, max=5))
     seats = fields.Integer(required=True, validate=validate.Range(min=0))
     has_sockets = fields.Boolean(required=True)
     has_toilet = fields.Boolean(required=True)
-    images = fields.String(validate=validate.Length(max=350))
-    full_review = fields.String(validate=validate.Length(min=3, max=300))
+    images = fields.String(validate=validate.Length(*IMAGES_LENGTH))
+    full_review = fields.String(validate=validate.Length(*REVIEW_LENGTH))
     full_rating = fields.Integer(required=True, validate=validate.Range(min=1, max=5))
 
     @validates('country')
     def validate_country(self, value):
         """ Validates that the country value matches the allowed format. """
-        if not any(value == choice[0] for choice in COUNTRIES):
+        if value not in COUNTRY_CHOICES:
             raise ValidationError('Invalid country format. Check documentation.')
 
     @validates('currency')
     def validate_currency(self, value):
         """ Validates that the currency value matches the allowed format. """
-        if not any(value == choice[0] for choice in CURRENCIES):
+        if value not in CURRENCY_CHOICES:
             raise ValidationError('Invalid currency format. Use currency symbol.')
 
     @validates('wifi_strength')
     def validate_wifi_strength(self, value):
         """ Validates that the wifi_strength value is within the allowed range. """
-        if not any(str(value) == choice[0] for choice in STAR_RATINGS):
+        if value not in WIFI_STRENGTHS:
             raise ValidationError('Invalid wifi-strength format. Required format: 0 - 5')
 
     @validates('full_rating')
     def validate_full_rating(self, value):
         """ Validates that the full_rating value is within the allowed range. """
-        if not any(str(value) == choice[0] for choice in STAR_RATINGS[1:]):
+        if value not in FULL_RATINGS:
             raise ValidationError('Invalid full-rating format. Required format: 1 - 5')
+
+
+cafe_schema = CafeSchema()   # Stateless, so one instance serves every request
+
+
+def load_cafe(record, partial=False, unknown=RAISE):
+    """ Loads one cafe record like CafeSchema().load, raising ValidationError if it's invalid.
+    Valid records are checked by the compiled rules alone; marshmallow only builds the error messages. """
+    data = clean_cafe(record, partial, exclude_unknown=unknown == EXCLUDE)
+    if data is None:
+        data = cafe_schema.load(record, partial=partial, unknown=unknown)
+    return data
+
+
+def load_cafes(records, partial=False, unknown=RAISE):
+    """ Loads a batch of cafe records. Returns the data of each record, None for invalid ones, and the
+    error messages of those by index. """
+    loaded, errors = [], {}
+    for index, record in enumerate(records):
+        try:
+            loaded.append(load_cafe(record, partial, unknown))
+        except ValidationError as err:
+            loaded.append(None)
+            errors[index] = err.messages
+    return loaded, errors
@@ -1,42 +1,88 @@
 from flask import Flask, jsonify
 from flask_sqlalchemy import SQLAlchemy
-from flask_bootstrap import Bootstrap5
 from flask_login import LoginManager
 from flask_limiter import Limiter
-from flask_limiter.util import get_remote_address
+from app.main.assets import StaticAssets
+from app.main.cache import ResponseCache
+from app.main.fragments import init_templates
+from app.main.metrics import Metrics
+from app.main.passwords import HashingBusy
+from app.main.database import RoutingSession, engine_options, database_binds, configure_sqlite
+from app.main.ratelimit import rate_limit_key, is_admin_request, default_storage_uri
 from config import Config
 
 # Initialize extensions
-db = SQLAlchemy()
+db = SQLAlchemy(session_options={'class_': RoutingSession})
 login_manager = LoginManager()
-limiter = Limiter(get_remote_address)
+limiter = Limiter(rate_limit_key)
+limiter.request_filter(is_admin_request)
+cache = ResponseCache()
+metrics = Metrics()
+static_assets = StaticAssets()
 
 def create_app():
     app = Flask(__name__)
     app.config.from_object(Config)
+    app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', engine_options(app.config))
+    app.config.setdefault('SQLALCHEMY_BINDS', database_binds(app.config))
 
     db.init_app(app)
-    Bootstrap5(app)
+    with app.app_context():
+        for engine in db.engines.values():
+            if app.config['DATABASE_PROFILE'] == 'sqlite' and engine.dialect.name == 'sqlite':
+                configure_sqlite(engine, app.config)
 
     login_manager.init_app(app)
     login_manager.login_view = 'main.login'
+    app.config['RATELIMIT_STORAGE_URI'] = app.config['RATELIMIT_STORAGE_URI'] or default_storage_uri()
     limiter.init_app(app)
+    cache.init_app(app)
+    metrics.init_app(app)
+    static_assets.init_app(app)
+    init_templates(app, cache, static_assets.release)
 
-    # Register blueprints
-    from app.main.routes import main as main_blueprint
-    app.register_blueprint(main_blueprint)
+    # Register blueprints; each is imported only if it's served
+    if 'main' in app.config['BLUEPRINTS']:
+        from flask_bootstrap import Bootstrap5
+        Bootstrap5(app)
 
-    from app.api import api as api_blueprint
-    app.register_blueprint(api_blueprint, url_prefix='/api')
+        from app.main.routes import main as main_blueprint
+        app.register_blueprint(main_blueprint)
 
-    with app.app_context():
-        db.create_all()
+    if 'api' in app.config['BLUEPRINTS']:
+        from app.api import api as api_blueprint
+        app.register_blueprint(api_blueprint, url_prefix='/api')
+
+    from app.api.auth import auth_cache
+    auth_cache.init_app(app)
+
+    from app.main.commands import cafes_cli, db_cli, assets_cli
+    app.cli.add_command(cafes_cli)
+    app.cli.add_command(db_cli)
+    app.cli.add_command(assets_cli)
+
+    if app.config['SETUP_DATABASE']:
+        with app.app_context():
+            from app.main.migrations import setup_database
+            setup_database(app.config['AUTO_MIGRATE'])
 
     # Custom 429 rate limit error handler
     @app.errorhandler(429)
     def ratelimit_error(e):
         return jsonify({'message': 'Rate limit exceeded! Please try again later.'}), 429
 
+    # Password hashing queue full: ask the client to retry instead of queueing more work
+    @app.errorhandler(HashingBusy)
+    def hashing_busy_error(e):
+        return jsonify({'message': 'Too many logins or registrations right now. Please try again shortly.'}), 503, \
+            {'Retry-After': '1'}
+
+    # Custom 413 upload size error handler
+    @app.errorhandler(413)
+    def upload_too_large_error(e):
+        max_size = app.config['MAX_CONTENT_LENGTH'] // (1024 * 1024)
+        return jsonify({'message': f'Upload too large! The limit is {max_size} MB per request.'}), 413
+
     return app
 
 @login_manager.user_loader
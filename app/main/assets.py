@@ -0,0 +1,207 @@
+"""Fingerprinted, precompressed static files.
+
+'flask assets build' copies every static file to STATIC_BUILD_DIR under a name holding a hash of its content
+(css/custom/main.css -> css/custom/main.1f2e3d4c5b6a.css), with gzip and brotli variants of the text files, and
+writes a manifest of the new names. url_for('static', ...) then links the hashed names, which are served
+precompressed and cached by browsers for a year without revalidation: a changed file gets a new name. Files
+missing from the manifest, and every file until the first build, are served from the static folder as before.
+"""
+from flask import current_app, request, send_from_directory
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import posixpath
+import re
+
+try:
+    import brotli
+except ImportError:   # Builds only gzip variants
+    brotli = None
+
+MANIFEST_NAME = 'manifest.json'
+HASH_LENGTH = 12
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+
+# Uploads change at runtime, so they are not part of a build. Stored blobs and their variants are named after
+# their content though, so they get the same caching.
+UPLOADS_PREFIX = 'assets/img_uploads/'   # storage.UPLOAD_FOLDER, within the static folder
+BLOB_FILENAME = re.compile(r'^[0-9a-f]{64}(_\w+)?\.\w+$')
+
+# Extensions of the files worth compressing; images and fonts like woff2 are compressed already
+COMPRESSIBLE = {'.css', '.js', '.map', '.json', '.svg', '.txt', '.html', '.xml', '.ico', '.ttf', '.otf', '.eot'}
+MIN_COMPRESS_SIZE = 1024
+
+# Content-Encoding -> extension of the precompressed file, in order of preference
+ENCODING_EXTENSIONS = {'br': 'br', 'gzip': 'gz'}
+
+# References to other files that are rewritten to their hashed names
+CSS_URL = re.compile(r'''(url\(\s*['"]?)([^'"()\s]+)(['"]?\s*\))''')
+SOURCE_MAP_URL = re.compile(r'(sourceMappingURL=)([^\s*]+)')
+
+
+def static_files(static_folder):
+    """Returns the paths, relative to the static folder, of the files a build includes."""
+    names = []
+    for directory, subdirectories, filenames in os.walk(static_folder):
+        relative = os.path.relpath(directory, static_folder).replace(os.sep, '/')
+        prefix = '' if relative == '.' else f"{relative}/"
+        if prefix.startswith(UPLOADS_PREFIX):
+            continue
+        names += [prefix + filename for filename in filenames if not filename.startswith('.')]
+    return sorted(names)
+
+
+def rewrite_references(name, content, resolve):
+    """Replaces the relative URLs in a CSS or JS file with those of their hashed files.
+
+    resolve is called with the path of every referenced file, relative to the static folder, and returns its
+    hashed path, or None to leave the URL as it is.
+    """
+    directory = posixpath.dirname(name)
+
+    def replace(match):
+        url = match.group(2)
+        if url.startswith(('data:', '#', '/')) or '://' in url:
+            return match.group(0)
+        path, _, fragment = url.partition('#')
+        path = path.partition('?')[0]
+        hashed = resolve(posixpath.normpath(posixpath.join(directory, path)))
+        if not hashed:
+            return match.group(0)
+        new_url = posixpath.relpath(hashed, directory or '.') + (f"#{fragment}" if fragment else '')
+        return match.group(1) + new_url + match.group(0)[match.end(2) - match.start():]
+
+    text = content.decode('utf-8', 'surrogateescape')
+    if name.endswith('.css'):
+        text = CSS_URL.sub(replace, text)
+    text = SOURCE_MAP_URL.sub(replace, text)
+    return text.encode('utf-8', 'surrogateescape')
+
+
+def compressed_variants(content):
+    """Returns {encoding: compressed content} of the variants that are smaller than the content."""
+    variants = {'gzip': gzip.compress(content, 9, mtime=0)}
+    if brotli:
+        variants['br'] = brotli.compress(content, quality=11)
+    return {encoding: data for encoding, data in variants.items() if len(data) < len(content)}
+
+
+def write_file(path, content):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'wb') as file:
+        file.write(content)
+    os.replace(tmp_path, path)
+
+
+def build_assets(static_folder, build_folder):
+    """Writes the hashed and compressed files of a static folder and their manifest. Returns the manifest.
+
+    Hashed files are named after their content, so those of earlier builds are reused as they are, and the
+    files they replace stay available to pages rendered before the new build was deployed.
+    """
+    names = set(static_files(static_folder))
+    files, encodings = {}, {}
+
+    def fingerprint(name, resolving=()):
+        if name in files:
+            return files[name]
+        if name not in names or name in resolving:
+            return None
+        with open(os.path.join(static_folder, name), 'rb') as file:
+            content = file.read()
+        if name.endswith(('.css', '.js')):
+            # Referenced files are hashed first, so a CSS file's hash changes with the fonts and images it uses
+            content = rewrite_references(name, content, lambda path: fingerprint(path, resolving + (name,)))
+
+        stem, extension = posixpath.splitext(name)
+        hashed = f"{stem}.{hashlib.sha256(content).hexdigest()[:HASH_LENGTH]}{extension}"
+        path = os.path.join(build_folder, hashed)
+        if not os.path.exists(path):   # Else an earlier build wrote the same file and its variants
+            if extension.lower() in COMPRESSIBLE and len(content) >= MIN_COMPRESS_SIZE:
+                for encoding, data in compressed_variants(content).items():
+                    write_file(f"{path}.{ENCODING_EXTENSIONS[encoding]}", data)
+            write_file(path, content)   # Last, so an interrupted build writes the variants again
+        variants = [encoding for encoding, suffix in ENCODING_EXTENSIONS.items()
+                    if os.path.exists(f"{path}.{suffix}")]
+
+        files[name] = hashed
+        if variants:
+            encodings[hashed] = variants
+        return hashed
+
+    for name in sorted(names):
+        fingerprint(name)
+
+    manifest = {'files': files, 'encodings': encodings}
+    write_file(os.path.join(build_folder, MANIFEST_NAME), json.dumps(manifest, indent=1, sort_keys=True).encode())
+    return manifest
+
+
+class StaticAssets:
+    """Links and serves the hashed files of the last 'flask assets build', if any."""
+
+    def __init__(self):
+        self.build_folder = None
+        self.files = {}
+        self.encodings = {}
+        self.hashed = set()
+        self.release = ''
+
+    def init_app(self, app):
+        self.build_folder = app.config['STATIC_BUILD_DIR'] or \
+            os.path.join(os.path.dirname(app.static_folder), 'static_build')
+        self.load()
+        app.url_defaults(self.hashed_url)
+        app.view_functions['static'] = self.send_static_file
+
+    def load(self):
+        """Reads the manifest of the last build."""
+        try:
+            with open(os.path.join(self.build_folder, MANIFEST_NAME)) as file:
+                manifest = json.load(file)
+        except (OSError, ValueError):
+            manifest = {}
+        self.files = manifest.get('files', {})
+        self.encodings = manifest.get('encodings', {})
+        self.hashed = set(self.files.values())
+        # Names the build, for caches of pages that link its files
+        self.release = hashlib.sha256(json.dumps(self.files, sort_keys=True).encode()).hexdigest()[:HASH_LENGTH] \
+            if self.files else ''
+
+    def build(self, static_folder):
+        """Builds the static folder into the build folder and starts linking the new files."""
+        manifest = build_assets(static_folder, self.build_folder)
+        self.load()
+        return manifest
+
+    def hashed_url(self, endpoint, values):
+        """Makes url_for('static', filename=...) link the hashed file."""
+        if endpoint == 'static' and values.get('filename') in self.files:
+            values['filename'] = self.files[values['filename']]
+
+    def send_static_file(self, filename):
+        """Serves a hashed file, precompressed if the client accepts it, or else a file of the static folder."""
+        if filename not in self.hashed:
+            if filename.startswith(UPLOADS_PREFIX) and BLOB_FILENAME.match(filename[len(UPLOADS_PREFIX):]):
+                return immutable(send_from_directory(current_app.static_folder, filename, max_age=IMMUTABLE_MAX_AGE))
+            return current_app.send_static_file(filename)
+
+        encodings = self.encodings.get(filename, ())
+        encoding = next((encoding for encoding in encodings if request.accept_encodings[encoding]), None)
+        path = f"{filename}.{ENCODING_EXTENSIONS[encoding]}" if encoding else filename
+        response = send_from_directory(self.build_folder, path, mimetype=mimetypes.guess_type(filename)[0],
+                                       download_name=posixpath.basename(filename), max_age=IMMUTABLE_MAX_AGE)
+        if encoding:
+            response.content_encoding = encoding
+        if encodings:
+            response.vary.add('Accept-Encoding')
+        return immutable(response)
+
+
+def immutable(response):
+    """Tells browsers not to revalidate a response during its max-age, not even on reload."""
+    response.cache_control.immutable = True
+    return response
@@ -0,0 +1,331 @@
+from collections import OrderedDict
+from functools import wraps
+from threading import Lock
+from urllib.parse import urlencode
+from flask import g, request, session, make_response
+from datetime import timezone
+import asyncio
+import hashlib
+import inspect
+import json
+import os
+import stat
+import tempfile
+import time
+
+
+def private_directory(path):
+    """Creates a directory only its owner can use, or checks that an existing one can't be written by others.
+
+    Raises RuntimeError if another user could have put files in it, since caches trust what they read back.
+    """
+    os.makedirs(path, mode=0o700, exist_ok=True)
+    info = os.lstat(path)
+    if not stat.S_ISDIR(info.st_mode):
+        raise RuntimeError(f"{path} is not a directory.")
+    if hasattr(os, 'getuid') and (info.st_uid != os.getuid() or info.st_mode & (stat.S_IWGRP | stat.S_IWOTH)):
+        raise RuntimeError(f"{path} must belong to this user and must not be writable by other users.")
+    return path
+
+
+def user_temp_directory(name):
+    """Returns a private directory of the temp folder for the current user, e.g. /tmp/cafe-connect-cache-1000."""
+    suffix = f"-{os.getuid()}" if hasattr(os, 'getuid') else ''
+    return private_directory(os.path.join(tempfile.gettempdir(), f"cafe-connect-{name}{suffix}"))
+
+
+def normalized_args():
+    """Returns the query string with its arguments sorted and empty values dropped."""
+    args = sorted((name, value.strip()) for name, value in request.args.items(multi=True) if value.strip())
+    return urlencode(args)
+
+
+def is_fresh(etag, last_modified):
+    """Checks whether the client's cached copy, named by If-None-Match or If-Modified-Since, is still current."""
+    if request.if_none_match:
+        return request.if_none_match.contains(etag)
+    if request.if_modified_since and last_modified is not None:
+        return last_modified <= request.if_modified_since
+    return False
+
+
+def conditional(get_validators):
+    """Decorator adding ETag/Last-Modified headers and answering conditional GETs with 304.
+
+    get_validators receives the view arguments and returns an (etag, last_modified) pair, or None
+    when the view should run unconditionally. A 304 is returned before the view runs, so the
+    body is never loaded or serialized. Coroutine views take a coroutine get_validators.
+    """
+    def tag(response, etag, last_modified):
+        if response.status_code in (200, 304):
+            response.set_etag(etag)
+            if last_modified is not None:
+                response.last_modified = last_modified
+        return response
+
+    def decorator(func):
+        if inspect.iscoroutinefunction(func):
+            @wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                validators = await get_validators(**kwargs)
+                if validators is None:
+                    return await func(*args, **kwargs)
+
+                etag, last_modified = validators
+                last_modified = utc_seconds(last_modified)
+                if is_fresh(etag, last_modified):
+                    return tag(make_response('', 304), etag, last_modified)
+                return tag(make_response(await func(*args, **kwargs)), etag, last_modified)
+            return async_wrapper
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            validators = get_validators(**kwargs)
+            if validators is None:
+                return func(*args, **kwargs)
+
+            etag, last_modified = validators
+            last_modified = utc_seconds(last_modified)
+            if is_fresh(etag, last_modified):
+                return tag(make_response('', 304), etag, last_modified)
+            return tag(make_response(func(*args, **kwargs)), etag, last_modified)
+        return wrapper
+    return decorator
+
+
+def utc_seconds(value):
+    """Returns a naive UTC datetime as an aware one, truncated to the whole seconds HTTP dates carry."""
+    return value.replace(tzinfo=timezone.utc, microsecond=0) if value is not None else None
+
+
+def catalog_version():
+    """Returns the database catalog version of the request, which keys its cached response.
+
+    Usually the ETag validators have already read it, so the body and the ETag always belong to the same version,
+    whichever process made the last change.
+    """
+    if 'catalog_version' not in g:
+        from app.main.models import Cafe   # The models need the db of app.main, which imports this module
+        Cafe.catalog_version()
+    return g.catalog_version
+
+
+class NullCache:
+    """Backend that never stores anything."""
+
+    def get(self, key):
+        return None
+
+    def set(self, key, value, timeout):
+        pass
+
+    def clear(self):
+        pass
+
+    def __len__(self):
+        return 0
+
+
+class MemoryCache:
+    """In-process LRU backend with per-entry expiry."""
+
+    def __init__(self, max_entries=500):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, timeout):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + timeout, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class FileCache:
+    """Backend storing entries as files in a directory, shared by every worker on the host.
+
+    Values are cached responses, (body bytes, status, headers), or text. Each file holds a line of JSON with the
+    expiry, status and headers, followed by the raw body, so reading an entry never runs code.
+    """
+
+    def __init__(self, cache_dir, max_entries=500):
+        self.cache_dir = private_directory(cache_dir)
+        self.max_entries = max_entries
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, hashlib.sha1(key.encode()).hexdigest() + '.cache')
+
+    def _write(self, path, data):
+        # Write to a temporary file first so other workers never read a partial entry
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir)
+        with os.fdopen(fd, 'wb') as file:
+            file.write(data)
+        os.replace(tmp_path, path)
+
+    def get(self, key):
+        try:
+            with open(self._path(key), 'rb') as file:
+                meta = json.loads(file.readline())
+                body = file.read()
+        except (OSError, ValueError):
+            return None
+        if not isinstance(meta, dict) or meta.get('expires_at', 0) < time.time():
+            return None
+        if meta.get('text'):
+            return body.decode()
+        return body, meta['status'], [tuple(header) for header in meta['headers']]
+
+    def set(self, key, value, timeout):
+        meta = {'expires_at': time.time() + timeout}
+        if isinstance(value, str):
+            meta['text'], body = True, value.encode()
+        else:
+            body, meta['status'], meta['headers'] = value
+        self._write(self._path(key), json.dumps(meta).encode() + b'\n' + body)
+        entries = [entry for entry in os.scandir(self.cache_dir) if entry.name.endswith('.cache')]
+        if len(entries) > self.max_entries:
+            entries.sort(key=lambda entry: entry.stat().st_mtime)
+            for entry in entries[:len(entries) - self.max_entries]:
+                try:
+                    os.remove(entry.path)
+                except OSError:
+                    pass
+
+    def clear(self):
+        for entry in os.scandir(self.cache_dir):
+            if entry.name.endswith('.cache'):
+                try:
+                    os.remove(entry.path)
+                except OSError:
+                    pass
+
+    def __len__(self):
+        return sum(1 for entry in os.scandir(self.cache_dir) if entry.name.endswith('.cache'))
+
+
+class ResponseCache:
+    """Read-through cache for GET responses, keyed on the database catalog version so any change invalidates it."""
+
+    def __init__(self):
+        self.backend = NullCache()
+        self.default_timeout = 300
+        self.hits = 0
+        self.misses = 0
+
+    def init_app(self, app):
+        cache_type = app.config.get('CACHE_TYPE', 'memory')
+        max_entries = app.config.get('CACHE_MAX_ENTRIES', 500)
+        if cache_type == 'memory':
+            self.backend = MemoryCache(max_entries)
+        elif cache_type == 'file':
+            self.backend = FileCache(app.config.get('CACHE_DIR') or user_temp_directory('cache'), max_entries)
+        elif cache_type == 'null':
+            self.backend = NullCache()
+        else:
+            raise ValueError(f"Unknown CACHE_TYPE '{cache_type}'. Use 'memory', 'file' or 'null'.")
+        self.default_timeout = app.config.get('CACHE_DEFAULT_TIMEOUT', 300)
+
+    def make_key(self):
+        """Builds the cache key from the catalog version, the route and the normalized query string."""
+        return f"{catalog_version()}:{request.path}?{normalized_args()}"
+
+    def cached(self, timeout=None):
+        """Decorator that serves successful GET responses from the cache. Works on coroutine views too."""
+        def decorator(func):
+            if inspect.iscoroutinefunction(func):
+                @wraps(func)
+                async def async_wrapper(*args, **kwargs):
+                    # The database can only be read through the request's AsyncSession, so the validators of
+                    # coroutine views must have read the catalog version; responses are not cached otherwise
+                    if 'catalog_version' not in g:
+                        return await func(*args, **kwargs)
+                    key = await self.run(self.lookup_key)
+                    if key is None:
+                        return await func(*args, **kwargs)
+                    response = await self.run(self.lookup, key)
+                    if response is None:
+                        response = await self.run(self.store, key, make_response(await func(*args, **kwargs)), timeout)
+                    return response
+                return async_wrapper
+
+            @wraps(func)
+            def wrapper(*args, **kwargs):
+                key = self.lookup_key()
+                if key is None:
+                    return func(*args, **kwargs)
+                response = self.lookup(key)
+                if response is None:
+                    response = self.store(key, make_response(func(*args, **kwargs)), timeout)
+                return response
+            return wrapper
+        return decorator
+
+    async def run(self, func, *args):
+        """Calls a cache method from a coroutine view, in a worker thread if the backend reads and writes files."""
+        if isinstance(self.backend, FileCache):
+            return await asyncio.to_thread(func, *args)
+        return func(*args)
+
+    def lookup_key(self):
+        """Returns the cache key of the request, or None if its response must not be cached."""
+        # Pending flash messages are rendered into the page, so it must not be shared
+        if request.method != 'GET' or session.get('_flashes'):
+            return None
+        return self.make_key()
+
+    def lookup(self, key):
+        """Returns the cached response for a key, or None on a miss."""
+        entry = self.backend.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        body, status, headers = entry
+        return make_response(body, status, headers)
+
+    def store(self, key, response, timeout=None):
+        """Caches a response if it is a complete 200, and returns it."""
+        if response.status_code == 200 and not response.is_streamed:
+            headers = [('Content-Type', response.headers['Content-Type'])]
+            self.backend.set(key, (response.get_data(), 200, headers), timeout or self.default_timeout)
+        return response
+
+    def invalidate(self):
+        """Drops the cached responses after a change to the catalog.
+
+        Entries are keyed on the database catalog version, so other processes never serve them after a change
+        anyway; this only frees the space of those that can't be used again.
+        """
+        self.backend.clear()
+
+    def stats(self):
+        """Returns the hit/miss counters of this process."""
+        lookups = self.hits + self.misses
+        return {
+            'backend': type(self.backend).__name__,
+            'version': catalog_version(),
+            'entries': len(self.backend),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': round(self.hits / lookups, 3) if lookups else 0.0,
+        }
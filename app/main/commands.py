@@ -0,0 +1,339 @@
+from flask import current_app
+from flask.cli import AppGroup
+from marshmallow import EXCLUDE
+from app.api.schemas import load_cafes
+from .models import db, Cafe, CafeStats, ImageBlob
+from .storage import UPLOAD_FOLDER, BLOB_NAME, BLOB_GRACE_SECONDS, is_managed, is_recent, image_paths, store_blob, \
+    retain_images, release_images, delete_blobs
+from .geo import location_fields
+from .pricing import price_fields
+from .validation import OPTIONAL_FIELDS
+from .stats import STATS_COLUMNS, stats_entry, update_stats, rebuild_stats
+from . import migrations, static_assets
+from .assets import ENCODING_EXTENSIONS
+from .images import VARIANT_SIZES, VARIANT_FORMATS, generate_variants, variant_path
+from collections import Counter
+from datetime import datetime
+import click
+import csv
+import json
+import os
+import time
+
+
+cafes_cli = AppGroup('cafes', help='Manage the cafe catalog.')
+db_cli = AppGroup('db', help='Manage the database schema.')
+assets_cli = AppGroup('assets', help='Build the static files.')
+
+
+def read_records(path, file_format):
+    """Streams records from a CSV or newline-delimited JSON file, one dict at a time."""
+    with open(path, newline='', encoding='utf-8') as file:
+        if file_format == 'csv':
+            for record in csv.DictReader(file):
+                # Empty CSV cells mean the optional field was not given
+                yield {field: value for field, value in record.items() if value not in ('', None)}
+        else:
+            for line in file:
+                if not line.strip():
+                    continue
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    yield None   # Rejected as invalid by the schema
+
+
+def load_checkpoint(path):
+    """Returns the progress saved by an interrupted import, if any."""
+    try:
+        with open(path) as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return None
+
+
+def save_checkpoint(path, progress):
+    """Saves the import progress atomically, so a crash never leaves a half-written checkpoint."""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as file:
+        json.dump(progress, file)
+    os.replace(tmp_path, path)
+
+
+def import_batch(records, on_duplicate):
+    """Validates and writes one batch of records in a single transaction. Returns per-outcome counts."""
+    # Exports write the optional fields a cafe doesn't have as null, which means not given, like empty CSV cells
+    records = [{field: value for field, value in record.items() if value is not None or field not in OPTIONAL_FIELDS}
+               if isinstance(record, dict) else record for record in records]
+    loaded, errors = load_cafes(records, unknown=EXCLUDE)
+    counts = {'inserted': 0, 'updated': 0, 'skipped': 0, 'invalid': len(errors)}
+
+    # Later records with the same name replace earlier ones within a batch
+    valid = {}
+    for data in loaded:
+        if data is None:
+            continue
+        if data['name'] in valid:
+            counts['skipped'] += 1
+        data.update(location_fields(data['map_url']))
+        data.update(price_fields(data['coffee_price'], data['currency']))
+        valid[data['name']] = data
+
+    if not valid:
+        return counts
+
+    existing = {row.name: row for row in db.session.execute(
+        db.select(Cafe.name, Cafe.id, Cafe.images, *STATS_COLUMNS).where(Cafe.name.in_(valid)))}
+    new_rows = [data for name, data in valid.items() if name not in existing]
+    if new_rows:
+        db.session.execute(db.insert(Cafe), new_rows)
+        for data in new_rows:
+            retain_images(data.get('images'))
+        update_stats(added=[stats_entry(data) for data in new_rows])
+        counts['inserted'] = len(new_rows)
+
+    orphans = []
+    if on_duplicate == 'upsert':
+        updated_at = datetime.utcnow()
+        update_rows = [{'id': existing[name].id, 'updated_at': updated_at, **data}
+                       for name, data in valid.items() if name in existing]
+        if update_rows:
+            db.session.execute(db.update(Cafe), update_rows)
+            replaced = [(data['images'], existing[name].images) for name, data in valid.items()
+                        if name in existing and data.get('images', existing[name].images) != existing[name].images]
+            for new_images, old_images in replaced:
+                retain_images(new_images)
+            for new_images, old_images in replaced:
+                orphans += release_images(old_images)
+            update_stats(removed=[stats_entry(row) for name, row in existing.items() if name in valid],
+                         added=[stats_entry(data) for name, data in valid.items() if name in existing])
+            counts['updated'] = len(update_rows)
+    else:
+        counts['skipped'] += len(valid) - len(new_rows)
+
+    if counts['inserted'] or counts['updated']:
+        Cafe.touch_catalog()
+    db.session.commit()
+    delete_blobs(orphans)
+    return counts
+
+
+@cafes_cli.command('import')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', 'file_format', type=click.Choice(['csv', 'ndjson']),
+              help='File format. Defaults to the file extension.')
+@click.option('--batch-size', default=1000, show_default=True, type=click.IntRange(min=1),
+              help='Number of records validated and committed per transaction.')
+@click.option('--on-duplicate', type=click.Choice(['skip', 'upsert']), default='skip', show_default=True,
+              help='What to do with records whose name already exists.')
+@click.option('--checkpoint', 'checkpoint_path', type=click.Path(dir_okay=False),
+              help='Progress file used to resume an interrupted import. Defaults to PATH.checkpoint.')
+@click.option('--restart', is_flag=True, help='Ignore any saved progress and start from the first record.')
+def import_cafes(path, file_format, batch_size, on_duplicate, checkpoint_path, restart):
+    """Imports cafes from a CSV or NDJSON file, e.g. one produced by /api/cafes/export."""
+    file_format = file_format or ('csv' if path.lower().endswith('.csv') else 'ndjson')
+    checkpoint_path = checkpoint_path or f"{path}.checkpoint"
+
+    progress = None if restart else load_checkpoint(checkpoint_path)
+    if progress:
+        click.echo(f"Resuming after record {progress['records']}.")
+    else:
+        progress = {'records': 0, 'inserted': 0, 'updated': 0, 'skipped': 0, 'invalid': 0}
+
+    start_time = time.perf_counter()
+    processed = 0
+    batch = []
+    records = read_records(path, file_format)
+
+    # Skip the records already committed by the interrupted run
+    for _ in zip(range(progress['records']), records):
+        pass
+
+    def flush():
+        counts = import_batch(batch, on_duplicate)
+        for outcome, count in counts.items():
+            progress[outcome] += count
+        progress['records'] += len(batch)
+        save_checkpoint(checkpoint_path, progress)
+        batch.clear()
+
+    for record in records:
+        batch.append(record)
+        processed += 1
+        if len(batch) >= batch_size:
+            flush()
+            click.echo(f"{progress['records']} records processed...")
+    if batch:
+        flush()
+
+    elapsed = time.perf_counter() - start_time
+    if os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
+    rate = processed / elapsed if elapsed else 0
+    click.echo(f"Imported {processed} records in {elapsed:.2f}s ({rate:.0f} rows/sec): "
+               f"{progress['inserted']} inserted, {progress['updated']} updated, "
+               f"{progress['skipped']} skipped, {progress['invalid']} invalid.")
+
+
+@cafes_cli.command('locate')
+@click.option('--all', 'relocate_all', is_flag=True, help='Recompute every cafe, not only those never located.')
+@click.option('--batch-size', default=1000, show_default=True, type=click.IntRange(min=1),
+              help='Number of cafes updated per transaction.')
+def locate_cafes(relocate_all, batch_size):
+    """Fills in the coordinates and geohash of cafes from their map links."""
+    query = db.select(Cafe.id, Cafe.map_url).order_by(Cafe.id)
+    if not relocate_all:
+        query = query.where(Cafe.geohash.is_(None))
+
+    last_id = 0
+    located = missing = 0
+    while True:
+        # Keyset batches, so rows located by an earlier batch never shift the next one
+        batch = db.session.execute(query.where(Cafe.id > last_id).limit(batch_size)).all()
+        if not batch:
+            break
+        last_id = batch[-1].id
+        rows = [{'id': cafe_id, **location_fields(map_url)} for cafe_id, map_url in batch]
+        db.session.execute(db.update(Cafe), rows)
+        Cafe.touch_catalog()
+        db.session.commit()
+        found = sum(1 for row in rows if row['geohash'])
+        located += found
+        missing += len(rows) - found
+
+    click.echo(f"Located {located} cafes; {missing} map links have no coordinates.")
+
+
+@cafes_cli.command('rebuild-stats')
+def rebuild_cafe_stats():
+    """Recomputes the per-city and per-country statistics from the cafes."""
+    rebuild_stats(db.session.connection())
+    db.session.commit()
+    click.echo(f"Rebuilt {db.session.scalar(db.select(db.func.count()).select_from(CafeStats))} statistics rows.")
+
+
+@cafes_cli.command('rebuild-images')
+@click.option('--dry-run', is_flag=True, help='Only report what would change.')
+@click.option('--min-age', type=int, default=BLOB_GRACE_SECONDS, show_default=True,
+              help='Seconds since an unreferenced file was written before it is deleted; newer ones may be uploads '
+                   'whose transaction is still open.')
+def rebuild_images(dry_run, min_age):
+    """Moves uploads to content-addressed blobs, recounts references and deletes orphaned files."""
+    renamed = 0
+    moved = {}   # legacy path -> blob path, shared by every cafe referencing the same file
+    cafes = db.session.execute(db.select(Cafe.id, Cafe.images).where(Cafe.images.is_not(None))).all()
+
+    # Re-address uploads saved before content addressing, merging byte-identical copies
+    for cafe_id, images in cafes:
+        paths = image_paths(images)
+        legacy = [path for path in paths if path in moved or (
+            is_managed(path) and not BLOB_NAME.match(os.path.basename(path)) and os.path.exists(path))]
+        if not legacy:
+            continue
+        renamed += 1
+        if dry_run:
+            continue
+
+        new_paths = []
+        for path in paths:
+            if path in legacy and path not in moved:
+                extension = path.rsplit('.', 1)[1].lower()
+                with open(path, 'rb') as file:
+                    moved[path] = store_blob(file, 'jpg' if extension == 'jpeg' else extension)
+                os.remove(path)
+            new_paths.append(moved.get(path, path))
+        variants = {path: generate_variants(path) for path in new_paths if is_managed(path) and os.path.exists(path)}
+        db.session.execute(db.update(Cafe).where(Cafe.id == cafe_id)
+                           .values(images=','.join(new_paths), image_variants=variants))
+
+    # Recount references from scratch
+    references = Counter()
+    for images in db.session.scalars(db.select(Cafe.images).where(Cafe.images.is_not(None))):
+        references.update(path for path in image_paths(images) if is_managed(path))
+    if not dry_run:
+        db.session.execute(db.delete(ImageBlob))
+        if references:
+            db.session.execute(db.insert(ImageBlob),
+                               [{'path': path, 'ref_count': count} for path, count in references.items()])
+        if renamed:
+            Cafe.touch_catalog()
+        db.session.commit()
+
+    # Anything in the upload folder that isn't a referenced image or one of its variants is an orphan
+    keep = set(references)
+    for path in references:
+        keep.update(variant_path(path, size, image_format)
+                    for size in VARIANT_SIZES for image_format in VARIANT_FORMATS)
+    files = [os.path.join(UPLOAD_FOLDER, entry.name) for entry in os.scandir(UPLOAD_FOLDER)
+             if entry.is_file() and not entry.name.endswith('.part')]
+    orphans = [path for path in files if path not in keep and not is_recent(path, min_age)]
+    if not dry_run:
+        for path in orphans:
+            os.remove(path)
+
+    action = 'Would delete' if dry_run else 'Deleted'
+    click.echo(f"Re-addressed the images of {renamed} cafes; {len(references)} referenced images. "
+               f"{action} {len(orphans)} orphaned files.")
+
+
+@db_cli.command('init')
+def init_database():
+    """Creates the tables of a new database, or applies the pending migrations of an existing one."""
+    fresh = not db.inspect(db.engine).has_table('cafe')
+    migrations.setup_database()
+    click.echo("Created the database schema." if fresh else "The database schema is up to date.")
+
+
+@db_cli.command('upgrade')
+def upgrade_database():
+    """Applies the pending schema migrations."""
+    applied = migrations.upgrade()
+    for step in applied:
+        click.echo(f"Applied {step.version}: {step.description}")
+    if not applied:
+        click.echo("The database is up to date.")
+
+
+@db_cli.command('status')
+def database_status():
+    """Lists the schema migrations and whether each has been applied."""
+    applied = migrations.applied_versions()
+    for step in sorted(migrations.MIGRATIONS):
+        state = 'applied' if step.version in applied else 'pending'
+        click.echo(f"{step.version:>4}  {state:<8} {step.description}")
+
+
+@db_cli.command('check-plans')
+def check_query_plans():
+    """Checks with EXPLAIN that the hot queries use their indexes. Exits with 1 if any doesn't."""
+    failures = 0
+    for description, index, used, plan in migrations.check_query_plans():
+        click.echo(f"{'ok' if used else 'FAIL':<5} {description}: {plan}")
+        if not used:
+            failures += 1
+            click.echo(f"      expected {index}")
+    if failures:
+        raise SystemExit(1)
+
+
+@assets_cli.command('build')
+def build_static_assets():
+    """Writes content-hashed, precompressed copies of the static files. Restart the app to serve them."""
+    start_time = time.perf_counter()
+    manifest = static_assets.build(current_app.static_folder)
+
+    sizes = Counter()
+    for hashed in manifest['files'].values():
+        path = os.path.join(static_assets.build_folder, hashed)
+        size = os.path.getsize(path)
+        sizes['files'] += size
+        for encoding in manifest['encodings'].get(hashed, ()):
+            sizes['original', encoding] += size
+            sizes[encoding] += os.path.getsize(f"{path}.{ENCODING_EXTENSIONS[encoding]}")
+
+    click.echo(f"Built {len(manifest['files'])} files ({sizes['files'] / 1e6:.1f} MB) into "
+               f"{static_assets.build_folder} in {time.perf_counter() - start_time:.1f}s.")
+    for encoding in ENCODING_EXTENSIONS:
+        if sizes['original', encoding]:
+            click.echo(f"  {encoding}: {sizes['original', encoding] / 1e6:.1f} MB of text files served as "
+                       f"{sizes[encoding] / 1e6:.1f} MB")
@@ -0,0 +1,98 @@
+from flask import has_request_context, request
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event, Select, String
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.functions import FunctionElement
+
+# Name of the SQLALCHEMY_BINDS engine that read-only queries are routed to when READ_DATABASE_URI is set
+REPLICA_BIND = 'replica'
+
+
+class nocase(FunctionElement):
+    """Case-insensitive form of a string expression, for comparisons, grouping and indexes.
+
+    Compiles to `x COLLATE NOCASE` on SQLite and to lower(x) elsewhere. Use it on both sides of a comparison,
+    e.g. nocase(Cafe.city) == nocase(city), so that an index on nocase(Cafe.city) serves it on every database.
+    """
+    type = String()
+    name = 'nocase'
+    inherit_cache = True
+
+
+@compiles(nocase)
+def compile_nocase(element, compiler, **kw):
+    return f"lower({compiler.process(element.clauses, **kw)})"
+
+
+@compiles(nocase, 'sqlite')
+def compile_nocase_sqlite(element, compiler, **kw):
+    return f"{compiler.process(element.clauses, **kw)} COLLATE NOCASE"
+
+
+def engine_options(config):
+    """Returns the SQLAlchemy engine options of the configured DATABASE_PROFILE."""
+    if config['DATABASE_PROFILE'] == 'sqlite':
+        # Wait for a writer to finish instead of failing at once with 'database is locked'
+        return {'connect_args': {'timeout': config['SQLITE_BUSY_TIMEOUT_MS'] / 1000}}
+    return {
+        'pool_size': config['DB_POOL_SIZE'],
+        'max_overflow': config['DB_MAX_OVERFLOW'],
+        'pool_recycle': config['DB_POOL_RECYCLE'],
+        'pool_pre_ping': config['DB_POOL_PRE_PING'],
+    }
+
+
+def database_binds(config):
+    """Returns the SQLALCHEMY_BINDS for the read replica, if one is configured."""
+    if not config.get('READ_DATABASE_URI'):
+        return {}
+    return {REPLICA_BIND: {'url': config['READ_DATABASE_URI'], **engine_options(config)}}
+
+
+def configure_sqlite(engine, config):
+    """Sets the WAL journal and tuning pragmas on every new connection of a SQLite engine.
+
+    WAL lets readers keep reading while a write is in progress, so workers only wait for each other
+    when they write at the same time, and synchronous=NORMAL is safe under WAL.
+    """
+    pragmas = [
+        'PRAGMA journal_mode=WAL',
+        f"PRAGMA synchronous={config['SQLITE_SYNCHRONOUS']}",
+        f"PRAGMA busy_timeout={int(config['SQLITE_BUSY_TIMEOUT_MS'])}",
+        f"PRAGMA mmap_size={int(config['SQLITE_MMAP_SIZE'])}",
+    ]
+
+    @event.listens_for(engine, 'connect')
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for pragma in pragmas:
+            cursor.execute(pragma)
+        cursor.close()
+
+
+def reads_from_replica():
+    """Checks whether the current request may read from the replica. Only GET and HEAD requests do."""
+    return has_request_context() and request.method in ('GET', 'HEAD')
+
+
+class RoutingSession(Session):
+    """Session sending SELECTs issued by GET requests to the read replica, and everything else to the primary.
+
+    Once the session flushes or runs anything but a plain SELECT, it sticks to the primary until it is closed,
+    so that a request that writes reads its own writes and its row locks instead of a lagging replica.
+    """
+    pinned = False
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and not self.pinned and reads_from_replica():
+            if self._flushing or not isinstance(clause, Select) or clause._for_update_arg is not None:
+                self.pinned = True
+            else:
+                replica = self._db.engines.get(REPLICA_BIND)
+                if replica is not None:
+                    return replica
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+    def close(self):
+        super().close()
+        self.pinned = False
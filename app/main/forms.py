@@ -1,28 +1,37 @@
 from flask_wtf import FlaskForm
 from flask_wtf.file import FileField, FileAllowed
 from wtforms import StringField, IntegerField, FloatField, TextAreaField, SelectField, BooleanField, PasswordField, SubmitField
-from wtforms.validators import DataRequired, URL, Length, Email, EqualTo, ValidationError, NumberRange
+from wtforms.validators import DataRequired, URL, Length, Email, EqualTo, ValidationError, NumberRange, AnyOf
 from .data import COUNTRIES, CURRENCIES, STAR_RATINGS
 from .models import User
+from .validation import (NAME_LENGTH, CITY_LENGTH, REVIEW_LENGTH, COUNTRY_CHOICES, CURRENCY_CHOICES, WIFI_CHOICES,
+                         RATING_CHOICES)
 import re
 
+# Select fields check their value with a set lookup instead of scanning their choices
+NOT_A_CHOICE = 'Not a valid choice.'
+
 
 class CafeForm(FlaskForm):
-    name = StringField('Cafe name', validators=[DataRequired(), Length(min=2, max=30)])
-    city = StringField('City', validators=[DataRequired(), Length(min=2, max=25)])
-    country = SelectField('Country', choices=COUNTRIES, validators=[DataRequired()], default='United States (US)')
+    name = StringField('Cafe name', validators=[DataRequired(), Length(*NAME_LENGTH)])
+    city = StringField('City', validators=[DataRequired(), Length(*CITY_LENGTH)])
+    country = SelectField('Country', choices=COUNTRIES, default='United States (US)', validate_choice=False,
+                          validators=[DataRequired(), AnyOf(COUNTRY_CHOICES, NOT_A_CHOICE)])
     map_url = StringField('Map URL', validators=[DataRequired(), URL()])
     coffee_price = FloatField('Coffee Price', validators=[DataRequired()])
-    currency = SelectField('Currency', choices=CURRENCIES, validators=[DataRequired()], default='$')
-    wifi_strength = SelectField('Wifi Strength', choices=STAR_RATINGS, validators=[DataRequired()])
+    currency = SelectField('Currency', choices=CURRENCIES, default='$', validate_choice=False,
+                           validators=[DataRequired(), AnyOf(CURRENCY_CHOICES, NOT_A_CHOICE)])
+    wifi_strength = SelectField('Wifi Strength', choices=STAR_RATINGS, validate_choice=False,
+                                validators=[DataRequired(), AnyOf(WIFI_CHOICES, NOT_A_CHOICE)])
     seats = IntegerField('Seats', validators=[DataRequired(), NumberRange(min=0)])
     has_sockets = SelectField('Has Sockets', choices=[('True', 'Yes'), ('False', 'No')], default='False',
                               validators=[DataRequired()])
     has_toilet = SelectField('Has Toilet', choices=[('True', 'Yes'), ('False', 'No')], default='False',
                              validators=[DataRequired()])
     images = FileField('Cafe Images', validators=[FileAllowed(['png', 'jpg', 'jpeg', 'gif'], 'Images only!')])
-    full_review = TextAreaField('Full Review', validators=[Length(min=3, max=300)])
-    full_rating = SelectField('Full Rating', choices=STAR_RATINGS[1:], validators=[DataRequired()])
+    full_review = TextAreaField('Full Review', validators=[Length(*REVIEW_LENGTH)])
+    full_rating = SelectField('Full Rating', choices=STAR_RATINGS[1:], validate_choice=False,
+                              validators=[DataRequired(), AnyOf(RATING_CHOICES, NOT_A_CHOICE)])
     submit = SubmitField('Add Cafe')
 
 
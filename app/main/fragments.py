@@ -0,0 +1,67 @@
+"""Template fragment cache: {% cache 'name', key, ... %}...{% endcache %} renders its body once per catalog version.
+
+The rendered markup is kept in the response cache's backend under the database catalog version, the template,
+the block and its key values, so no worker reuses it once any process has changed the catalog. Blocks must only
+depend on their key values, the catalog and the static build they link, so flashed messages and forms with CSRF
+tokens stay outside of them.
+"""
+from jinja2 import nodes, FileSystemBytecodeCache
+from jinja2.ext import Extension
+from markupsafe import Markup
+from app.main.cache import catalog_version, private_directory
+import hashlib
+
+
+class FragmentCache(Extension):
+    """Jinja extension adding the {% cache %} tag."""
+    tags = {'cache'}
+
+    def __init__(self, environment):
+        super().__init__(environment)
+        environment.extend(fragment_cache=None, fragment_timeout=None, fragment_release='')
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+        key = [parser.parse_expression()]
+        while parser.stream.skip_if('comma'):
+            key.append(parser.parse_expression())
+        body = parser.parse_statements(('name:endcache',), drop_needle=True)
+
+        # Blocks are told apart by template and line, and by the template's source so that a new release never
+        # reuses the markup of an older one from a shared cache
+        source, _, _ = self.environment.loader.get_source(self.environment, parser.name)
+        block = f"{parser.name}:{lineno}:{hashlib.sha1(source.encode()).hexdigest()[:12]}"
+        return nodes.CallBlock(self.call_method('_render', [nodes.Const(block), nodes.List(key)]),
+                               [], [], body).set_lineno(lineno)
+
+    def _render(self, block, key, caller):
+        cache = self.environment.fragment_cache
+        if cache is None:
+            return caller()
+        cache_key = f"fragment:{catalog_version()}:{self.environment.fragment_release}:{block}:{key!r}"
+        markup = cache.backend.get(cache_key)
+        if markup is None:
+            markup = caller()
+            cache.backend.set(cache_key, str(markup), self.environment.fragment_timeout or cache.default_timeout)
+        return Markup(markup)
+
+
+def init_templates(app, cache, release=''):
+    """Adds the {% cache %} tag backed by a ResponseCache, and the on-disk bytecode cache, to an app's templates.
+
+    release names the static build the pages link, so that fragments cached by workers of an older build are
+    not reused by those of a newer one.
+    """
+    app.jinja_env.add_extension(FragmentCache)
+    if app.config['FRAGMENT_CACHE_ENABLED']:
+        app.jinja_env.fragment_cache = cache
+        app.jinja_env.fragment_timeout = app.config['FRAGMENT_CACHE_TIMEOUT']
+        app.jinja_env.fragment_release = release
+    # Compiled templates are shared by every worker and kept across restarts; each file is checked against its
+    # template's source, so an edited template is compiled again. They are loaded as code, so the directory must
+    # be private to the app's user: Jinja creates and checks its default one itself.
+    directory = app.config['TEMPLATE_BYTECODE_DIR']
+    if directory is None:
+        app.jinja_env.bytecode_cache = FileSystemBytecodeCache()
+    elif directory:
+        app.jinja_env.bytecode_cache = FileSystemBytecodeCache(private_directory(directory))
@@ -0,0 +1,103 @@
+from urllib.parse import unquote_plus
+import math
+import re
+
+
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE = 2 * math.pi * EARTH_RADIUS_KM / 360
+GEOHASH_PRECISION = 9   # About 5 m, far finer than any search radius
+GEOHASH_ALPHABET = '0123456789bcdefghjkmnpqrstuvwxyz'
+
+_NUMBER = r'(-?\d{1,3}(?:\.\d+)?)'
+# Tried in order: the pin of a place link, a coordinate query, then the centre of the map view
+COORDINATE_PATTERNS = [
+    re.compile(rf'!3d{_NUMBER}!4d{_NUMBER}'),
+    re.compile(rf'[?&](?:q|query|ll|sll|center|destination|daddr)=(?:loc:)?{_NUMBER}\s*,\s*{_NUMBER}'),
+    re.compile(rf'@{_NUMBER},{_NUMBER}'),
+]
+
+
+def parse_coordinates(map_url):
+    """Extracts (latitude, longitude) from a Google Maps link, or returns None if it has no coordinates."""
+    url = unquote_plus(map_url or '')
+    for pattern in COORDINATE_PATTERNS:
+        match = pattern.search(url)
+        if match:
+            latitude, longitude = float(match.group(1)), float(match.group(2))
+            if -90 <= latitude <= 90 and -180 <= longitude <= 180:
+                return latitude, longitude
+    return None
+
+
+def encode_geohash(latitude, longitude, precision=GEOHASH_PRECISION):
+    """Encodes a point as a geohash. Points sharing a prefix lie in the same cell."""
+    lat_range, lon_range = [-90.0, 90.0], [-180.0, 180.0]
+    geohash = []
+    bits = 0
+    value = 0
+    even = True   # Bits alternate between longitude and latitude, starting with longitude
+    while len(geohash) < precision:
+        interval, coordinate = (lon_range, longitude) if even else (lat_range, latitude)
+        middle = (interval[0] + interval[1]) / 2
+        value <<= 1
+        if coordinate >= middle:
+            value |= 1
+            interval[0] = middle
+        else:
+            interval[1] = middle
+        even = not even
+        bits += 1
+        if bits == 5:
+            geohash.append(GEOHASH_ALPHABET[value])
+            bits = value = 0
+    return ''.join(geohash)
+
+
+def cell_size(precision):
+    """Returns the (height, width) in degrees of a geohash cell."""
+    lat_bits = 5 * precision // 2
+    lon_bits = 5 * precision - lat_bits
+    return 180 / 2 ** lat_bits, 360 / 2 ** lon_bits
+
+
+def location_fields(map_url):
+    """Returns the latitude, longitude and geohash column values for a map link."""
+    coordinates = parse_coordinates(map_url)
+    if not coordinates:
+        return {'latitude': None, 'longitude': None, 'geohash': None}
+    latitude, longitude = coordinates
+    return {'latitude': latitude, 'longitude': longitude, 'geohash': encode_geohash(latitude, longitude)}
+
+
+def covering_cells(latitude, longitude, radius_km):
+    """Returns the geohash prefixes of the cells that together cover a circle.
+
+    The longest prefix whose cells are at least as large as the radius is used, so the circle
+    always fits in the cell containing its centre and the eight around it. Returns None when
+    even the largest cells are too small, meaning every located cafe must be checked.
+    """
+    radius_lat = radius_km / KM_PER_DEGREE
+    # Degrees of longitude grow shorter towards the poles, so measure at the circle's poleward edge
+    poleward = min(abs(latitude) + radius_lat, 90)
+    radius_lon = radius_km / (KM_PER_DEGREE * max(math.cos(math.radians(poleward)), 1e-6))
+    for precision in range(GEOHASH_PRECISION, 0, -1):
+        height, width = cell_size(precision)
+        if height >= radius_lat and width >= radius_lon:
+            break
+    else:
+        return None
+
+    cells = set()
+    for d_lat in (-height, 0, height):
+        for d_lon in (-width, 0, width):
+            cell_lat = min(max(latitude + d_lat, -90), 90)
+            cell_lon = (longitude + d_lon + 180) % 360 - 180
+            cells.add(encode_geohash(cell_lat, cell_lon, precision))
+    return sorted(cells)
+
+
+def distance_km(lat1, lon1, lat2, lon2):
+    """Returns the great-circle distance between two points."""
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
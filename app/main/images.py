@@ -0,0 +1,105 @@
+from concurrent.futures import ThreadPoolExecutor
+from flask import current_app
+import os
+
+
+STATIC_PREFIX = 'app/main/static/'
+
+# Longest edge, in pixels, of each generated variant
+VARIANT_SIZES = {
+    'thumb': 320,
+    'display': 1280,
+}
+
+VARIANT_FORMATS = {
+    'jpeg': ('.jpg', {'format': 'JPEG', 'quality': 82, 'optimize': True, 'progressive': True}),
+    'webp': ('.webp', {'format': 'WEBP', 'quality': 80, 'method': 4}),
+}
+
+_executor = None
+
+
+def get_executor():
+    """Returns the shared pool that generates variants off the request thread."""
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=current_app.config.get('IMAGE_WORKERS', 2),
+                                       thread_name_prefix='image-variants')
+    return _executor
+
+
+def variant_path(path, size, image_format):
+    """Returns where a variant of an uploaded image is stored, next to the original."""
+    stem = os.path.splitext(path)[0]
+    return f"{stem}_{size}{VARIANT_FORMATS[image_format][0]}"
+
+
+def generate_variants(path):
+    """Writes the resized JPEG and WebP variants of an image. Returns {size: {format: path}}."""
+    from PIL import Image, ImageOps   # Loaded with the first upload, not at startup
+
+    variants = {}
+    with Image.open(path) as image:
+        image = ImageOps.exif_transpose(image).convert('RGB')
+        for size, max_edge in VARIANT_SIZES.items():
+            resized = image.copy()
+            resized.thumbnail((max_edge, max_edge), Image.LANCZOS)   # Never upscales
+            variants[size] = {}
+            for image_format, (extension, options) in VARIANT_FORMATS.items():
+                output_path = variant_path(path, size, image_format)
+                if not os.path.exists(output_path):   # Blobs are shared, so their variants may exist already
+                    resized.save(output_path, **options)
+                variants[size][image_format] = output_path
+    return variants
+
+
+def process_cafe_images(app, cafe_id, images):
+    """Generates the variants of a cafe's uploads and records them on the cafe."""
+    from PIL import Image
+    from .models import db, Cafe
+    from . import cache
+
+    variants = {}
+    for path in filter(None, images.split(',')):
+        try:
+            variants[path] = generate_variants(path)
+        except (OSError, Image.DecompressionBombError):
+            app.logger.exception(f"Could not generate variants for {path}")
+
+    with app.app_context():
+        # Skip the update if the cafe's images were replaced while the variants were generated
+        result = db.session.execute(
+            db.update(Cafe).where(Cafe.id == cafe_id, Cafe.images == images).values(image_variants=variants))
+        if result.rowcount:
+            Cafe.touch_catalog()
+        db.session.commit()
+        if result.rowcount:
+            cache.invalidate()
+
+
+def schedule_variants(cafe):
+    """Queues variant generation for a cafe's uploaded images without blocking the request."""
+    if not cafe.images:
+        return None
+    app = current_app._get_current_object()
+    return get_executor().submit(process_cafe_images, app, cafe.id, cafe.images)
+
+
+def best_image_path(cafe, index=0, size='thumb', accept_webp=False):
+    """Returns the smallest stored file suitable for the requested size, or None if there is no image."""
+    images = [path for path in (cafe.images or '').split(',') if path]
+    if not 0 <= index < len(images):
+        return None
+
+    path = images[index]
+    variants = (cafe.image_variants or {}).get(path, {}).get(size)
+    if variants:
+        if accept_webp and 'webp' in variants:
+            return variants['webp']
+        return variants['jpeg']
+    return path
+
+
+def static_filename(path):
+    """Converts a stored upload path into a filename for url_for('static', ...)."""
+    return path[len(STATIC_PREFIX):] if path.startswith(STATIC_PREFIX) else None
@@ -0,0 +1,186 @@
+from bisect import bisect_left
+from collections import Counter as Tally
+from threading import Lock
+from flask import Response, abort, current_app, g, has_request_context, request, before_render_template, \
+    template_rendered
+from flask_login import current_user
+from sqlalchemy import event
+import hmac
+import time
+
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+
+def format_labels(names, values):
+    pairs = []
+    for name, value in zip(names, values):
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        pairs.append(f'{name}="{value}"')
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class Counter:
+    """Prometheus counter with labels."""
+
+    def __init__(self, name, description, labels):
+        self.name, self.description, self.labels = name, description, labels
+        self._values = {}
+        self._lock = Lock()
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.description}', f'# TYPE {self.name} counter']
+        with self._lock:
+            for label_values, value in sorted(self._values.items()):
+                lines.append(f'{self.name}{format_labels(self.labels, label_values)} {value}')
+        return lines
+
+
+class Histogram:
+    """Prometheus histogram with labels and fixed bucket upper bounds."""
+
+    def __init__(self, name, description, labels, buckets):
+        self.name, self.description, self.labels, self.buckets = name, description, labels, buckets
+        self._series = {}   # label values -> [count per bucket (the last one is +Inf), sum]
+        self._lock = Lock()
+
+    def observe(self, value, *label_values):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [[0] * (len(self.buckets) + 1), 0]
+            series[0][index] += 1
+            series[1] += value
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.description}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            for label_values, (counts, total) in sorted(self._series.items()):
+                cumulative = 0
+                for bound, count in zip([*self.buckets, '+Inf'], counts):
+                    cumulative += count
+                    labels = format_labels([*self.labels, 'le'], [*label_values, bound])
+                    lines.append(f'{self.name}_bucket{labels} {cumulative}')
+                labels = format_labels(self.labels, label_values)
+                lines.append(f'{self.name}_sum{labels} {total}')
+                lines.append(f'{self.name}_count{labels} {cumulative}')
+        return lines
+
+
+class Metrics:
+    """Per-process request, SQL and template instrumentation, exposed in Prometheus text format on /metrics."""
+
+    def __init__(self):
+        self.requests = Counter('http_requests_total', 'Requests handled.', ['endpoint', 'method', 'status'])
+        self.latency = Histogram('http_request_duration_seconds', 'Time to build the response.',
+                                 ['endpoint', 'method'], LATENCY_BUCKETS)
+        self.response_size = Histogram('http_response_size_bytes', 'Size of response bodies of known length.',
+                                       ['endpoint'], SIZE_BUCKETS)
+        self.sql_queries = Histogram('db_queries_per_request', 'SQL statements executed per request.',
+                                     ['endpoint'], QUERY_COUNT_BUCKETS)
+        self.sql_time = Histogram('db_query_seconds_per_request', 'Total SQL execution time per request.',
+                                  ['endpoint'], LATENCY_BUCKETS)
+        self.render_time = Histogram('template_render_seconds', 'Time to render a template.',
+                                     ['template'], LATENCY_BUCKETS)
+        self.slow_request_ms = 0
+
+    def init_app(self, app):
+        if not app.config.get('METRICS_ENABLED', False):
+            return
+        self.slow_request_ms = app.config.get('SLOW_REQUEST_MS', 0)
+
+        app.before_request(self.start_request)
+        app.after_request(self.finish_request)
+        before_render_template.connect(self.start_render, app)
+        template_rendered.connect(self.finish_render, app)
+        with app.app_context():
+            for engine in app.extensions['sqlalchemy'].engines.values():
+                self.instrument_engine(engine)
+        app.add_url_rule('/metrics', 'metrics', self.export)
+
+    def instrument_engine(self, engine):
+        """Times the statements of an engine into the metrics of the request that runs them."""
+        event.listen(engine, 'before_cursor_execute', self.start_query)
+        event.listen(engine, 'after_cursor_execute', self.finish_query)
+        event.listen(engine, 'handle_error', self.fail_query)
+
+    def start_request(self):
+        g.metrics_started = time.perf_counter()
+        g.sql_queries = []
+
+    def finish_request(self, response):
+        started = g.get('metrics_started')
+        if started is None:
+            return response
+        duration = time.perf_counter() - started
+        endpoint = request.endpoint or 'unmatched'
+        queries = g.get('sql_queries', [])
+        sql_time = sum(query_time for _, query_time in queries)
+
+        self.requests.inc(endpoint, request.method, response.status_code)
+        self.latency.observe(duration, endpoint, request.method)
+        self.sql_queries.observe(len(queries), endpoint)
+        self.sql_time.observe(sql_time, endpoint)
+        if response.content_length is not None:   # Streamed responses have no length yet
+            self.response_size.observe(response.content_length, endpoint)
+
+        if self.slow_request_ms and duration * 1000 >= self.slow_request_ms:
+            self.log_slow_request(duration, queries, sql_time)
+        return response
+
+    def log_slow_request(self, duration, queries, sql_time):
+        # Identical statements are grouped, so an N+1 loop shows up as one statement run many times
+        counts, times = Tally(), Tally()
+        for statement, query_time in queries:
+            counts[statement] += 1
+            times[statement] += query_time
+        lines = [f'Slow request: {request.method} {request.full_path.rstrip("?")} took {duration * 1000:.1f} ms, '
+                 f'{len(queries)} queries in {sql_time * 1000:.1f} ms']
+        for statement, total in times.most_common():
+            lines.append(f'  {counts[statement]} x {total * 1000:.1f} ms  {" ".join(statement.split())}')
+        current_app.logger.warning('\n'.join(lines))
+
+    def start_query(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+    def finish_query(self, conn, cursor, statement, parameters, context, executemany):
+        duration = time.perf_counter() - conn.info['query_started'].pop()
+        if has_request_context():
+            queries = g.get('sql_queries')
+            if queries is not None:
+                queries.append((statement, duration))
+
+    def fail_query(self, context):
+        # A failed statement never reaches after_cursor_execute; drop its start so the next one isn't timed from it
+        started = context.connection.info.get('query_started') if context.connection is not None else None
+        if started and context.execution_context is not None:
+            started.pop()
+
+    def start_render(self, app, template, context, **extra):
+        if has_request_context():
+            g.setdefault('render_started', []).append(time.perf_counter())
+
+    def finish_render(self, app, template, context, **extra):
+        started = g.get('render_started') if has_request_context() else None
+        if started:
+            self.render_time.observe(time.perf_counter() - started.pop(), template.name or 'string')
+
+    def export(self):
+        """Returns every metric in the Prometheus text exposition format, to admins and holders of METRICS_TOKEN."""
+        token = current_app.config.get('METRICS_TOKEN')
+        authorization = request.headers.get('Authorization', '')
+        if not (token and hmac.compare_digest(authorization.encode(), f'Bearer {token}'.encode())) \
+                and not (current_user.is_authenticated and current_user.is_admin):
+            abort(403)
+        lines = []
+        for metric in (self.requests, self.latency, self.response_size, self.sql_queries, self.sql_time,
+                       self.render_time):
+            lines.extend(metric.render())
+        return Response('\n'.join(lines) + '\n', mimetype='text/plain; version=0.0.4')
@@ -0,0 +1,199 @@
+from collections import namedtuple
+from datetime import datetime
+from sqlalchemy.exc import OperationalError, IntegrityError
+from .models import db, Cafe, CafeStats, SchemaMigration
+from .database import nocase
+from .geo import covering_cells
+from .pricing import price_fields
+from .stats import rebuild_stats
+import time
+
+
+# Versioned, forward-only schema changes. Never edit or reorder a released migration; add a new one instead.
+# db.create_all() builds fresh databases from the models directly, and they are marked as fully migrated.
+Migration = namedtuple('Migration', ['version', 'description', 'upgrade'])
+MIGRATIONS = []
+
+
+def migration(version, description):
+    """Registers a function taking a connection as the migration with the given version."""
+    def decorator(func):
+        MIGRATIONS.append(Migration(version, description, func))
+        return func
+    return decorator
+
+
+def cafe_columns(connection):
+    return {column['name'] for column in db.inspect(connection).get_columns('cafe')}
+
+
+def create_cafe_index(connection, name):
+    """Creates an index of the Cafe model as the models define it, for the database in use, unless it exists."""
+    index = next(index for index in Cafe.__table__.indexes if index.name == name)
+    index.create(connection, checkfirst=True)
+
+
+def analyze_cafes(connection):
+    """Gives the planner fresh statistics of the cafe table."""
+    dialect = connection.dialect.name
+    connection.execute(db.text('ANALYZE TABLE cafe' if dialect in ('mysql', 'mariadb') else 'ANALYZE cafe'))
+
+
+@migration(1, 'Add cafe.updated_at')
+def add_cafe_updated_at(connection):
+    if 'updated_at' not in cafe_columns(connection):
+        # DATETIME on SQLite and MySQL, TIMESTAMP on PostgreSQL
+        column_type = db.DateTime().compile(dialect=connection.dialect)
+        connection.execute(db.text(f'ALTER TABLE cafe ADD COLUMN updated_at {column_type}'))
+        connection.execute(db.text('UPDATE cafe SET updated_at = :now'), {'now': datetime.utcnow()})
+
+
+@migration(2, 'Add cafe.image_variants')
+def add_cafe_image_variants(connection):
+    if 'image_variants' not in cafe_columns(connection):
+        connection.execute(db.text('ALTER TABLE cafe ADD COLUMN image_variants JSON'))
+
+
+@migration(3, 'Add cafe coordinates and geohash')
+def add_cafe_location(connection):
+    # Filled in by 'flask cafes locate'
+    if 'geohash' not in cafe_columns(connection):
+        connection.execute(db.text('ALTER TABLE cafe ADD COLUMN latitude FLOAT'))
+        connection.execute(db.text('ALTER TABLE cafe ADD COLUMN longitude FLOAT'))
+        connection.execute(db.text('ALTER TABLE cafe ADD COLUMN geohash VARCHAR(12)'))
+    create_cafe_index(connection, 'ix_cafe_geohash')
+
+
+@migration(4, 'Add indexes for the listing, filter and sort access paths')
+def add_cafe_access_path_indexes(connection):
+    if connection.dialect.name != 'sqlite':
+        # The single-column NOCASE indexes below are SQLite-only, and migration 5 replaces them anyway
+        for name in ['ix_cafe_full_rating_id', 'ix_cafe_wifi_strength_rating', 'ix_cafe_city_id',
+                     'ix_cafe_country_id', 'ix_cafe_seats_id']:
+            create_cafe_index(connection, name)
+        analyze_cafes(connection)
+        return
+    for statement in [
+        'CREATE INDEX IF NOT EXISTS ix_cafe_full_rating_id ON cafe (full_rating, id)',
+        'CREATE INDEX IF NOT EXISTS ix_cafe_city_nocase ON cafe (city COLLATE NOCASE)',
+        'CREATE INDEX IF NOT EXISTS ix_cafe_country_nocase ON cafe (country COLLATE NOCASE)',
+        'CREATE INDEX IF NOT EXISTS ix_cafe_wifi_strength_rating ON cafe (wifi_strength, full_rating)',
+        'CREATE INDEX IF NOT EXISTS ix_cafe_city_id ON cafe (city, id)',
+        'CREATE INDEX IF NOT EXISTS ix_cafe_country_id ON cafe (country, id)',
+        'CREATE INDEX IF NOT EXISTS ix_cafe_seats_id ON cafe (seats, id)',
+    ]:
+        connection.execute(db.text(statement))
+    analyze_cafes(connection)   # Gives the planner statistics to choose between them
+
+
+@migration(5, 'Add cafe price and currency code, and the cafe_stats table')
+def add_cafe_price_and_stats(connection):
+    if 'price' not in cafe_columns(connection):
+        connection.execute(db.text('ALTER TABLE cafe ADD COLUMN price NUMERIC(10, 2)'))
+        connection.execute(db.text('ALTER TABLE cafe ADD COLUMN currency_code VARCHAR(3)'))
+    rows = []
+    for cafe_id, coffee_price, currency in connection.execute(db.text('SELECT id, coffee_price, currency FROM cafe')):
+        fields = price_fields(coffee_price, currency)
+        price = fields['price'] if fields['price'] is None else str(fields['price'])
+        rows.append({'id': cafe_id, 'price': price, 'currency_code': fields['currency_code']})
+    if rows:
+        connection.execute(db.text('UPDATE cafe SET price = :price, currency_code = :currency_code WHERE id = :id'),
+                           rows)
+    # `city COLLATE NOCASE` on SQLite, lower(city) elsewhere; see nocase()
+    create_cafe_index(connection, 'ix_cafe_city_price')
+    create_cafe_index(connection, 'ix_cafe_country_price')
+    if connection.dialect.name == 'sqlite':
+        connection.execute(db.text('DROP INDEX IF EXISTS ix_cafe_city_nocase'))       # Prefixes of the indexes above
+        connection.execute(db.text('DROP INDEX IF EXISTS ix_cafe_country_nocase'))
+    analyze_cafes(connection)
+    CafeStats.__table__.create(connection, checkfirst=True)
+    rebuild_stats(connection)
+
+
+def applied_versions():
+    """Returns the versions of the migrations already applied to the database."""
+    return set(db.session.scalars(db.select(SchemaMigration.version)))
+
+
+def pending_migrations():
+    """Returns the migrations not yet applied, oldest first."""
+    applied = applied_versions()
+    return [step for step in sorted(MIGRATIONS) if step.version not in applied]
+
+
+def upgrade():
+    """Applies every pending migration, each in its own transaction. Returns the applied migrations."""
+    applied = []
+    for step in pending_migrations():
+        with db.engine.begin() as connection:
+            step.upgrade(connection)
+            connection.execute(db.insert(SchemaMigration).values(version=step.version, description=step.description,
+                                                                 applied_at=datetime.utcnow()))
+        applied.append(step)
+    return applied
+
+
+def stamp():
+    """Marks every migration as applied, for databases that create_all built from the current models."""
+    db.session.execute(db.insert(SchemaMigration), [
+        {'version': step.version, 'description': step.description, 'applied_at': datetime.utcnow()}
+        for step in pending_migrations()])
+    db.session.commit()
+
+
+def setup_database(auto_migrate=True, attempts=3):
+    """Creates missing tables, then stamps a new database or migrates an existing one.
+
+    Workers starting together race to do this; the loser sees an 'already exists' or duplicate
+    version error and simply tries again against the schema the winner created.
+    """
+    for attempt in range(attempts):
+        try:
+            fresh = not db.inspect(db.engine).has_table('cafe')
+            db.create_all()
+            if fresh:
+                stamp()   # create_all already built the latest schema
+            elif auto_migrate:
+                upgrade()
+            return
+        except (OperationalError, IntegrityError):
+            db.session.rollback()
+            if attempt == attempts - 1:
+                raise
+            time.sleep(0.1 * (attempt + 1))
+
+
+def hot_queries():
+    """Returns (description, statement, expected index) for the queries behind the busiest pages."""
+    cafes = db.select(Cafe.id)
+    return [
+        ('Top rated listing page', cafes.where(Cafe.full_rating == 5).order_by(Cafe.id).limit(12),
+         'ix_cafe_full_rating_id'),
+        ('API city filter', cafes.where(nocase(Cafe.city) == nocase('Paris')), 'ix_cafe_city_price'),
+        ('API country filter', cafes.where(nocase(Cafe.country) == nocase('France (FR)')),
+         'ix_cafe_country_price'),
+        ('API min_wifi filter', cafes.where(Cafe.wifi_strength >= 5), 'ix_cafe_wifi_strength_rating'),
+        ('API sort by rating', cafes.order_by(Cafe.full_rating.desc(), Cafe.id).limit(100),
+         'ix_cafe_full_rating_id'),
+        ('API sort by city, next page', cafes.where(db.or_(Cafe.city > 'M', db.and_(Cafe.city == 'M', Cafe.id > 10)))
+         .order_by(Cafe.city, Cafe.id).limit(100), 'ix_cafe_city_id'),
+        ('API sort by country', cafes.order_by(Cafe.country, Cafe.id).limit(100), 'ix_cafe_country_id'),
+        ('API sort by seats', cafes.order_by(Cafe.seats, Cafe.id).limit(100), 'ix_cafe_seats_id'),
+        ('Cheapest coffee in a city', cafes.where(nocase(Cafe.city) == nocase('Paris'), Cafe.currency_code == 'EUR')
+         .order_by(Cafe.price).limit(5), 'ix_cafe_city_price'),
+        ('Nearby search', cafes.where(db.or_(*[db.and_(Cafe.geohash >= cell, Cafe.geohash < cell + '~')
+                                               for cell in covering_cells(48.8566, 2.3522, 10)])),
+         'ix_cafe_geohash'),
+    ]
+
+
+def check_query_plans():
+    """Runs EXPLAIN on the hot queries. Returns (description, expected index, used, plan) for each."""
+    dialect = db.engine.dialect
+    explain = 'EXPLAIN QUERY PLAN' if dialect.name == 'sqlite' else 'EXPLAIN'
+    results = []
+    for description, statement, index in hot_queries():
+        sql = str(statement.compile(dialect=dialect, compile_kwargs={'literal_binds': True}))
+        plan = ' | '.join(str(row[-1]) for row in db.session.execute(db.text(f"{explain} {sql}")))
+        results.append((description, index, index in plan, plan))
+    return results
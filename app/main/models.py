@@ -1,6 +1,11 @@
 from app.main import db
+from app.main.database import nocase
+from flask import g
 from flask_login import UserMixin
-from werkzeug.security import generate_password_hash, check_password_hash
+from .passwords import hash_password, verify_password, needs_rehash
+from .geo import location_fields, covering_cells, distance_km
+from .pricing import price_fields
+from datetime import datetime
 
 
 class Cafe(db.Model):
@@ -16,14 +21,89 @@ class Cafe(db.Model):
     has_sockets = db.Column(db.Boolean, nullable=False)
     has_toilet = db.Column(db.Boolean, nullable=False)
     images = db.Column(db.String, nullable=True)
+    image_variants = db.Column(db.JSON, nullable=True)
     full_review = db.Column(db.String(300), nullable=True)
     full_rating = db.Column(db.Integer, nullable=False)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow)
+    # Parsed from map_url by locate(); cafes whose link has no coordinates are left out of nearby searches
+    latitude = db.Column(db.Float, nullable=True)
+    longitude = db.Column(db.Float, nullable=True)
+    geohash = db.Column(db.String(12), nullable=True, index=True)
+    # Parsed from coffee_price and currency by set_price(), so prices can be compared and aggregated in SQL
+    price = db.Column(db.Numeric(10, 2), nullable=True)
+    currency_code = db.Column(db.String(3), nullable=True)
 
     def to_dict(self):
         """Converts the SQLAlchemy model instance into a dictionary."""
         model_dict = {column.name: getattr(self, column.name) for column in self.__table__.columns}
         return model_dict
 
+    def locate(self):
+        """Sets the coordinates and geohash from map_url. Call it whenever map_url changes."""
+        for field, value in location_fields(self.map_url).items():
+            setattr(self, field, value)
+
+    def set_price(self):
+        """Sets price and currency_code from coffee_price and currency. Call it whenever either changes."""
+        for field, value in price_fields(self.coffee_price, self.currency).items():
+            setattr(self, field, value)
+
+    @staticmethod
+    def nearby(latitude, longitude, radius_km, limit):
+        """Returns up to limit (cafe, distance in km) pairs within radius_km of a point, nearest first.
+
+        Only the cafes in the geohash cells covering the search circle are loaded.
+        """
+        query = Cafe.query.filter(Cafe.geohash.is_not(None))
+        cells = covering_cells(latitude, longitude, radius_km)
+        if cells is not None:
+            # Prefix ranges, so each cell is a range scan of the geohash index
+            query = query.filter(db.or_(*[db.and_(Cafe.geohash >= cell, Cafe.geohash < cell + '~')
+                                          for cell in cells]))
+        matches = []
+        for cafe in query:
+            distance = distance_km(latitude, longitude, cafe.latitude, cafe.longitude)
+            if distance <= radius_km:
+                matches.append((cafe, distance))
+        matches.sort(key=lambda match: (match[1], match[0].id))
+        return matches[:limit]
+
+    @staticmethod
+    def catalog_version():
+        """Returns the version and last modification time of the whole cafe catalog.
+
+        The version is also kept on g, so that the response cache keys a request's response on the version its
+        ETag was computed from.
+        """
+        state = db.session.get(CatalogState, 1)
+        version, updated_at = (state.version, state.updated_at) if state else (0, None)
+        g.catalog_version = version
+        return version, updated_at
+
+    @staticmethod
+    def touch_catalog():
+        """Bumps the catalog version. Call it in the same transaction as any change to the cafes."""
+        g.pop('catalog_version', None)
+        state = db.session.get(CatalogState, 1)
+        if not state:
+            db.session.add(CatalogState(id=1, version=1, updated_at=datetime.utcnow()))
+            return
+        state.version = CatalogState.version + 1   # Incremented in SQL, so concurrent writers don't collide
+        state.updated_at = datetime.utcnow()
+
+
+# Indexes for the listing, filter and sort access paths. Existing databases get them from migration 4.
+db.Index('ix_cafe_full_rating_id', Cafe.full_rating, Cafe.id)        # Top rated listing, rating filter/sort
+db.Index('ix_cafe_wifi_strength_rating', Cafe.wifi_strength, Cafe.full_rating)   # min_wifi filter
+db.Index('ix_cafe_city_id', Cafe.city, Cafe.id)                       # sort=city pages
+db.Index('ix_cafe_country_id', Cafe.country, Cafe.id)                 # sort=country pages
+db.Index('ix_cafe_seats_id', Cafe.seats, Cafe.id)                     # sort=seats pages
+
+# city/country filters and the cheapest coffee there, e.g. the minimum price of CafeStats. Added by migration 5,
+# which drops the single-column NOCASE indexes of migration 4 that these extend.
+db.Index('ix_cafe_city_price', nocase(Cafe.city), Cafe.currency_code, Cafe.price)
+db.Index('ix_cafe_country_price', nocase(Cafe.country), Cafe.currency_code, Cafe.price)
+
 
 class User(UserMixin, db.Model):
     __tablename__ = 'users'
@@ -36,11 +116,18 @@ class User(UserMixin, db.Model):
 
     def set_password(self, password):
         """Hashes the password and stores the hash."""
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = hash_password(password)
 
     def check_password(self, password):
-        """Checks the hashed password against the user-provided password."""
-        return check_password_hash(self.password_hash, password)
+        """Checks the hashed password against the user-provided password.
+
+        A hash made with an outdated method or cost is replaced on success; commit to keep it.
+        """
+        if not verify_password(self.password_hash, password):
+            return False
+        if needs_rehash(self.password_hash):
+            self.password_hash = hash_password(password)
+        return True
 
     def to_dict(self):
         """Converts the SQLAlchemy model instance into a dictionary."""
@@ -49,3 +136,51 @@ class User(UserMixin, db.Model):
             'username': self.username,
             'email': self.email,
         }
+
+
+class CatalogState(db.Model):
+    """Single-row table tracking the version of the cafe catalog."""
+    __tablename__ = 'catalog_state'
+
+    id = db.Column(db.Integer, primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+
+class CafeStats(db.Model):
+    """Running totals of the cafes in one city or country priced in one currency, kept up to date by update_stats()."""
+    __tablename__ = 'cafe_stats'
+
+    scope = db.Column(db.String(10), primary_key=True)   # 'city' or 'country'
+    # Case-insensitive on SQLite; elsewhere names are matched with nocase(), which stats.py always does
+    name = db.Column(db.String(30).with_variant(db.String(30, collation='NOCASE'), 'sqlite'), primary_key=True)
+    currency_code = db.Column(db.String(3), primary_key=True)
+    cafe_count = db.Column(db.Integer, nullable=False, default=0)
+    rating_sum = db.Column(db.Integer, nullable=False, default=0)
+    price_count = db.Column(db.Integer, nullable=False, default=0)
+    price_sum = db.Column(db.Numeric(14, 2), nullable=False, default=0)
+    min_price = db.Column(db.Numeric(10, 2), nullable=True)
+    # Number of cafes with each wifi strength
+    wifi_0 = db.Column(db.Integer, nullable=False, default=0)
+    wifi_1 = db.Column(db.Integer, nullable=False, default=0)
+    wifi_2 = db.Column(db.Integer, nullable=False, default=0)
+    wifi_3 = db.Column(db.Integer, nullable=False, default=0)
+    wifi_4 = db.Column(db.Integer, nullable=False, default=0)
+    wifi_5 = db.Column(db.Integer, nullable=False, default=0)
+
+
+class ImageBlob(db.Model):
+    """Content-addressed uploaded image and the number of cafe references to it."""
+    __tablename__ = 'image_blobs'
+
+    path = db.Column(db.String(350), primary_key=True)
+    ref_count = db.Column(db.Integer, nullable=False, default=0)
+
+
+class SchemaMigration(db.Model):
+    """A migration from app/main/migrations.py that has been applied to this database."""
+    __tablename__ = 'schema_migrations'
+
+    version = db.Column(db.Integer, primary_key=True)
+    description = db.Column(db.String(200), nullable=False)
+    applied_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
@@ -0,0 +1,52 @@
+from sqlalchemy import and_, or_
+import base64
+import json
+
+
+def encode_cursor(sort, value, last_id):
+    """Encodes the position after the last row of a page into an opaque token."""
+    payload = json.dumps([sort, value, last_id], separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(payload).decode().rstrip('=')
+
+
+def decode_cursor(token, sort):
+    """Decodes a cursor token into its (value, last id) pair. Raises ValueError if it is invalid."""
+    try:
+        payload = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        cursor_sort, value, last_id = json.loads(payload)
+    except (TypeError, ValueError, UnicodeDecodeError):
+        raise ValueError('Cursor is invalid.')
+    if cursor_sort != sort or not isinstance(last_id, int):
+        raise ValueError('Cursor does not match the requested sort order.')
+    return value, last_id
+
+
+def keyset_query(query, sort_column, id_column, limit, cursor=None, descending=False):
+    """Restricts a query or select to a page of rows after the cursor, plus one to tell whether another page follows.
+
+    Rows are ordered by the sort column with the id as a tie-breaker, so a page is a range
+    scan that starts where the previous one stopped instead of an OFFSET over skipped rows.
+    """
+    is_id_sort = sort_column is id_column
+
+    if cursor is not None:
+        value, last_id = cursor
+        if is_id_sort:
+            query = query.filter(id_column < last_id if descending else id_column > last_id)
+        else:
+            after = sort_column < value if descending else sort_column > value
+            query = query.filter(or_(after, and_(sort_column == value, id_column > last_id)))
+
+    order = sort_column.desc() if descending else sort_column.asc()
+    query = query.order_by(order) if is_id_sort else query.order_by(order, id_column.asc())
+    return query.limit(limit + 1)
+
+
+def page_rows(rows, sort, sort_column, id_column, limit):
+    """Splits the rows fetched by keyset_query into the page and the cursor for the next page."""
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        next_cursor = encode_cursor(sort, getattr(last, sort_column.key), getattr(last, id_column.key))
+    return rows, next_cursor
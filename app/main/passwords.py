@@ -0,0 +1,80 @@
+from concurrent.futures import ProcessPoolExecutor
+from threading import BoundedSemaphore, Lock
+from flask import current_app
+from werkzeug.security import generate_password_hash, check_password_hash, DEFAULT_PBKDF2_ITERATIONS
+import multiprocessing
+
+
+class HashingBusy(Exception):
+    """Raised when the password hashing queue is full."""
+
+
+_executor = None
+_slots = None
+_lock = Lock()
+
+
+def parse_method(method):
+    """Splits a hash method into its name and parameters, with Werkzeug's defaults for those left out.
+
+    e.g. 'scrypt:16384' -> ('scrypt', 16384, 8, 1), so that methods can be compared however they were written.
+    """
+    name, *args = method.split(':')
+    try:
+        if name == 'scrypt':
+            return (name, *[int(arg) for arg in args], *[32768, 8, 1][len(args):])
+        if name == 'pbkdf2':
+            return name, (args or ['sha256'])[0], int(args[1]) if len(args) > 1 else DEFAULT_PBKDF2_ITERATIONS
+    except ValueError:
+        pass
+    return (name, *args)
+
+
+def hash_method():
+    """Returns the configured hash method with Werkzeug's defaults filled in, e.g. 'scrypt:32768:8:1'."""
+    return ':'.join(str(part) for part in parse_method(current_app.config.get('PASSWORD_HASH_METHOD', 'scrypt')))
+
+
+def get_executor():
+    """Returns the shared process pool that hashes passwords off the request threads."""
+    global _executor, _slots
+    with _lock:
+        if _executor is None:
+            # Spawned, not forked: the pool starts from a request thread, and a fork would copy the locks
+            # other threads hold at that moment into the hashing processes
+            _executor = ProcessPoolExecutor(max_workers=current_app.config.get('HASH_WORKERS', 2),
+                                            mp_context=multiprocessing.get_context('spawn'))
+            _slots = BoundedSemaphore(current_app.config.get('HASH_QUEUE_SIZE', 16))
+    return _executor
+
+
+def run_hash(func, *args):
+    """Runs a hash function in the pool and waits for it. Raises HashingBusy when the queue is full."""
+    if not current_app.config.get('HASH_WORKERS', 2):
+        return func(*args)
+
+    executor = get_executor()
+    if not _slots.acquire(blocking=False):
+        raise HashingBusy()
+    try:
+        future = executor.submit(func, *args)
+    except BaseException:
+        _slots.release()
+        raise
+    future.add_done_callback(lambda _: _slots.release())
+    return future.result()
+
+
+def hash_password(password):
+    """Hashes a password with the configured method."""
+    return run_hash(generate_password_hash, password, hash_method())
+
+
+def verify_password(password_hash, password):
+    """Checks a password against its stored hash."""
+    return run_hash(check_password_hash, password_hash, password)
+
+
+def needs_rehash(password_hash):
+    """Checks whether a stored hash was made with a different method or cost than the configured one."""
+    return parse_method(password_hash.split('$', 1)[0]) != parse_method(hash_method())
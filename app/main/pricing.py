@@ -0,0 +1,21 @@
+from decimal import Decimal, InvalidOperation
+from .data import CURRENCIES
+
+# ISO 4217 codes of the currency symbols in CURRENCIES, e.g. '€' -> 'EUR'. 'XXX' is ISO's "no currency".
+CURRENCY_CODES = {symbol: label.split()[0] for symbol, label in CURRENCIES}
+NO_CURRENCY = 'XXX'
+CENT = Decimal('0.01')
+
+
+def parse_price(coffee_price):
+    """Returns a coffee_price string as a Decimal rounded to cents, or None if it is not a number."""
+    try:
+        price = Decimal(str(coffee_price).strip()).quantize(CENT)
+    except (InvalidOperation, ValueError):
+        return None
+    return price if price.is_finite() and price >= 0 else None
+
+
+def price_fields(coffee_price, currency):
+    """Returns the price and currency_code column values for a coffee_price and currency symbol."""
+    return {'price': parse_price(coffee_price), 'currency_code': CURRENCY_CODES.get(currency, NO_CURRENCY)}
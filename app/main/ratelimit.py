@@ -0,0 +1,102 @@
+from threading import local
+from flask import g
+from flask_limiter.util import get_remote_address
+from limits.storage import Storage
+from app.main.cache import user_temp_directory
+import os
+import sqlite3
+import time
+
+
+def default_storage_uri():
+    """Returns the URI of the counters file used when RATELIMIT_STORAGE_URI is unset, in a private temp directory."""
+    return f"sqlite:///{os.path.join(user_temp_directory('limits'), 'limits.db')}"
+
+
+def rate_limit_key():
+    """Keys limits on the authenticated API user, falling back to the client address."""
+    principal = g.get('principal')
+    if principal is not None:
+        return f"user:{principal.id}"
+    return get_remote_address()
+
+
+def is_admin_request():
+    """Exempts admin API calls from every limit, without touching anyone else's counters."""
+    principal = g.get('principal')
+    return principal is not None and principal.is_admin
+
+
+class SQLiteStorage(Storage):
+    """Fixed-window counters in a SQLite file, shared by every worker process on the host.
+
+    Configure it with RATELIMIT_STORAGE_URI = 'sqlite:///<path>'. Each hit is one atomic UPSERT,
+    so concurrent workers never lose an increment.
+    """
+
+    STORAGE_SCHEME = ['sqlite']
+    CLEANUP_INTERVAL = 1000   # hits between sweeps of expired counters
+
+    def __init__(self, uri, wrap_exceptions=False, **options):
+        super().__init__(uri, wrap_exceptions=wrap_exceptions, **options)
+        self.path = uri.split(':///', 1)[1]
+        self.timeout = float(options.get('timeout', 5))
+        self._local = local()
+        self._hits = 0
+        self._connection().execute('CREATE TABLE IF NOT EXISTS rate_limits '
+                                   '(key TEXT PRIMARY KEY, count INTEGER NOT NULL, expires_at REAL NOT NULL) '
+                                   'WITHOUT ROWID')
+
+    @property
+    def base_exceptions(self):
+        return sqlite3.Error
+
+    def _connection(self):
+        # One connection per thread, reopened after a fork so processes never share one
+        connection = getattr(self._local, 'connection', None)
+        if connection is None or self._local.pid != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None,
+                                         check_same_thread=False)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=OFF')   # Counters are disposable; losing them on a crash is fine
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
+
+    def incr(self, key, expiry, amount=1):
+        now = time.time()
+        count = self._connection().execute(
+            'INSERT INTO rate_limits (key, count, expires_at) VALUES (:key, :amount, :expires_at) '
+            'ON CONFLICT (key) DO UPDATE SET '
+            'count = CASE WHEN expires_at <= :now THEN excluded.count ELSE count + excluded.count END, '
+            'expires_at = CASE WHEN expires_at <= :now THEN excluded.expires_at ELSE expires_at END '
+            'RETURNING count',
+            {'key': key, 'amount': amount, 'expires_at': now + expiry, 'now': now}).fetchone()[0]
+
+        self._hits += 1
+        if self._hits % self.CLEANUP_INTERVAL == 0:
+            self._connection().execute('DELETE FROM rate_limits WHERE expires_at <= ?', (now,))
+        return count
+
+    def get(self, key):
+        row = self._connection().execute('SELECT count FROM rate_limits WHERE key = ? AND expires_at > ?',
+                                         (key, time.time())).fetchone()
+        return row[0] if row else 0
+
+    def get_expiry(self, key):
+        row = self._connection().execute('SELECT expires_at FROM rate_limits WHERE key = ? AND expires_at > ?',
+                                         (key, time.time())).fetchone()
+        return row[0] if row else time.time()
+
+    def check(self):
+        try:
+            self._connection().execute('SELECT 1')
+            return True
+        except sqlite3.Error:
+            return False
+
+    def reset(self):
+        return self._connection().execute('DELETE FROM rate_limits').rowcount
+
+    def clear(self, key):
+        self._connection().execute('DELETE FROM rate_limits WHERE key = ?', (key,))
@@ -1,19 +1,24 @@
-from flask import Blueprint, request, render_template, redirect, url_for, flash, jsonify
+from flask import Blueprint, request, render_template, redirect, url_for, flash, jsonify, abort
 from flask_login import login_user, logout_user, login_required, current_user
 from .forms import CafeForm, LoginForm, RegistrationForm
 from .models import db, Cafe, User
-from werkzeug.utils import secure_filename
+from .search import search_index
+from .stats import stats_entry, update_stats
+from .images import schedule_variants, best_image_path, static_filename, VARIANT_SIZES
+from .storage import store_blob, retain_images, release_images, delete_blobs
+from app.main import cache
 from functools import wraps
-from config import Config
-from datetime import datetime, timedelta
-from fuzzywuzzy import fuzz
-from uuid import uuid4
-import jwt
-import os
 
 
-UPLOAD_FOLDER = 'app/main/static/assets/img_uploads'
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg'}
+ROWS_PER_PAGE = 12
+NEARBY_RADIUS_KM = 25
+NEARBY_LIMIT = 10 * ROWS_PER_PAGE
+# The cafe columns shown in the cafes table, loaded as plain rows instead of ORM objects
+TABLE_COLUMNS = [Cafe.name, Cafe.map_url, Cafe.city, Cafe.country, Cafe.currency, Cafe.coffee_price, Cafe.wifi_strength,
+                 Cafe.seats, Cafe.has_sockets, Cafe.has_toilet, Cafe.full_rating]
+CAFE_COLUMNS = ["Name", "Map URL", "Location", "Coffee Price", "Wifi Strength", "Seats", "Has Sockets",
+                "Has Toilet", "Cafe Rating"]
 
 main = Blueprint('main', __name__)
 
@@ -36,14 +41,88 @@ def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
 
-def generate_token(user_id):
-    """Generates a JWT token with an expiration time of 1 hour."""
-    expiration = datetime.utcnow() + timedelta(hours=1)
-    token = jwt.encode({
-        'user_id': user_id,
-        'exp': expiration
-    }, Config.API_KEY, algorithm="HS256")
-    return token
+def save_uploads(image_files):
+    """Stores the allowed uploaded images by content and returns their paths."""
+    filepaths = []
+    for image_file in image_files:
+        if image_file and allowed_file(image_file.filename):
+            extension = image_file.filename.rsplit('.', 1)[1].lower()
+            filepaths.append(store_blob(image_file.stream, 'jpg' if extension == 'jpeg' else extension))
+    return filepaths
+
+
+def table_row(cafe, short_country=False):
+    """Converts a cafe, or a row of its TABLE_COLUMNS, into the fields displayed in the cafes table."""
+    return {
+        'name': cafe.name,
+        'map_url': cafe.map_url,
+        'city': cafe.city,
+        'country': cafe.country.split('(')[1].strip(')') if short_country else cafe.country,
+        'currency': cafe.currency,
+        'coffee_price': cafe.coffee_price,
+        'wifi_strength': cafe.wifi_strength,
+        'seats': cafe.seats,
+        'has_sockets': 'Yes' if cafe.has_sockets else 'No',
+        'has_toilet': 'Yes' if cafe.has_toilet else 'No',
+        'full_rating': cafe.full_rating,
+    }
+
+
+def table_page(rows, page, total):
+    """Builds the payload for one page of the cafes table."""
+    start = (page - 1) * ROWS_PER_PAGE
+    return {
+        'rows': rows,
+        'page': page,
+        'total': total,
+        'start': start + 1 if rows else 0,
+        'end': start + len(rows),
+        'has_prev': page > 1,
+        'has_next': start + len(rows) < total,
+    }
+
+
+def listing_page(page, is_rated=False):
+    """Loads one page of all cafes, or of the top-rated cafes only."""
+    query = db.session.query(*TABLE_COLUMNS)
+    if is_rated:
+        query = query.filter(Cafe.full_rating == 5)
+    pagination = query.order_by(Cafe.id).paginate(page=page, per_page=ROWS_PER_PAGE, error_out=False)
+    rows = [table_row(cafe, short_country=True) for cafe in pagination.items]
+    return table_page(rows, page, pagination.total)
+
+
+def search_page(query, page):
+    """Loads one page of the cafes matching a search query, best match first."""
+    ranked_ids = [cafe_id for cafe_id, score in search_index.search(query)]
+    start = (page - 1) * ROWS_PER_PAGE
+    page_ids = ranked_ids[start:start + ROWS_PER_PAGE]
+    cafes = {row.id: row for row in db.session.query(Cafe.id, *TABLE_COLUMNS).filter(Cafe.id.in_(page_ids))} \
+        if page_ids else {}
+    rows = [table_row(cafes[cafe_id]) for cafe_id in page_ids if cafe_id in cafes]
+    return table_page(rows, page, len(ranked_ids))
+
+
+def nearby_page(latitude, longitude, page):
+    """Loads one page of the cafes closest to a point, nearest first."""
+    matches = Cafe.nearby(latitude, longitude, NEARBY_RADIUS_KM, NEARBY_LIMIT)
+    start = (page - 1) * ROWS_PER_PAGE
+    rows = [table_row(cafe) for cafe, distance in matches[start:start + ROWS_PER_PAGE]]
+    return table_page(rows, page, len(matches))
+
+
+def requested_point():
+    """Returns the (latitude, longitude) from the query string, or None if there is no valid point."""
+    latitude = request.args.get('lat', type=float)
+    longitude = request.args.get('lon', type=float)
+    if latitude is None or longitude is None or not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+        return None
+    return latitude, longitude
+
+
+def requested_page():
+    """Returns the page number from the query string, starting at 1."""
+    return max(request.args.get('page', 1, type=int), 1)
 
 
 @main.route('/')
@@ -95,6 +174,7 @@ def login():
     if form.validate_on_submit():
         user = User.query.filter_by(email=form.email.data.lower()).first()
         if user and user.check_password(form.password.data):
+            db.session.commit()   # Keeps a rehashed password
             login_user(user, remember=form.remember_me.data)
             flash('Login successful!', 'success')
             flash(f'Welcome {user.username}!', 'success')
@@ -115,7 +195,6 @@ def login():
 def logout():
     """Logs out a user."""
     next_page = request.args.get('next_page')
-    print(next_page)
     logout_user()
     flash('You have been logged out.', 'success')
     return redirect(url_for(next_page)) if next_page else redirect(url_for('main.home'))
@@ -128,15 +207,7 @@ def add_cafe():
     form = CafeForm()
 
     if form.validate_on_submit():
-        image_files = request.files.getlist('images')
-        filepaths = []
-        for image_file in image_files:
-            if image_file and allowed_file(image_file.filename):
-                filename = secure_filename(image_file.filename)
-                unique_filename = f"{uuid4().hex}_{filename}"
-                filepath = os.path.join(UPLOAD_FOLDER, unique_filename)
-                image_file.save(filepath)
-                filepaths.append(filepath)
+        filepaths = save_uploads(request.files.getlist('images'))
 
         new_cafe = Cafe(
             name=form.name.data,
@@ -153,8 +224,16 @@ def add_cafe():
             full_review=form.full_review.data,
             full_rating=form.full_rating.data
         )
+        new_cafe.locate()
+        new_cafe.set_price()
         db.session.add(new_cafe)
+        retain_images(new_cafe.images)
+        update_stats(added=[stats_entry(new_cafe)])
+        Cafe.touch_catalog()
         db.session.commit()
+        search_index.add(new_cafe)
+        cache.invalidate()
+        schedule_variants(new_cafe)
         return redirect(url_for('main.give_feedback', action='add'))
 
     # Flash errors
@@ -184,24 +263,34 @@ def update_cafe(cafe_id):
 
     elif request.method in ['POST', 'PATCH']:
         if form.validate_on_submit():
+            old_images = cafe.images
+            old_stats = stats_entry(cafe)
             form.populate_obj(cafe)
+            cafe.images = old_images   # populate_obj copies the raw uploads; they are stored below
             # Manually convert string boolean fields to actual booleans
             cafe.has_sockets = form.has_sockets.data == 'True'
             cafe.has_toilet = form.has_toilet.data == 'True'
+            cafe.locate()
+            cafe.set_price()
             # Handle file uploads
             image_files = request.files.getlist('images')
-            if image_files and image_files[0].filename != '':
-                filepaths = []
-                for image_file in image_files:
-                    if image_file and allowed_file(image_file.filename):
-                        filename = secure_filename(image_file.filename)
-                        unique_filename = f"{uuid4().hex}_{filename}"
-                        filepath = os.path.join(UPLOAD_FOLDER, unique_filename)
-                        image_file.save(filepath)
-                        filepaths.append(filepath)
-                cafe.images = ",".join(filepaths)
-
+            images_replaced = bool(image_files and image_files[0].filename != '')
+            orphans = []
+            if images_replaced:
+                new_images = ",".join(save_uploads(image_files))
+                retain_images(new_images)
+                orphans = release_images(old_images)
+                cafe.images = new_images
+                cafe.image_variants = None
+
+            update_stats(removed=[old_stats], added=[stats_entry(cafe)])
+            Cafe.touch_catalog()
             db.session.commit()
+            delete_blobs(orphans)
+            search_index.update(cafe)
+            cache.invalidate()
+            if images_replaced:
+                schedule_variants(cafe)
             return redirect(url_for('main.give_feedback', action='update'))
 
         if form.errors:
@@ -221,53 +310,79 @@ def give_feedback():
 
 
 @main.route('/all', methods=['GET', 'POST'])
+@cache.cached()
 def get_all_cafes():
-    """Retrieves all cafes from the database."""
+    """Retrieves a page of cafes from the database."""
     is_rated = request.args.get('is_rated')
-    all_cafes = Cafe.query.all()
-    cafes_list = [cafe.to_dict() for cafe in all_cafes]
-    for cafe in cafes_list:
-        cafe['country'] = cafe['country'].split('(')[1].strip(')')
-
-    if is_rated:
-        cafes_list = [cafe for cafe in cafes_list if cafe['full_rating'] == 5]
-        cafes_list = sorted(cafes_list, key=lambda cafe: cafe['full_rating'], reverse=True)
-
-    cafe_columns = ["Name", "Map URL", "Location", "Coffee Price", "Wifi Strength", "Seats", "Has Sockets",
-                    "Has Toilet", "Cafe Rating"]
-    return render_template('cafes.html', cafe_rows=cafes_list, cafe_columns=cafe_columns, is_rated=is_rated)
+    cafe_page = listing_page(requested_page(), is_rated=bool(is_rated))
+    rows_url = url_for('main.get_cafe_rows', is_rated=is_rated)
+    return render_template('cafes.html', cafe_page=cafe_page, rows_url=rows_url, cafe_columns=CAFE_COLUMNS,
+                           is_rated=is_rated)
 
 
 @main.route('/search', methods=['GET'])
+@cache.cached()
 def search_cafes():
     """Searches for cafes based on user input."""
     find_nearby = request.args.get('nearby')
     form = CafeForm()
 
     query = request.args.get('query') or request.args.get('city')
-    cafes_list = Cafe.query.all()
-    matching_cafes = []
-
-    if query:
-        for cafe in cafes_list:
-            if (fuzz.partial_ratio(query.lower(), cafe.name.lower()) > 70 or
-                    fuzz.partial_ratio(query.lower(), cafe.city.lower()) > 70 or
-                    fuzz.partial_ratio(query.lower(), cafe.country.lower()) > 70):
-                matching_cafes.append(cafe.to_dict())
-        if not matching_cafes:
+    point = requested_point()
+    cafe_page = table_page([], 1, 0)
+
+    if point:
+        query = None
+        cafe_page = nearby_page(*point, requested_page())
+        if not cafe_page['total']:
+            flash(f"Sorry, no cafes were found within {NEARBY_RADIUS_KM} km of your location.", "info")
+    elif query:
+        cafe_page = search_page(query, requested_page())
+        if not cafe_page['total']:
             flash("Sorry, no cafes matching your search criteria were found.", "info")
     else:
         if not find_nearby:
             flash("Please enter a search query.", "info")
 
-    cafe_columns = ["Name", "Map URL", "Location", "Coffee Price", "Wifi Strength", "Seats", "Has Sockets",
-                    "Has Toilet", "Cafe Rating"]
+    lat, lon = point or (None, None)
+    rows_url = url_for('main.get_cafe_rows', query=query, lat=lat, lon=lon)
+    return render_template('cafes.html', cafe_page=cafe_page, rows_url=rows_url, cafe_columns=CAFE_COLUMNS,
+                           find_nearby=find_nearby and not point, form=form, mode="search")
+
+
+@main.route('/all/rows', methods=['GET'])
+@cache.cached()
+def get_cafe_rows():
+    """Returns one page of the cafes table as JSON, for the table's pagination buttons."""
+    query = request.args.get('query')
+    point = requested_point()
+    if point:
+        return jsonify(nearby_page(*point, requested_page()))
+    if query:
+        return jsonify(search_page(query, requested_page()))
+    return jsonify(listing_page(requested_page(), is_rated=bool(request.args.get('is_rated'))))
+
+
+@main.route('/cafes/<int:cafe_id>/image', methods=['GET'])
+def get_cafe_image(cafe_id):
+    """Redirects to the smallest stored version of a cafe image that fits the requested size."""
+    size = request.args.get('size', 'thumb')
+    if size not in VARIANT_SIZES and size != 'original':
+        abort(400)
+
+    cafe = Cafe.query.get_or_404(cafe_id)
+    accept_webp = 'image/webp' in request.accept_mimetypes
+    path = best_image_path(cafe, request.args.get('index', 0, type=int), size, accept_webp)
+    filename = static_filename(path) if path else None
+    if not filename:
+        abort(404)
 
-    return render_template('cafes.html', cafe_rows=matching_cafes, cafe_columns=cafe_columns,
-                           find_nearby=find_nearby, form=form, mode="search")
+    response = redirect(url_for('static', filename=filename))
+    response.vary.add('Accept')
+    return response
 
 
-@main.route('/delete_cafe/<int:cafe_id>', methods=['GET', 'POST'])
+@main.route('/delete_cafe/<int:cafe_id>', methods=['POST'])
 @login_required
 @admin_required
 def delete_cafe(cafe_id):
@@ -275,6 +390,12 @@ def delete_cafe(cafe_id):
     cafe = Cafe.query.get(cafe_id)
     if not cafe:
         return redirect(url_for('main.give_feedback', action='notfound'))
+    orphans = release_images(cafe.images)
     db.session.delete(cafe)
+    update_stats(removed=[stats_entry(cafe)])
+    Cafe.touch_catalog()
     db.session.commit()
+    delete_blobs(orphans)
+    search_index.remove(cafe_id)
+    cache.invalidate()
     return redirect(url_for('main.give_feedback', action='delete'))
@@ -0,0 +1,142 @@
+from collections import Counter, defaultdict
+from threading import Lock
+from .models import db, Cafe
+import time
+
+
+MATCH_THRESHOLD = 70
+VERSION_CHECK_SECONDS = 1.0   # How stale the index may be behind writes made by other workers or the CLI
+
+
+def _grams(text):
+    """Splits a string into (character, occurrence) grams, e.g. 'cafe' -> ('c', 1), ('a', 1), ..."""
+    seen = Counter()
+    grams = []
+    for char in text:
+        seen[char] += 1
+        grams.append((char, seen[char]))
+    return grams
+
+
+def _could_match(overlap, query, value):
+    """Checks the shared-gram count against the lowest count a partial_ratio above the threshold allows.
+
+    A partial_ratio of 71 or more needs a ratio of at least 0.705 against some window of the longer
+    string, which means at least 0.705 / 1.295 of the shorter string's characters are matched.
+    """
+    return overlap * 1295 >= 705 * min(len(query), len(value))
+
+
+class SearchIndex:
+    """In-memory n-gram index over cafe names, cities and countries."""
+
+    def __init__(self):
+        self._lock = Lock()
+        self._built = False
+        self._version = None                # catalog version the index reflects
+        self._checked_at = 0.0              # time.monotonic() of the last comparison with the catalog version
+        self._docs = {}                     # cafe id -> normalized field values
+        self._values = defaultdict(set)     # normalized value -> cafe ids
+        self._postings = defaultdict(set)   # gram -> normalized values
+
+    def _index(self, cafe_id, fields):
+        values = {field.lower() for field in fields if field}
+        self._docs[cafe_id] = values
+        for value in values:
+            if not self._values[value]:
+                for gram in _grams(value):
+                    self._postings[gram].add(value)
+            self._values[value].add(cafe_id)
+
+    def _unindex(self, cafe_id):
+        for value in self._docs.pop(cafe_id, ()):
+            self._values[value].discard(cafe_id)
+            if not self._values[value]:
+                del self._values[value]
+                for gram in _grams(value):
+                    self._postings[gram].discard(value)
+                    if not self._postings[gram]:
+                        del self._postings[gram]
+
+    def _build(self):
+        # Under the lock, so that an add or remove between reading the rows and indexing them isn't lost
+        self._version = Cafe.catalog_version()[0]
+        rows = db.session.execute(db.select(Cafe.id, Cafe.name, Cafe.city, Cafe.country)).all()
+        self._docs.clear()
+        self._values.clear()
+        self._postings.clear()
+        for cafe_id, *fields in rows:
+            self._index(cafe_id, fields)
+        self._built = True
+        self._checked_at = time.monotonic()
+
+    def build(self):
+        """(Re)builds the index from the name, city and country columns only."""
+        with self._lock:
+            self._build()
+
+    def refresh(self):
+        """Rebuilds the index if the catalog has changed, comparing versions at most every VERSION_CHECK_SECONDS.
+
+        Writes made by other workers or the CLI show up as a catalog version this index hasn't seen.
+        """
+        if self._built and time.monotonic() - self._checked_at < VERSION_CHECK_SECONDS:
+            return
+        with self._lock:
+            if self._built and time.monotonic() - self._checked_at < VERSION_CHECK_SECONDS:
+                return   # Another thread checked while this one waited
+            if not self._built or Cafe.catalog_version()[0] != self._version:
+                self._build()
+            self._checked_at = time.monotonic()
+
+    def add_rows(self, rows):
+        """Adds new or updated cafes to the index from (id, name, city, country) rows."""
+        if not self._built:
+            return
+        with self._lock:
+            for cafe_id, *fields in rows:
+                self._unindex(cafe_id)
+                self._index(cafe_id, fields)
+            self._version += 1   # Each write request bumps the catalog version exactly once
+
+    def add(self, cafe):
+        """Adds a new or updated cafe to the index."""
+        self.add_rows([(cafe.id, cafe.name, cafe.city, cafe.country)])
+
+    update = add
+
+    def remove(self, *cafe_ids):
+        """Removes deleted cafes from the index."""
+        if not self._built:
+            return
+        with self._lock:
+            for cafe_id in cafe_ids:
+                self._unindex(cafe_id)
+            self._version += 1
+
+    def search(self, query):
+        """Returns (cafe id, score) pairs matching the query, best match first."""
+        self.refresh()
+
+        from fuzzywuzzy import fuzz   # Loaded with the first search, not at startup
+
+        query = query.lower()
+        scores = {}
+        with self._lock:
+            overlaps = Counter()
+            for gram in _grams(query):
+                overlaps.update(self._postings.get(gram, ()))
+
+            for value, overlap in overlaps.items():
+                if not _could_match(overlap, query, value):
+                    continue
+                score = fuzz.partial_ratio(query, value)
+                if score > MATCH_THRESHOLD:
+                    for cafe_id in self._values[value]:
+                        if score > scores.get(cafe_id, 0):
+                            scores[cafe_id] = score
+
+        return sorted(scores.items(), key=lambda item: (-item[1], item[0]))
+
+
+search_index = SearchIndex()
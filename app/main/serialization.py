@@ -0,0 +1,70 @@
+from flask import current_app
+from json.encoder import encode_basestring_ascii
+from sqlalchemy import JSON, Boolean, Date, DateTime, Float, Integer, Numeric
+from werkzeug.http import http_date
+
+
+class RowEncoder:
+    """Encodes result rows of a fixed list of columns straight to JSON text, without ORM objects or dicts.
+
+    An encoding function is generated once per column list, with the keys in sorted order and the
+    conversion of every column type inlined. Its output is the same as jsonify's for the dict of a row
+    (Decimals and datetimes as strings, ASCII only), so the fast path doesn't change the API. The
+    default separators are jsonify's; use (', ', ': ') to match json.dumps.
+    """
+
+    def __init__(self, columns, separators=(',', ':')):
+        self.columns = list(columns)
+        self.item_separator, self.key_separator = separators
+        self.encode = self._compile()
+
+    def _value(self, column, name):
+        """Returns the expression encoding a non-null value of a column the way Flask's JSON provider does."""
+        column_type = column.type
+        if isinstance(column_type, Boolean):
+            return f"('true' if {name} else 'false')"
+        if isinstance(column_type, Integer):
+            return f"int_repr({name})"
+        if isinstance(column_type, Float):   # Float is a Numeric, so it comes first
+            return f"float_repr({name})"
+        if isinstance(column_type, Numeric):
+            return f"string(str({name}))"
+        if isinstance(column_type, (Date, DateTime)):
+            return f"string(http_date({name}))"
+        if isinstance(column_type, JSON):
+            return f"json_value({name})"
+        return f"string({name})"
+
+    def _json_value(self, value):
+        """Encodes the value of a JSON column, e.g. a cafe's image_variants, with the app's JSON provider."""
+        return current_app.json.dumps(value, separators=(self.item_separator, self.key_separator))
+
+    def _compile(self):
+        names = [f"v{index}" for index in range(len(self.columns))]
+        template = []
+        values = []
+        for index in sorted(range(len(self.columns)), key=lambda index: self.columns[index].key):
+            column, name = self.columns[index], names[index]
+            key = encode_basestring_ascii(column.key).replace('%', '%%')
+            template.append(f"{key}{self.key_separator}%s")
+            value = self._value(column, name)
+            values.append(f"('null' if {name} is None else {value})" if column.nullable else value)
+
+        # e.g. def encode(row): v0, v1 = row; return '{"id":%s,"name":%s}' % (int_repr(v0), string(v1))
+        source = (f"def encode(row):\n"
+                  f"    {', '.join(names)}, = row\n"
+                  f"    return {'{' + self.item_separator.join(template) + '}'!r} % ({', '.join(values)},)\n")
+        namespace = {'int_repr': int.__repr__, 'float_repr': float.__repr__, 'string': encode_basestring_ascii,
+                     'http_date': http_date, 'json_value': self._json_value}
+        exec(compile(source, f"<RowEncoder {','.join(column.key for column in self.columns)}>", 'exec'), namespace)
+        return namespace['encode']
+
+    def encode_rows(self, rows):
+        """Encodes rows as a JSON array."""
+        return f"[{self.item_separator.join(map(self.encode, rows))}]"
+
+
+def json_response(text, status=200):
+    """Returns JSON text, e.g. from a RowEncoder, as a response like jsonify's."""
+    return current_app.response_class(f"{text}\n", status=status, mimetype=current_app.json.mimetype)
+
@@ -0,0 +1,119 @@
+from collections import namedtuple
+from .models import db, Cafe, CafeStats
+from .database import nocase
+from .pricing import NO_CURRENCY, CENT
+
+# The cafe columns that CafeStats aggregates
+StatsEntry = namedtuple('StatsEntry', ['city', 'country', 'currency_code', 'price', 'full_rating', 'wifi_strength'])
+STATS_COLUMNS = [getattr(Cafe, field) for field in StatsEntry._fields]
+STATS_SCOPES = {'city': Cafe.city, 'country': Cafe.country}
+WIFI_LEVELS = range(6)
+COUNTERS = ['cafe_count', 'rating_sum', 'price_count', 'price_sum', *[f'wifi_{level}' for level in WIFI_LEVELS]]
+
+
+def stats_entry(cafe):
+    """Returns the StatsEntry of a cafe given as a model, a result row or a dict of column values."""
+    if isinstance(cafe, dict):
+        entry = StatsEntry(*(cafe.get(field) for field in StatsEntry._fields))
+    else:
+        entry = StatsEntry(*(getattr(cafe, field) for field in StatsEntry._fields))
+    # Form data assigned to a model is still a string until it is flushed
+    return entry._replace(full_rating=int(entry.full_rating),
+                          wifi_strength=None if entry.wifi_strength is None else int(entry.wifi_strength))
+
+
+def update_stats(removed=(), added=()):
+    """Applies the StatsEntry values of removed and added cafes to CafeStats, in the current transaction.
+
+    An update is the removal of the old values and the addition of the new ones. Call it after the
+    cafe changes themselves, so that recomputing a minimum price sees them.
+    """
+    removed, added = list(removed), list(added)
+    if removed == added:
+        return   # e.g. an update that left the aggregated columns alone
+
+    deltas = {}
+    for sign, entries in ((-1, removed), (1, added)):
+        for entry in entries:
+            currency_code = entry.currency_code or NO_CURRENCY
+            for scope, name in (('city', entry.city), ('country', entry.country)):
+                # Names are compared case-insensitively, with nocase() in SQL
+                delta = deltas.get((scope, name.lower(), currency_code))
+                if delta is None:
+                    delta = deltas[(scope, name.lower(), currency_code)] = {
+                        'name': name, 'counts': dict.fromkeys(COUNTERS, 0), 'min_added': None, 'min_removed': None}
+                counts = delta['counts']
+                counts['cafe_count'] += sign
+                counts['rating_sum'] += sign * entry.full_rating
+                if entry.wifi_strength in WIFI_LEVELS:
+                    counts[f'wifi_{entry.wifi_strength}'] += sign
+                if entry.price is not None:
+                    counts['price_count'] += sign
+                    counts['price_sum'] += sign * entry.price
+                    bound = 'min_added' if sign > 0 else 'min_removed'
+                    if delta[bound] is None or entry.price < delta[bound]:
+                        delta[bound] = entry.price
+
+    stale_minimums = []
+    for (scope, _, currency_code), delta in deltas.items():
+        stats = db.session.scalar(db.select(CafeStats).where(
+            CafeStats.scope == scope, nocase(CafeStats.name) == nocase(delta['name']),
+            CafeStats.currency_code == currency_code))
+        if stats is None:
+            db.session.add(CafeStats(scope=scope, name=delta['name'], currency_code=currency_code,
+                                     min_price=delta['min_added'], **delta['counts']))
+            continue
+        for column, change in delta['counts'].items():
+            if change:
+                # Incremented in SQL, so concurrent writers don't collide
+                setattr(stats, column, getattr(CafeStats, column) + change)
+        if delta['min_removed'] is not None and stats.min_price is not None \
+                and delta['min_removed'] <= stats.min_price:
+            stale_minimums.append(stats)   # The cheapest cafe may be gone; only the cafes can tell
+        elif delta['min_added'] is not None and (stats.min_price is None or delta['min_added'] < stats.min_price):
+            stats.min_price = delta['min_added']
+
+    for stats in stale_minimums:
+        column = STATS_SCOPES[stats.scope]
+        stats.min_price = db.session.scalar(db.select(db.func.min(Cafe.price)).where(
+            nocase(column) == nocase(stats.name), Cafe.currency_code == stats.currency_code))
+
+    if removed:
+        db.session.flush()
+        db.session.execute(db.delete(CafeStats).where(CafeStats.cafe_count <= 0)
+                           .execution_options(synchronize_session=False))
+
+
+def rebuild_stats(connection):
+    """Recomputes every CafeStats row from the cafes."""
+    connection.execute(db.delete(CafeStats))
+    wifi_counts = [db.func.sum(db.case((Cafe.wifi_strength == level, 1), else_=0)) for level in WIFI_LEVELS]
+    for scope, column in STATS_SCOPES.items():
+        key = nocase(column)
+        connection.execute(db.insert(CafeStats).from_select(
+            ['scope', 'name', 'currency_code', 'min_price', *COUNTERS],
+            db.select(db.literal(scope), db.func.min(column), Cafe.currency_code, db.func.min(Cafe.price),
+                      db.func.count(), db.func.sum(Cafe.full_rating), db.func.count(Cafe.price),
+                      db.func.coalesce(db.func.sum(Cafe.price), 0), *wifi_counts)
+            .group_by(key, Cafe.currency_code)))
+
+
+def stats_summary(scope, name):
+    """Returns the statistics of one city or country from its CafeStats rows, or None if it has no cafes."""
+    rows = db.session.scalars(db.select(CafeStats).where(
+        CafeStats.scope == scope, nocase(CafeStats.name) == nocase(name))).all()
+    if not rows:
+        return None
+    cafe_count = sum(row.cafe_count for row in rows)
+    return {
+        scope: rows[0].name,
+        'cafe_count': cafe_count,
+        'average_rating': round(sum(row.rating_sum for row in rows) / cafe_count, 2),
+        'wifi_strength': {str(level): sum(getattr(row, f'wifi_{level}') for row in rows) for level in WIFI_LEVELS},
+        'prices': [{
+            'currency_code': row.currency_code,
+            'cafe_count': row.price_count,
+            'average_price': str((row.price_sum / row.price_count).quantize(CENT)),
+            'min_price': str(row.min_price),
+        } for row in sorted(rows, key=lambda row: row.price_count, reverse=True) if row.price_count],
+    }
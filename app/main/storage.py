@@ -0,0 +1,138 @@
+from collections import Counter
+from .models import db, ImageBlob
+from .images import VARIANT_SIZES, VARIANT_FORMATS, variant_path
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session
+import hashlib
+import os
+import re
+import tempfile
+import time
+
+
+UPLOAD_FOLDER = 'app/main/static/assets/img_uploads'
+CHUNK_SIZE = 64 * 1024
+BLOB_NAME = re.compile(r'^[0-9a-f]{64}\.\w+$')
+# 'flask cafes rebuild-images' keeps unreferenced files newer than this: their upload may not have committed yet
+BLOB_GRACE_SECONDS = 3600
+
+
+def is_managed(path):
+    """Checks whether an image path points to a file stored in the upload folder."""
+    return path.startswith(UPLOAD_FOLDER + '/')
+
+
+def image_paths(images):
+    """Splits a Cafe.images value into its paths."""
+    return [path for path in (images or '').split(',') if path]
+
+
+def blob_path(digest, extension):
+    """Returns the content-addressed path of a blob."""
+    return os.path.join(UPLOAD_FOLDER, f"{digest}.{extension}")
+
+
+def store_blob(stream, extension):
+    """Stores the content of a stream under its SHA-256 digest and returns the blob path.
+
+    The content is hashed while it is written to a temporary file, which then replaces any blob with the
+    same content once its row is claimed, so delete_blobs cannot remove it before the upload has committed.
+    """
+    digest = hashlib.sha256()
+    fd, tmp_path = tempfile.mkstemp(dir=UPLOAD_FOLDER, suffix='.part')
+    try:
+        with os.fdopen(fd, 'wb') as file:
+            for chunk in iter(lambda: stream.read(CHUNK_SIZE), b''):
+                digest.update(chunk)
+                file.write(chunk)
+        path = blob_path(digest.hexdigest(), extension)
+        claim_blob(path)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return path
+
+
+def lock_blob(session, path):
+    """Loads the ImageBlob row of a path, locking it until the end of the transaction."""
+    return session.get(ImageBlob, path, with_for_update=True, populate_existing=True)
+
+
+def claim_blob(path):
+    """Locks the ImageBlob row of a path, creating it without references if needed, until the transaction ends."""
+    claimed = db.session.execute(db.update(ImageBlob).where(ImageBlob.path == path)
+                                 .values(ref_count=ImageBlob.ref_count)).rowcount
+    if not claimed:
+        db.session.add(ImageBlob(path=path, ref_count=0))
+        db.session.flush()
+
+
+def retain_images(images):
+    """Adds a reference to every stored blob in a Cafe.images value."""
+    for path, count in Counter(filter(is_managed, image_paths(images))).items():
+        blob = lock_blob(db.session, path)
+        if blob:
+            blob.ref_count = ImageBlob.ref_count + count
+        else:
+            db.session.add(ImageBlob(path=path, ref_count=count))
+
+
+def release_images(images):
+    """Drops a reference to every stored blob in a Cafe.images value.
+
+    Returns the blobs that are no longer referenced. Their rows are kept with no references until
+    delete_blobs removes them along with their files, which it must only do once the transaction has
+    been committed, so a rollback never loses files.
+    """
+    orphans = []
+    for path, count in Counter(filter(is_managed, image_paths(images))).items():
+        blob = lock_blob(db.session, path)
+        if not blob:
+            continue   # Uploaded before reference counting; 'flask cafes rebuild-images' adopts these
+        blob.ref_count = ImageBlob.ref_count - count
+        db.session.flush()
+        db.session.refresh(blob)
+        if blob.ref_count <= 0:
+            blob.ref_count = 0
+            orphans.append(path)
+    return orphans
+
+
+def is_recent(path, min_age=BLOB_GRACE_SECONDS):
+    """Checks whether a file was written less than min_age seconds ago, or is already gone."""
+    try:
+        return time.time() - os.stat(path).st_mtime < min_age
+    except FileNotFoundError:
+        return True
+
+
+def delete_blobs(paths):
+    """Deletes unreferenced blobs and their generated variants from disk, after the release has been committed.
+
+    Each blob row is deleted only while it is still unreferenced, in a transaction of its own that lasts
+    until its files are gone, so an upload storing the same content either waits for the removal or keeps
+    the blob. Unreferenced rows left behind by an earlier removal that failed, or by an upload that never
+    referenced its blob, are removed along with the given ones.
+    """
+    with Session(db.engine) as session:
+        paths = set(paths).union(session.scalars(db.select(ImageBlob.path).where(ImageBlob.ref_count == 0)))
+        session.rollback()
+        for path in paths:
+            try:
+                deleted = session.execute(db.delete(ImageBlob)
+                                          .where(ImageBlob.path == path, ImageBlob.ref_count == 0)).rowcount
+                if not deleted:
+                    session.rollback()
+                    continue
+                variants = [variant_path(path, size, image_format)
+                            for size in VARIANT_SIZES for image_format in VARIANT_FORMATS]
+                for file_path in [path, *variants]:
+                    try:
+                        os.remove(file_path)
+                    except FileNotFoundError:
+                        pass
+                session.commit()
+            except OperationalError:
+                session.rollback()   # Busy; the row is still unreferenced, so the next call retries it
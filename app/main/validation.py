@@ -0,0 +1,128 @@
+"""Rules of a valid cafe, compiled once from data.py and shared by CafeForm and the API's CafeSchema.
+
+clean_cafe checks a record against all of them in one pass, with set lookups and precompiled patterns. It
+accepts exactly what CafeSchema would load without errors and returns the same data, so bulk loads only
+pay for marshmallow on the records that have errors.
+"""
+from marshmallow import fields, validate, ValidationError
+from .data import COUNTRIES, CURRENCIES, STAR_RATINGS
+import re
+
+# (min, max) length of the text fields
+NAME_LENGTH = (2, 30)
+CITY_LENGTH = (2, 25)
+COUNTRY_LENGTH = (2, 20)
+CURRENCY_LENGTH = (None, 10)
+IMAGES_LENGTH = (None, 350)
+REVIEW_LENGTH = (3, 300)
+
+# Allowed values, as submitted by the website's select fields
+COUNTRY_CHOICES = frozenset(value for value, label in COUNTRIES)
+CURRENCY_CHOICES = frozenset(value for value, label in CURRENCIES)
+WIFI_CHOICES = frozenset(value for value, label in STAR_RATINGS)
+RATING_CHOICES = frozenset(value for value, label in STAR_RATINGS[1:])
+
+# ... and as integers, as sent to the API
+WIFI_STRENGTHS = frozenset(map(int, WIFI_CHOICES))
+FULL_RATINGS = frozenset(map(int, RATING_CHOICES))
+
+PRICE_PATTERN = re.compile(r'^\d+(\.\d{1,2})?$')
+is_url = validate.URL()
+
+BOOLEAN_TRUE = fields.Boolean.truthy
+BOOLEAN_FALSE = fields.Boolean.falsy
+
+
+class Invalid(Exception):
+    """Raised by a rule for a value it doesn't accept as is."""
+
+
+def text(length=(None, None), choices=None, pattern=None):
+    """Rule of a string field, with its length limits and allowed values or pattern."""
+    min_length = length[0] or 0
+    max_length = length[1] or float('inf')
+
+    def rule(value):
+        if type(value) is not str or not min_length <= len(value) <= max_length:
+            raise Invalid
+        if choices is not None and value not in choices:
+            raise Invalid
+        if pattern is not None and not pattern.match(value):
+            raise Invalid
+        return value
+    return rule
+
+
+def integer(minimum=None, choices=None):
+    """Rule of an integer field. Numbers and numeric strings are converted like marshmallow's Integer does."""
+    def rule(value):
+        if value is True or value is False:
+            raise Invalid
+        try:
+            number = int(value)
+        except (TypeError, ValueError, OverflowError):
+            raise Invalid
+        if (minimum is not None and number < minimum) or (choices is not None and number not in choices):
+            raise Invalid
+        return number
+    return rule
+
+
+def boolean(value):
+    """Rule of a boolean field, which accepts marshmallow's true and false values, e.g. 'yes' or 0."""
+    try:
+        if value in BOOLEAN_TRUE:
+            return True
+        if value in BOOLEAN_FALSE:
+            return False
+    except TypeError:   # Unhashable values
+        pass
+    raise Invalid
+
+
+def url(value):
+    """Rule of an absolute URL field."""
+    if type(value) is not str:
+        raise Invalid
+    try:
+        return is_url(value)
+    except ValidationError:
+        raise Invalid
+
+
+# Field -> rule, in the order of CafeSchema's fields
+CAFE_RULES = {
+    'name': text(NAME_LENGTH),
+    'map_url': url,
+    'city': text(CITY_LENGTH),
+    'country': text(COUNTRY_LENGTH, choices=COUNTRY_CHOICES),
+    'coffee_price': text(pattern=PRICE_PATTERN),
+    'currency': text(CURRENCY_LENGTH, choices=CURRENCY_CHOICES),
+    'wifi_strength': integer(choices=WIFI_STRENGTHS),
+    'seats': integer(minimum=0),
+    'has_sockets': boolean,
+    'has_toilet': boolean,
+    'images': text(IMAGES_LENGTH),
+    'full_review': text(REVIEW_LENGTH),
+    'full_rating': integer(choices=FULL_RATINGS),
+}
+OPTIONAL_FIELDS = frozenset({'wifi_strength', 'images', 'full_review'})
+REQUIRED_FIELDS = frozenset(CAFE_RULES) - OPTIONAL_FIELDS
+
+
+def clean_cafe(record, partial=False, exclude_unknown=False):
+    """Returns the converted fields of a record that passes every rule, or None if it doesn't.
+
+    Unknown fields fail the record unless exclude_unknown drops them, and partial records (updates) don't
+    need the required fields.
+    """
+    if type(record) is not dict:
+        return None
+    if not exclude_unknown and not record.keys() <= CAFE_RULES.keys():
+        return None
+    if not partial and not REQUIRED_FIELDS <= record.keys():
+        return None
+    try:
+        return {field: rule(record[field]) for field, rule in CAFE_RULES.items() if field in record}
+    except Invalid:
+        return None
@@ -0,0 +1,4 @@
+from app.api.asgi import create_asgi_app
+
+# Serves the cafe API routes with coroutines: uvicorn asgi:app --workers 4
+app = create_asgi_app()
@@ -0,0 +1,10 @@
+"""Load benchmarks run against a throwaway database of synthetic cafes and users.
+
+    python -m benchmarks.run --sizes 1000 10000 100000 --output bench.json
+    python -m benchmarks.compare before.json after.json
+    python -m benchmarks.concurrency --concurrency 1 10 50 200 --slow-clients 8
+    python -m benchmarks.serialization --sizes 10000 100000
+    python -m benchmarks.validation --records 10000
+    python -m benchmarks.templates --cafes 10000
+    python -m benchmarks.startup --repeat 10 --max-ms 1500
+"""
@@ -0,0 +1,45 @@
+"""Compares two benchmark result files, e.g. from the commits before and after a change."""
+import argparse
+import json
+
+
+def change(before, after):
+    if not before:
+        return 'n/a'
+    return f"{(after - before) / before * 100:+.1f}%"
+
+
+def compare(before, after):
+    """Yields a line per scenario and size found in both results, with the change of its latencies and throughput."""
+    before_runs = {run['cafes']: run for run in before['runs']}
+    for run in after['runs']:
+        base = before_runs.get(run['cafes'])
+        if base is None:
+            continue
+        yield (f"{run['cafes']} cafes: peak RSS {base['peak_rss_mb']} -> {run['peak_rss_mb']} MB "
+               f"({change(base['peak_rss_mb'], run['peak_rss_mb'])})")
+        for name, result in run['scenarios'].items():
+            old = base['scenarios'].get(name)
+            if old is None:
+                continue
+            yield (f"  {name:<24} p50 {change(old['p50_ms'], result['p50_ms']):>8}  "
+                   f"p95 {change(old['p95_ms'], result['p95_ms']):>8}  "
+                   f"p99 {change(old['p99_ms'], result['p99_ms']):>8}  "
+                   f"throughput {change(old['throughput_rps'], result['throughput_rps']):>8}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('before', help='Results of the baseline commit.')
+    parser.add_argument('after', help='Results of the changed commit.')
+    args = parser.parse_args()
+
+    with open(args.before) as before_file, open(args.after) as after_file:
+        before, after = json.load(before_file), json.load(after_file)
+    print(f"{before['commit']} -> {after['commit']}")
+    for line in compare(before, after):
+        print(line)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,230 @@
+"""Compares API throughput under concurrent connections: the WSGI app on a fixed pool of worker threads against
+the ASGI app (asgi.py) on a single event loop.
+
+Both servers run in their own process on one seeded database, and receive the same mix of cafe listing and
+single cafe requests, one connection per request. --slow-clients adds connections that trickle their request
+headers for a few seconds at a time, like clients on bad networks, which keep WSGI threads busy.
+"""
+from datetime import datetime
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.run import percentile, git_commit
+
+SERVERS = ['wsgi', 'asgi']
+SORTS = ['id', '-full_rating', 'city', 'seats']
+SLOW_CLIENT_SECONDS = 3
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def serve_wsgi(port, threads):
+    """Serves the Flask app with a fixed pool of threads, like the worker threads of a WSGI server."""
+    from concurrent.futures import ThreadPoolExecutor
+    from werkzeug.serving import ThreadedWSGIServer, WSGIRequestHandler
+    from app.main import create_app
+
+    class QuietHandler(WSGIRequestHandler):
+        def log_request(self, *args, **kwargs):
+            pass
+
+    class PooledWSGIServer(ThreadedWSGIServer):
+        request_queue_size = 2048
+        pool = ThreadPoolExecutor(threads)
+
+        def process_request(self, request, client_address):
+            self.pool.submit(self.process_request_thread, request, client_address)
+
+    PooledWSGIServer('127.0.0.1', port, create_app(), handler=QuietHandler).serve_forever()
+
+
+def serve_asgi(port):
+    import uvicorn
+    from app.api.asgi import create_asgi_app
+    uvicorn.run(create_asgi_app(), host='127.0.0.1', port=port, log_level='warning', access_log=False, backlog=2048)
+
+
+def wait_for_port(port, timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=1):
+                return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f"The server on port {port} did not start.")
+
+
+async def fetch(port, path, token, pause=None):
+    """Sends one GET request on a new connection and returns its status code.
+
+    With a pause, the request headers are sent one byte every half second for that many seconds first.
+    """
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    try:
+        writer.write(f"GET {path} HTTP/1.1\r\nHost: 127.0.0.1\r\n".encode())
+        if pause:
+            writer.write(b"X-Slow: ")
+            for _ in range(int(pause * 2)):
+                await writer.drain()
+                await asyncio.sleep(0.5)
+                writer.write(b"z")
+            writer.write(b"\r\n")
+        writer.write(f"Authorization: Bearer {token}\r\nConnection: close\r\n\r\n".encode())
+        await writer.drain()
+        response = await reader.read()
+    finally:
+        writer.close()
+    return int(response.split(b' ', 2)[1]) if response else 0
+
+
+async def slow_client(port, token):
+    """Sends slow requests one after another until cancelled."""
+    while True:
+        try:
+            await fetch(port, '/api/cafes/1', token, pause=SLOW_CLIENT_SECONDS)
+        except OSError:
+            await asyncio.sleep(0.5)
+
+
+async def run_level(port, token, paths, concurrency, slow_clients, timeout):
+    """Sends the paths from `concurrency` connections at a time and summarizes their latencies.
+
+    Requests without a response after `timeout` seconds count as errors.
+    """
+    trickles = [asyncio.create_task(slow_client(port, token)) for _ in range(slow_clients)]
+    await asyncio.sleep(0.5)   # Let the slow clients take their connections first
+
+    pending = iter(paths)
+    latencies = []
+    errors = 0
+
+    async def connection():
+        nonlocal errors
+        for path in pending:
+            started = time.perf_counter()
+            try:
+                status = await asyncio.wait_for(fetch(port, path, token), timeout)
+            except (OSError, asyncio.TimeoutError):
+                status = 0
+            latencies.append(time.perf_counter() - started)
+            if status != 200:
+                errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(connection() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    for trickle in trickles:
+        trickle.cancel()
+    await asyncio.gather(*trickles, return_exceptions=True)
+
+    latencies.sort()
+    return {
+        'concurrency': concurrency,
+        'requests': len(paths),
+        'errors': errors,
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 3),
+        'p95_ms': round(percentile(latencies, 0.95) * 1000, 3),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 3),
+        'throughput_rps': round(len(paths) / elapsed, 1),
+    }
+
+
+def request_paths(rng, cafes, count):
+    """Returns a mix of paginated listings and single cafe lookups."""
+    return [f"/api/cafes?limit=20&sort={rng.choice(SORTS)}" if rng.random() < 0.5
+            else f"/api/cafes/{rng.randint(1, cafes)}" for _ in range(count)]
+
+
+def seed(cafes, users, seed_value):
+    """Seeds the database configured in the environment and returns an admin token, which has no rate limits."""
+    from app.main import create_app, db
+    from app.main.models import User
+    from app.api.auth import generate_token
+    from benchmarks.data import ADMIN_EMAIL, seed_database
+
+    app = create_app()
+    with app.app_context():
+        seed_database(cafes, users, seed_value)
+        token = generate_token(User.query.filter_by(email=ADMIN_EMAIL).first().id)
+        db.session.remove()
+    return token
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--cafes', type=int, default=10000, help='Number of cafes.')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 10, 50, 200],
+                        help='Numbers of concurrent connections.')
+    parser.add_argument('--requests', type=int, default=2000, help='Requests per concurrency level.')
+    parser.add_argument('--threads', type=int, default=8, help='Worker threads of the WSGI server.')
+    parser.add_argument('--slow-clients', type=int, default=0, help='Connections that trickle their headers.')
+    parser.add_argument('--timeout', type=float, default=10, help='Seconds before a request counts as an error.')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the data generator and request mix.')
+    parser.add_argument('--output', default='concurrency.json', help='JSON file to write the results to.')
+    parser.add_argument('--serve', choices=SERVERS, help=argparse.SUPPRESS)   # Runs one server in this process
+    parser.add_argument('--port', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve == 'wsgi':
+        return serve_wsgi(args.port, args.threads)
+    if args.serve == 'asgi':
+        return serve_asgi(args.port)
+
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        os.environ.update({'DATABASE_URI': f"sqlite:///{os.path.join(directory, 'bench.db')}", 'CACHE_TYPE': 'null',
+                           'RATELIMIT_STORAGE_URI': 'memory://', 'METRICS_ENABLED': '0'})
+        print(f"Seeding {args.cafes} cafes...", file=sys.stderr)
+        token = seed(args.cafes, 10, args.seed)
+
+        for server in SERVERS:
+            port = free_port()
+            command = [sys.executable, '-m', 'benchmarks.concurrency', '--serve', server, '--port', str(port),
+                       '--threads', str(args.threads)]
+            process = subprocess.Popen(command, env=os.environ.copy())
+            try:
+                wait_for_port(port)
+                rng = random.Random(args.seed)
+                asyncio.run(run_level(port, token, request_paths(rng, args.cafes, 50), 5, 0, args.timeout))   # Warm up
+                results[server] = []
+                for concurrency in args.concurrency:
+                    paths = request_paths(random.Random(args.seed + concurrency), args.cafes, args.requests)
+                    result = asyncio.run(run_level(port, token, paths, concurrency, args.slow_clients,
+                                                         args.timeout))
+                    results[server].append(result)
+                    print(f"  {server} {concurrency:>4} connections  p50 {result['p50_ms']:>8.2f} ms  "
+                          f"p95 {result['p95_ms']:>8.2f} ms  p99 {result['p99_ms']:>8.2f} ms  "
+                          f"{result['throughput_rps']:>8.1f} req/s  {result['errors']} errors", file=sys.stderr)
+            finally:
+                process.terminate()
+                process.wait()
+
+    with open(args.output, 'w') as file:
+        json.dump({
+            'commit': git_commit(),
+            'created_at': datetime.utcnow().isoformat(timespec='seconds') + 'Z',
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'settings': {'cafes': args.cafes, 'requests': args.requests, 'threads': args.threads,
+                         'slow_clients': args.slow_clients, 'timeout': args.timeout, 'seed': args.seed},
+            'servers': results,
+        }, file, indent=2)
+    print(f"Results written to {args.output}", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
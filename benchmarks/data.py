@@ -0,0 +1,88 @@
+from datetime import datetime
+from app.main import db
+from app.main.geo import location_fields
+from app.main.models import Cafe, User
+from app.main.passwords import hash_password
+from app.main.pricing import price_fields
+from app.main.stats import rebuild_stats
+import random
+
+BENCH_PASSWORD = 'bench@2024'
+ADMIN_EMAIL = 'admin@bench.example.com'
+INSERT_BATCH_SIZE = 5000
+
+NAME_WORDS = ['Velvet', 'Copper', 'Little', 'Golden', 'Harbour', 'Maple', 'Juniper', 'Sunday', 'Ember', 'Olive',
+              'Paper', 'Wild', 'Common', 'Corner', 'Blue', 'Kettle', 'Atlas', 'Fig', 'Hazel', 'Northern']
+NAME_KINDS = ['Cafe', 'Roastery', 'Coffee', 'Espresso Bar', 'Beans', 'Brew House', 'Kitchen', 'Grind']
+
+# A few cities for each of the COUNTRIES, with their centres and the currency (one of the CURRENCIES) used there
+CITIES = {
+    'Australia (AU)': ('A$', [('Sydney', -33.8688, 151.2093), ('Melbourne', -37.8136, 144.9631)]),
+    'Canada (CA)': ('C$', [('Toronto', 43.6532, -79.3832), ('Montreal', 45.5019, -73.5674)]),
+    'Germany (DE)': ('€', [('Berlin', 52.5200, 13.4050), ('Munich', 48.1351, 11.5820)]),
+    'Spain (ES)': ('€', [('Madrid', 40.4168, -3.7038), ('Barcelona', 41.3874, 2.1686)]),
+    'France (FR)': ('€', [('Paris', 48.8566, 2.3522), ('Lyon', 45.7640, 4.8357)]),
+    'Ghana (GH)': ('GH₵', [('Accra', 5.6037, -0.1870), ('Kumasi', 6.6885, -1.6244)]),
+    'India (IN)': ('₹', [('Mumbai', 19.0760, 72.8777), ('Bengaluru', 12.9716, 77.5946)]),
+    'Italy (IT)': ('€', [('Rome', 41.9028, 12.4964), ('Milan', 45.4642, 9.1900)]),
+    'Japan (JP)': ('¥', [('Tokyo', 35.6762, 139.6503), ('Osaka', 34.6937, 135.5023)]),
+    'Nigeria (NG)': ('₦', [('Lagos', 6.5244, 3.3792), ('Abuja', 9.0765, 7.3986)]),
+    'Netherlands (NL)': ('€', [('Amsterdam', 52.3676, 4.9041), ('Rotterdam', 51.9244, 4.4777)]),
+    'Norway (NO)': ('kr', [('Oslo', 59.9139, 10.7522), ('Bergen', 60.3913, 5.3221)]),
+    'New Zealand (NZ)': ('NZ$', [('Auckland', -36.8485, 174.7633), ('Wellington', -41.2865, 174.7762)]),
+    'United Kingdom (UK)': ('£', [('London', 51.5072, -0.1276), ('Manchester', 53.4808, -2.2426)]),
+    'United States (US)': ('$', [('New York', 40.7128, -74.0060), ('Los Angeles', 34.0522, -118.2437)]),
+    'South Africa (ZA)': ('R', [('Cape Town', -33.9249, 18.4241), ('Johannesburg', -26.2041, 28.0473)]),
+}
+
+# Images shipped with the site; they are outside the upload folder, so deleting a cafe never removes them
+IMAGES = [f'app/main/static/assets/img/card-{number}.jpg' for number in (1, 2, 3)]
+REVIEWS = ['Great coffee and friendly staff.', 'Quiet spot to work with fast wifi.', 'Busy at lunch, lovely pastries.',
+           'Plenty of seats and sockets.', 'Small but cosy, the flat white is excellent.']
+
+
+def cafe_fields(rng, number):
+    """Returns the fields of one realistic synthetic cafe. Names are unique per number."""
+    country = rng.choice(list(CITIES))
+    currency, cities = CITIES[country]
+    city, latitude, longitude = rng.choice(cities)
+    latitude += rng.uniform(-0.1, 0.1)
+    longitude += rng.uniform(-0.1, 0.1)
+    return {
+        'name': f"{rng.choice(NAME_WORDS)} {rng.choice(NAME_KINDS)} {number}",
+        'map_url': f"http://maps.google.com/?q={latitude:.6f},{longitude:.6f}",
+        'city': city,
+        'country': country,
+        'currency': currency,
+        'coffee_price': f"{rng.uniform(1.5, 6):.2f}",
+        'wifi_strength': rng.randint(0, 5),
+        'seats': rng.randint(4, 120),
+        'has_sockets': rng.random() < 0.6,
+        'has_toilet': rng.random() < 0.7,
+        'images': ','.join(rng.sample(IMAGES, rng.randint(1, len(IMAGES)))),
+        'full_review': rng.choice(REVIEWS),
+        'full_rating': rng.randint(1, 5),
+    }
+
+
+def seed_database(cafes, users, seed=0):
+    """Fills an empty database with synthetic cafes, users sharing BENCH_PASSWORD, and one admin."""
+    rng = random.Random(seed)
+    now = datetime.utcnow()
+    for start in range(0, cafes, INSERT_BATCH_SIZE):
+        rows = []
+        for number in range(start + 1, min(start + INSERT_BATCH_SIZE, cafes) + 1):
+            fields = cafe_fields(rng, number)
+            rows.append({**fields, **location_fields(fields['map_url']),
+                         **price_fields(fields['coffee_price'], fields['currency']), 'updated_at': now})
+        db.session.execute(db.insert(Cafe), rows)
+    rebuild_stats(db.session.connection())
+
+    # Hashing is deliberately slow, so every user shares one hash
+    password_hash = hash_password(BENCH_PASSWORD)
+    db.session.execute(db.insert(User), [
+        {'username': f"user{number}", 'email': f"user{number}@bench.example.com", 'password_hash': password_hash,
+         'is_admin': False} for number in range(1, users + 1)])
+    db.session.add(User(username='benchadmin', email=ADMIN_EMAIL, password_hash=password_hash, is_admin=True))
+    Cafe.touch_catalog()
+    db.session.commit()
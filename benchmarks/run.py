@@ -0,0 +1,232 @@
+"""Seeds a throwaway database for each catalog size and times the busiest routes through the Flask test client.
+
+Each size runs in its own process, so peak RSS is measured per size, and results are written as JSON
+for benchmarks/compare.py.
+"""
+from datetime import datetime
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+try:
+    import resource
+except ImportError:   # Not available on Windows
+    resource = None
+
+SEARCH_TERMS = ['paris', 'velvet', 'roastery', 'tokyo', 'golden cafe', 'lagos', 'espresso', 'new york', 'fig', 'osl']
+
+
+class Context:
+    """State shared by the scenarios of one run: clients, tokens and the cafes that still exist."""
+
+    def __init__(self, app, cafes, users, seed):
+        from benchmarks.data import ADMIN_EMAIL, BENCH_PASSWORD
+        from app.main.routes import ROWS_PER_PAGE
+        from app.main.models import Cafe, User
+
+        self.rng = random.Random(seed)
+        self.client = app.test_client()
+        self.admin_client = app.test_client()   # Keeps the admin's login session for the website routes
+        response = self.admin_client.post('/login', data={'email': ADMIN_EMAIL, 'password': BENCH_PASSWORD})
+        if response.status_code != 302:
+            raise RuntimeError('The benchmark admin could not log in to the website.')
+        self.users = users
+        self.password = BENCH_PASSWORD
+        self.pages = max(1, -(-cafes // ROWS_PER_PAGE))
+        self.next_number = cafes + 1
+        with app.app_context():
+            from app.main import db
+            from app.api.auth import generate_token
+            self.cafe_ids = list(db.session.scalars(db.select(Cafe.id)))
+            admin = User.query.filter_by(email=ADMIN_EMAIL).first()
+            self.admin_token = generate_token(admin.id)
+            self.user_token = generate_token(User.query.filter_by(is_admin=False).first().id)
+
+    def new_cafe(self):
+        from benchmarks.data import cafe_fields
+        self.next_number += 1
+        return cafe_fields(self.rng, self.next_number)
+
+
+def browse_all(ctx):
+    return ctx.client.get(f"/all?page={ctx.rng.randint(1, ctx.pages)}")
+
+
+def search(ctx):
+    return ctx.client.get('/search', query_string={'query': ctx.rng.choice(SEARCH_TERMS)})
+
+
+def api_login(ctx):
+    number = ctx.rng.randint(1, ctx.users)
+    return ctx.client.post('/api/login', json={'email': f"user{number}@bench.example.com", 'password': ctx.password})
+
+
+def api_list(ctx):
+    sort = ctx.rng.choice(['id', '-full_rating', 'city', 'seats'])
+    return ctx.client.get(f"/api/cafes?limit=50&sort={sort}", headers={'Authorization': f"Bearer {ctx.user_token}"})
+
+
+def api_get(ctx):
+    return ctx.client.get(f"/api/cafes/{ctx.rng.choice(ctx.cafe_ids)}",
+                          headers={'Authorization': f"Bearer {ctx.user_token}"})
+
+
+def api_add(ctx):
+    response = ctx.client.post('/api/cafes', json=ctx.new_cafe(),
+                               headers={'Authorization': f"Bearer {ctx.admin_token}"})
+    if response.status_code == 201:
+        ctx.cafe_ids.append(response.get_json()['cafe']['id'])
+    return response
+
+
+def update(ctx):
+    form = ctx.new_cafe()
+    form.update(wifi_strength=str(form['wifi_strength']), full_rating=str(form['full_rating']),
+                has_sockets=str(form['has_sockets']), has_toilet=str(form['has_toilet']))
+    del form['images']
+    return ctx.admin_client.post(f"/update/{ctx.rng.choice(ctx.cafe_ids)}", data=form)
+
+
+def delete(ctx):
+    cafe_id = ctx.cafe_ids.pop(ctx.rng.randrange(len(ctx.cafe_ids)))
+    return ctx.admin_client.post(f"/delete_cafe/{cafe_id}")
+
+
+# Name -> (scenario, status codes that count as success)
+SCENARIOS = {
+    'GET /all': (browse_all, {200}),
+    'GET /search?query=': (search, {200}),
+    'POST /api/login': (api_login, {200}),
+    'GET /api/cafes': (api_list, {200}),
+    'GET /api/cafes/<id>': (api_get, {200}),
+    'POST /api/cafes': (api_add, {201}),
+    'POST /update/<id>': (update, {302}),
+    'POST /delete_cafe/<id>': (delete, {302}),
+}
+
+
+def percentile(sorted_values, fraction):
+    """Returns the nearest-rank percentile of sorted values."""
+    index = max(0, min(len(sorted_values) - 1, round(fraction * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def peak_rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)   # Bytes on macOS, KiB elsewhere
+
+
+def run_scenario(ctx, scenario, ok_statuses, requests):
+    """Sends a scenario's requests one after another and summarizes their latencies."""
+    latencies = []
+    errors = 0
+    started = time.perf_counter()
+    for _ in range(requests):
+        request_started = time.perf_counter()
+        response = scenario(ctx)
+        latencies.append(time.perf_counter() - request_started)
+        response.close()
+        if response.status_code not in ok_statuses:
+            errors += 1
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        'requests': requests,
+        'errors': errors,
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 3),
+        'p95_ms': round(percentile(latencies, 0.95) * 1000, 3),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 3),
+        'throughput_rps': round(requests / elapsed, 1),
+    }
+
+
+def run_size(cafes, users, requests, seed):
+    """Seeds the database configured in the environment and runs every scenario against it."""
+    from app.main import create_app, db, limiter
+    from benchmarks.data import seed_database
+
+    app = create_app()
+    app.config.update(TESTING=True, WTF_CSRF_ENABLED=False)
+    limiter.enabled = False   # Measure the routes, not the rate limits
+
+    seed_started = time.perf_counter()
+    with app.app_context():
+        seed_database(cafes, users, seed)
+        db.session.remove()
+    seed_seconds = time.perf_counter() - seed_started
+
+    ctx = Context(app, cafes, users, seed)
+    for scenario, _ in SCENARIOS.values():   # Warm up lazily built state such as the search index
+        scenario(ctx).close()
+
+    results = {name: run_scenario(ctx, scenario, ok_statuses, requests)
+               for name, (scenario, ok_statuses) in SCENARIOS.items()}
+    return {'cafes': cafes, 'users': users, 'seed_seconds': round(seed_seconds, 2), 'peak_rss_mb': peak_rss_mb(),
+            'scenarios': results}
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000], help='Numbers of cafes.')
+    parser.add_argument('--users', type=int, default=100, help='Number of users.')
+    parser.add_argument('--requests', type=int, default=200, help='Requests per scenario.')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the data generator and request mix.')
+    parser.add_argument('--cache', default='null', help="CACHE_TYPE for the app; 'null' measures every request.")
+    parser.add_argument('--output', default='bench.json', help='JSON file to write the results to.')
+    parser.add_argument('--worker', type=int, help=argparse.SUPPRESS)   # Runs one size in this process
+    args = parser.parse_args()
+
+    if args.worker is not None:
+        json.dump(run_size(args.worker, args.users, args.requests, args.seed), sys.stdout)
+        return
+
+    runs = []
+    for size in args.sizes:
+        with tempfile.TemporaryDirectory() as directory:
+            env = {**os.environ, 'DATABASE_URI': f"sqlite:///{os.path.join(directory, 'bench.db')}",
+                   'CACHE_TYPE': args.cache, 'RATELIMIT_STORAGE_URI': 'memory://'}
+            command = [sys.executable, '-m', 'benchmarks.run', '--worker', str(size), '--users', str(args.users),
+                       '--requests', str(args.requests), '--seed', str(args.seed)]
+            print(f"Benchmarking {size} cafes...", file=sys.stderr)
+            output = subprocess.run(command, env=env, capture_output=True, text=True)
+            if output.returncode:
+                sys.exit(output.stderr)
+            run = json.loads(output.stdout)
+        runs.append(run)
+        for name, result in run['scenarios'].items():
+            print(f"  {name:<24} p50 {result['p50_ms']:>8.2f} ms  p95 {result['p95_ms']:>8.2f} ms  "
+                  f"p99 {result['p99_ms']:>8.2f} ms  {result['throughput_rps']:>8.1f} req/s  "
+                  f"{result['errors']} errors", file=sys.stderr)
+        print(f"  peak RSS {run['peak_rss_mb']} MB, seeded in {run['seed_seconds']} s", file=sys.stderr)
+
+    with open(args.output, 'w') as file:
+        json.dump({
+            'commit': git_commit(),
+            'created_at': datetime.utcnow().isoformat(timespec='seconds') + 'Z',
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'settings': {'users': args.users, 'requests': args.requests, 'seed': args.seed, 'cache': args.cache},
+            'runs': runs,
+        }, file, indent=2)
+    print(f"Results written to {args.output}", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,119 @@
+"""Measures rows/sec of the cafe listing's JSON: ORM objects with to_dict and jsonify, against column rows encoded
+by a RowEncoder.
+
+Both paths are timed from the query to the response body, and on serialization alone, and must produce the
+same bytes.
+"""
+from datetime import datetime
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+
+from benchmarks.run import git_commit
+
+SAMPLE_VARIANTS = {'assets/img_uploads/a.jpg': {'thumb': {'jpeg': 'assets/img_uploads/a_thumb.jpg',
+                                                          'webp': 'assets/img_uploads/a_thumb.webp'}}}
+
+
+def best_time(func, repeat):
+    """Returns the result and the fastest time of several calls."""
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return result, best
+
+
+def run_size(size, repeat):
+    """Times both paths on the first `size` cafes of the seeded database."""
+    from flask import jsonify
+    from app.main import db
+    from app.main.models import Cafe
+    from app.main.serialization import json_response
+    from app.api.routes import CAFE_COLUMNS, cafe_json
+
+    orm_query = Cafe.query.order_by(Cafe.id).limit(size)
+    column_query = db.select(*CAFE_COLUMNS).order_by(Cafe.id).limit(size)
+
+    def orm_path():
+        db.session.expunge_all()   # Every request builds its ORM objects anew
+        return jsonify(cafes=[cafe.to_dict() for cafe in orm_query.all()]).get_data()
+
+    def column_path():
+        rows = db.session.execute(column_query).all()
+        return json_response(f'{{"cafes":{cafe_json.encode_rows(rows)}}}').get_data()
+
+    orm_body, orm_seconds = best_time(orm_path, repeat)
+    column_body, column_seconds = best_time(column_path, repeat)
+    if orm_body != column_body:
+        raise RuntimeError(f"The two paths encoded {size} cafes differently.")
+
+    db.session.expunge_all()
+    cafes = orm_query.all()
+    rows = db.session.execute(column_query).all()
+    _, orm_encode_seconds = best_time(lambda: jsonify(cafes=[cafe.to_dict() for cafe in cafes]).get_data(), repeat)
+    _, column_encode_seconds = best_time(lambda: cafe_json.encode_rows(rows), repeat)
+
+    return {
+        'rows': size,
+        'bytes': len(orm_body),
+        'orm_rows_per_sec': round(size / orm_seconds),
+        'column_rows_per_sec': round(size / column_seconds),
+        'speedup': round(orm_seconds / column_seconds, 2),
+        'orm_encode_rows_per_sec': round(size / orm_encode_seconds),
+        'column_encode_rows_per_sec': round(size / column_encode_seconds),
+        'encode_speedup': round(orm_encode_seconds / column_encode_seconds, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000], help='Numbers of rows.')
+    parser.add_argument('--repeat', type=int, default=5, help='Runs per path; the fastest is reported.')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the data generator.')
+    parser.add_argument('--output', default='serialization.json', help='JSON file to write the results to.')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        os.environ.update({'DATABASE_URI': f"sqlite:///{os.path.join(directory, 'bench.db')}",
+                           'RATELIMIT_STORAGE_URI': 'memory://', 'METRICS_ENABLED': '0'})
+        from app.main import create_app, db
+        from app.main.models import Cafe
+        from benchmarks.data import seed_database
+
+        app = create_app()
+        with app.test_request_context():
+            print(f"Seeding {max(args.sizes)} cafes...", file=sys.stderr)
+            seed_database(max(args.sizes), 1, args.seed)
+            # Uploads give a cafe JSON image variants, which both paths must encode alike
+            db.session.execute(db.update(Cafe).where(Cafe.id == 1).values(image_variants=SAMPLE_VARIANTS))
+            db.session.commit()
+            results = []
+            for size in args.sizes:
+                result = run_size(size, args.repeat)
+                results.append(result)
+                print(f"  {size:>7} rows  to_dict + jsonify {result['orm_rows_per_sec']:>9} rows/s  "
+                      f"RowEncoder {result['column_rows_per_sec']:>9} rows/s  x{result['speedup']}  "
+                      f"(serialization only x{result['encode_speedup']})", file=sys.stderr)
+            db.session.remove()
+
+    with open(args.output, 'w') as file:
+        json.dump({
+            'commit': git_commit(),
+            'created_at': datetime.utcnow().isoformat(timespec='seconds') + 'Z',
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'settings': {'repeat': args.repeat, 'seed': args.seed},
+            'runs': results,
+        }, file, indent=2)
+    print(f"Results written to {args.output}", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
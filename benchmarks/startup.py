@@ -0,0 +1,126 @@
+"""Measures the cold start of a worker: the time to import the app, to run create_app and to answer the first API
+request, each in a new process, with the default settings and with the lean startup of serverless deployments
+(only the API blueprint, no database setup at startup).
+
+--max-ms makes the run fail if the lean start takes longer than that, so a change that puts a heavy import or
+a database round trip back on the startup path is caught.
+"""
+from datetime import datetime
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.run import git_commit
+
+# Configuration -> environment of its processes
+CONFIGURATIONS = {
+    'default': {},
+    'lean': {'BLUEPRINTS': 'api', 'SETUP_DATABASE': '0'},
+}
+PHASES = ['import_ms', 'create_app_ms', 'first_request_ms', 'total_ms']
+
+
+def measure(token):
+    """Starts the app in this process and prints the time of each phase as JSON."""
+    started = time.perf_counter()
+    from app.main import create_app
+    imported = time.perf_counter()
+    app = create_app()
+    created = time.perf_counter()
+    response = app.test_client().get('/api/cafes?limit=20', headers={'Authorization': f"Bearer {token}"})
+    answered = time.perf_counter()
+    if response.status_code != 200:
+        raise RuntimeError(f"The first request failed with {response.status_code}.")
+    print(json.dumps({
+        'import_ms': round((imported - started) * 1000, 1),
+        'create_app_ms': round((created - imported) * 1000, 1),
+        'first_request_ms': round((answered - created) * 1000, 1),
+        'total_ms': round((answered - started) * 1000, 1),
+        'modules': len(sys.modules),
+    }))
+
+
+def seed(cafes, seed_value):
+    """Seeds the database configured in the environment and returns an admin token."""
+    from app.main import create_app, db
+    from app.main.models import User
+    from app.api.auth import generate_token
+    from benchmarks.data import ADMIN_EMAIL, seed_database
+
+    app = create_app()
+    with app.app_context():
+        seed_database(cafes, 1, seed_value)
+        token = generate_token(User.query.filter_by(email=ADMIN_EMAIL).first().id)
+        db.session.remove()
+    return token
+
+
+def start_process(environment, token):
+    """Runs one cold start and returns its phases, with the wall time of the whole process."""
+    command = [sys.executable, '-m', 'benchmarks.startup', '--measure', token]
+    started = time.perf_counter()
+    output = subprocess.run(command, env={**os.environ, **environment}, capture_output=True, text=True)
+    elapsed = time.perf_counter() - started
+    if output.returncode:
+        sys.exit(output.stderr)
+    result = json.loads(output.stdout.strip().splitlines()[-1])
+    result['process_ms'] = round(elapsed * 1000, 1)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--cafes', type=int, default=1000, help='Number of cafes.')
+    parser.add_argument('--repeat', type=int, default=10, help='Cold starts per configuration; medians are reported.')
+    parser.add_argument('--max-ms', type=float, help='Fails if the median lean total_ms exceeds this.')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the data generator.')
+    parser.add_argument('--output', default='startup.json', help='JSON file to write the results to.')
+    parser.add_argument('--measure', metavar='TOKEN', help=argparse.SUPPRESS)   # Runs one cold start in this process
+    args = parser.parse_args()
+
+    if args.measure:
+        return measure(args.measure)
+
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        os.environ.update({'DATABASE_URI': f"sqlite:///{os.path.join(directory, 'bench.db')}",
+                           'RATELIMIT_STORAGE_URI': 'memory://', 'HASH_WORKERS': '0',
+                           'TEMPLATE_BYTECODE_DIR': os.path.join(directory, 'templates')})
+        print(f"Seeding {args.cafes} cafes...", file=sys.stderr)
+        token = seed(args.cafes, args.seed)
+
+        for configuration, environment in CONFIGURATIONS.items():
+            start_process(environment, token)   # Warm up the OS file cache and the .pyc files
+            starts = [start_process(environment, token) for _ in range(args.repeat)]
+            result = {phase: round(statistics.median(start[phase] for start in starts), 1)
+                      for phase in PHASES + ['process_ms']}
+            result['modules'] = starts[-1]['modules']
+            results[configuration] = result
+            print(f"  {configuration:<8} import {result['import_ms']:>7.1f} ms  create_app "
+                  f"{result['create_app_ms']:>6.1f} ms  first request {result['first_request_ms']:>6.1f} ms  "
+                  f"total {result['total_ms']:>7.1f} ms  process {result['process_ms']:>7.1f} ms  "
+                  f"{result['modules']} modules", file=sys.stderr)
+
+    with open(args.output, 'w') as file:
+        json.dump({
+            'commit': git_commit(),
+            'created_at': datetime.utcnow().isoformat(timespec='seconds') + 'Z',
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'settings': {'cafes': args.cafes, 'repeat': args.repeat, 'seed': args.seed},
+            'configurations': results,
+        }, file, indent=2)
+    print(f"Results written to {args.output}", file=sys.stderr)
+
+    if args.max_ms is not None and results['lean']['total_ms'] > args.max_ms:
+        sys.exit(f"The lean start took {results['lean']['total_ms']} ms, over the budget of {args.max_ms} ms.")
+
+
+if __name__ == '__main__':
+    main()
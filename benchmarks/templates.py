@@ -0,0 +1,141 @@
+"""Measures the template render time of the home page, the cafe listing and search, with and without the
+{% cache %} fragments of app/main/fragments.py, and the first request of a new worker with an empty and a filled
+template bytecode directory.
+
+Each configuration runs in its own process on one seeded database. Requests carry a unique query argument, so
+that every one of them renders its template instead of being served from the response cache.
+"""
+from datetime import datetime
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.run import git_commit
+
+ROUTES = {'home': '/', 'all': '/all', 'search': '/search?query=paris'}
+
+# Configuration -> environment of its process
+CONFIGURATIONS = {
+    'fragments_off': {'FRAGMENT_CACHE_ENABLED': '0'},
+    'fragments_on': {'FRAGMENT_CACHE_ENABLED': '1'},
+}
+
+
+def with_arg(path, name, value):
+    return f"{path}{'&' if '?' in path else '?'}{name}={value}"
+
+
+def measure(requests, pages):
+    """Times the routes in this process and prints the results as JSON.
+
+    The first request of each route is timed whole, as it loads or compiles the template; the others report
+    the median time spent rendering it.
+    """
+    from flask import before_render_template, template_rendered, g
+    from app.main import create_app, limiter
+
+    app = create_app()
+    limiter.enabled = False
+    timings = []
+
+    def started(sender, **extra):
+        g.render_started = time.perf_counter()
+
+    def rendered(sender, **extra):
+        timings.append(time.perf_counter() - g.render_started)
+
+    before_render_template.connect(started, app)
+    template_rendered.connect(rendered, app)
+    client = app.test_client()
+
+    results = {}
+    for name, path in ROUTES.items():
+        started_at = time.perf_counter()
+        client.get(with_arg(path, 'first', 1))
+        first_request = time.perf_counter() - started_at
+
+        timings.clear()
+        for number in range(requests):
+            page_path = with_arg(path, 'page', number % pages + 1) if name == 'all' else path
+            if client.get(with_arg(page_path, 'x', number)).status_code != 200:
+                raise RuntimeError(f"{path} failed.")
+        results[name] = {'first_request_ms': round(first_request * 1000, 3),
+                         'render_p50_ms': round(statistics.median(timings) * 1000, 3)}
+    print(json.dumps(results))
+
+
+def run_process(environment, requests, pages):
+    command = [sys.executable, '-m', 'benchmarks.templates', '--measure', '--requests', str(requests),
+               '--pages', str(pages)]
+    output = subprocess.run(command, env={**os.environ, **environment}, check=True, capture_output=True, text=True)
+    return json.loads(output.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--cafes', type=int, default=10000, help='Number of cafes.')
+    parser.add_argument('--requests', type=int, default=500, help='Requests per route.')
+    parser.add_argument('--pages', type=int, default=20, help='Pages of the listing the requests spread over.')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the data generator.')
+    parser.add_argument('--output', default='templates.json', help='JSON file to write the results to.')
+    parser.add_argument('--measure', action='store_true', help=argparse.SUPPRESS)   # Times the routes in this process
+    args = parser.parse_args()
+
+    if args.measure:
+        return measure(args.requests, args.pages)
+
+    with tempfile.TemporaryDirectory() as directory:
+        os.environ.update({'DATABASE_URI': f"sqlite:///{os.path.join(directory, 'bench.db')}", 'CACHE_TYPE': 'memory',
+                           'RATELIMIT_STORAGE_URI': 'memory://', 'METRICS_ENABLED': '0', 'HASH_WORKERS': '0',
+                           'TEMPLATE_BYTECODE_DIR': os.path.join(directory, 'templates')})
+        from app.main import create_app, db
+        from benchmarks.data import seed_database
+
+        print(f"Seeding {args.cafes} cafes...", file=sys.stderr)
+        app = create_app()
+        with app.app_context():
+            seed_database(args.cafes, 1, args.seed)
+            db.session.remove()
+
+        # The bytecode directory is empty for the first process only
+        runs = {'bytecode_empty': run_process({}, 1, 1)}
+        runs['bytecode_filled'] = run_process({}, 1, 1)
+        for configuration, environment in CONFIGURATIONS.items():
+            runs[configuration] = run_process(environment, args.requests, args.pages)
+
+    results = []
+    for name, path in ROUTES.items():
+        off, on = runs['fragments_off'][name]['render_p50_ms'], runs['fragments_on'][name]['render_p50_ms']
+        result = {
+            'route': path,
+            'render_p50_ms': off,
+            'fragments_render_p50_ms': on,
+            'speedup': round(off / on, 2),
+            'first_request_ms': runs['bytecode_empty'][name]['first_request_ms'],
+            'bytecode_first_request_ms': runs['bytecode_filled'][name]['first_request_ms'],
+        }
+        results.append(result)
+        print(f"  {path:<20} render {off:>7.3f} ms  with fragments {on:>7.3f} ms  x{result['speedup']}  "
+              f"first request {result['first_request_ms']:>8.2f} ms  with bytecode "
+              f"{result['bytecode_first_request_ms']:>8.2f} ms", file=sys.stderr)
+
+    with open(args.output, 'w') as file:
+        json.dump({
+            'commit': git_commit(),
+            'created_at': datetime.utcnow().isoformat(timespec='seconds') + 'Z',
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'settings': {'cafes': args.cafes, 'requests': args.requests, 'pages': args.pages, 'seed': args.seed},
+            'routes': results,
+        }, file, indent=2)
+    print(f"Results written to {args.output}", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
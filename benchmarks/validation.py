@@ -0,0 +1,110 @@
+"""Measures records/sec of validating cafe records: a CafeSchema built per record, as the API did per request,
+CafeSchema(many=True) as bulk loads did, and load_cafes with the compiled rules of app/main/validation.py.
+
+Records are synthetic cafes, typed as JSON (numbers and booleans) or as CSV (strings only), with a share of
+them invalid. All paths must load the same data.
+"""
+from datetime import datetime
+import argparse
+import json
+import platform
+import random
+import sys
+import time
+
+from marshmallow import ValidationError
+from benchmarks.data import cafe_fields
+from benchmarks.run import git_commit
+
+# Changes that make a record invalid
+BREAKERS = [('country', 'Atlantis'), ('currency', 'GBP'), ('full_rating', 9), ('seats', -1), ('map_url', 'not a url')]
+
+
+def make_records(count, invalid, csv_typed, seed):
+    """Returns synthetic cafe records, `invalid` of them (a fraction) with one bad field."""
+    rng = random.Random(seed)
+    records = []
+    for number in range(count):
+        record = cafe_fields(rng, number)
+        if rng.random() < invalid:
+            field, value = rng.choice(BREAKERS)
+            record[field] = value
+        if csv_typed:
+            record = {field: str(value) for field, value in record.items()}
+        records.append(record)
+    return records
+
+
+def per_record(records):
+    """The former per-request cost: a new schema for every record."""
+    from app.api.schemas import CafeSchema
+    loaded = []
+    for record in records:
+        try:
+            loaded.append(CafeSchema().load(record))
+        except ValidationError:
+            loaded.append(None)
+    return loaded
+
+
+def schema_many(records):
+    from app.api.schemas import CafeSchema
+    try:
+        return CafeSchema(many=True).load(records)
+    except ValidationError as err:
+        return [None if index in err.messages else data for index, data in enumerate(err.valid_data)]
+
+
+def batch(records):
+    from app.api.schemas import load_cafes
+    return load_cafes(records)[0]
+
+
+PATHS = {'per_record_schema': per_record, 'schema_many': schema_many, 'load_cafes': batch}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--records', type=int, default=10000, help='Records per run.')
+    parser.add_argument('--invalid', type=float, default=0.05, help='Fraction of invalid records.')
+    parser.add_argument('--repeat', type=int, default=5, help='Runs per path; the fastest is reported.')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the data generator.')
+    parser.add_argument('--output', default='validation.json', help='JSON file to write the results to.')
+    args = parser.parse_args()
+
+    results = []
+    for kind in ('json', 'csv'):
+        records = make_records(args.records, args.invalid, kind == 'csv', args.seed)
+        result = {'kind': kind, 'records': args.records}
+        expected = None
+        for name, path in PATHS.items():
+            best = None
+            for _ in range(args.repeat):
+                started = time.perf_counter()
+                loaded = path(records)
+                elapsed = time.perf_counter() - started
+                best = elapsed if best is None else min(best, elapsed)
+            if expected is None:
+                expected = loaded
+            elif loaded != expected:
+                raise RuntimeError(f"{name} loaded different data from {kind} records.")
+            result[f"{name}_records_per_sec"] = round(args.records / best)
+        result['speedup'] = round(result['load_cafes_records_per_sec'] / result['per_record_schema_records_per_sec'], 2)
+        results.append(result)
+        print(f"  {kind:>4} records  " + '  '.join(f"{name} {result[f'{name}_records_per_sec']:>7}/s" for name in PATHS)
+              + f"  x{result['speedup']}", file=sys.stderr)
+
+    with open(args.output, 'w') as file:
+        json.dump({
+            'commit': git_commit(),
+            'created_at': datetime.utcnow().isoformat(timespec='seconds') + 'Z',
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'settings': {'invalid': args.invalid, 'repeat': args.repeat, 'seed': args.seed},
+            'runs': results,
+        }, file, indent=2)
+    print(f"Results written to {args.output}", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -9,3 +9,75 @@ class Config:
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URI') or 'sqlite:///cc-database.db'
 
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+
+    # Engine profile: 'sqlite' sets WAL and the pragmas below on every connection, 'server' sets the connection pool
+    # options for PostgreSQL/MySQL. Defaults to the profile matching the database URI.
+    DATABASE_PROFILE = os.environ.get('DATABASE_PROFILE') or \
+        ('sqlite' if SQLALCHEMY_DATABASE_URI.startswith('sqlite') else 'server')
+    SQLITE_BUSY_TIMEOUT_MS = int(os.environ.get('SQLITE_BUSY_TIMEOUT_MS', 5000))
+    SQLITE_SYNCHRONOUS = os.environ.get('SQLITE_SYNCHRONOUS') or 'NORMAL'
+    SQLITE_MMAP_SIZE = int(os.environ.get('SQLITE_MMAP_SIZE', 256 * 1024 * 1024))
+    DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 5))
+    DB_MAX_OVERFLOW = int(os.environ.get('DB_MAX_OVERFLOW', 10))
+    DB_POOL_RECYCLE = int(os.environ.get('DB_POOL_RECYCLE', 1800))
+    DB_POOL_PRE_PING = os.environ.get('DB_POOL_PRE_PING', '1').lower() not in ('0', 'false', 'no')
+
+    # Optional read replica. SELECTs made while handling GET requests are sent to it; everything else uses the primary,
+    # and so does the rest of a request once it has written.
+    READ_DATABASE_URI = os.environ.get('READ_DATABASE_URI')
+
+    # Response cache: 'memory' (per process), 'file' (shared by the workers on one host) or 'null'. CACHE_DIR
+    # defaults to a directory of the temp folder private to the user running the app.
+    CACHE_TYPE = os.environ.get('CACHE_TYPE') or 'memory'
+    CACHE_DIR = os.environ.get('CACHE_DIR')
+    CACHE_DEFAULT_TIMEOUT = int(os.environ.get('CACHE_DEFAULT_TIMEOUT', 300))
+    CACHE_MAX_ENTRIES = int(os.environ.get('CACHE_MAX_ENTRIES', 500))
+
+    # Template fragments ({% cache %} blocks) kept in the response cache until the catalog changes, for
+    # FRAGMENT_CACHE_TIMEOUT seconds (0 uses CACHE_DEFAULT_TIMEOUT)
+    FRAGMENT_CACHE_ENABLED = os.environ.get('FRAGMENT_CACHE_ENABLED', '1').lower() not in ('0', 'false', 'no')
+    FRAGMENT_CACHE_TIMEOUT = int(os.environ.get('FRAGMENT_CACHE_TIMEOUT', 0))
+
+    # Compiled templates, shared by the workers on one host and kept across restarts. Unset uses Jinja's directory
+    # of the temp folder private to the app's user; empty turns it off.
+    TEMPLATE_BYTECODE_DIR = os.environ.get('TEMPLATE_BYTECODE_DIR')
+
+    # Rate limit counters: 'sqlite:///<path>' is shared by the workers on one host, 'memory://' is per process.
+    # Unset uses a file in a directory of the temp folder private to the app's user.
+    RATELIMIT_STORAGE_URI = os.environ.get('RATELIMIT_STORAGE_URI')
+
+    # Metrics: per-process Prometheus metrics on /metrics, off unless enabled, and a warning log with the SQL of every
+    # request slower than SLOW_REQUEST_MS (0 turns the log off). /metrics answers logged-in admins and requests with
+    # an 'Authorization: Bearer <METRICS_TOKEN>' header.
+    METRICS_ENABLED = os.environ.get('METRICS_ENABLED', '0').lower() not in ('0', 'false', 'no')
+    METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+    SLOW_REQUEST_MS = int(os.environ.get('SLOW_REQUEST_MS', 0))
+
+    # Uploads: maximum request size and the number of threads generating image variants
+    MAX_CONTENT_LENGTH = int(os.environ.get('MAX_UPLOAD_MB', 16)) * 1024 * 1024
+    IMAGE_WORKERS = int(os.environ.get('IMAGE_WORKERS', 2))
+
+    # API authentication: cached verified tokens/principals, and how long a principal is trusted before re-reading it
+    AUTH_CACHE_SIZE = int(os.environ.get('AUTH_CACHE_SIZE', 1000))
+    AUTH_PRINCIPAL_TTL = int(os.environ.get('AUTH_PRINCIPAL_TTL', 60))
+
+    # Passwords: Werkzeug hash method/cost (e.g. 'scrypt:32768:8:1' or 'pbkdf2:sha256:600000', parameters left out
+    # take Werkzeug's defaults), hashing processes (0 hashes on the request thread) and how many hashes may be
+    # queued before logins get a 503
+    PASSWORD_HASH_METHOD = os.environ.get('PASSWORD_HASH_METHOD') or 'scrypt'
+    HASH_WORKERS = int(os.environ.get('HASH_WORKERS', 2))
+    HASH_QUEUE_SIZE = int(os.environ.get('HASH_QUEUE_SIZE', 16))
+
+    # Static files: where 'flask assets build' writes the hashed and compressed files. Defaults to
+    # app/main/static_build; until a build exists, the static folder is served as is.
+    STATIC_BUILD_DIR = os.environ.get('STATIC_BUILD_DIR')
+
+    # Apply pending schema migrations at startup. Turn off to run 'flask db upgrade' as a deploy step instead.
+    AUTO_MIGRATE = os.environ.get('AUTO_MIGRATE', '1').lower() not in ('0', 'false', 'no')
+
+    # Create the tables of a new database at startup. Turn off to keep startup away from the database, e.g. on
+    # serverless cold starts, and run 'flask db init' as a deploy step instead.
+    SETUP_DATABASE = os.environ.get('SETUP_DATABASE', '1').lower() not in ('0', 'false', 'no')
+
+    # Blueprints to serve: 'main' (the website) and 'api'. 'api' alone skips loading the website's forms and views.
+    BLUEPRINTS = {name.strip() for name in os.environ.get('BLUEPRINTS', 'main,api').split(',') if name.strip()}